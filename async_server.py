@@ -0,0 +1,118 @@
+import asyncio
+import logging
+from time import perf_counter
+from config import SRVR_HOST, PORT, LISTEN_BACKLOG
+from framing import read_frame_async, split_request_id, FrameError, HEADER, OP_HELLO, OP_COMMAND, OP_RESPONSE, FLAG_REQUEST_ID
+from protocol import parse_command, parse_hello, negotiate, dispatch_command, end_session
+from vcs_core import vcs
+from pubsub import AsyncSubscriber
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Commands run in the default thread pool executor, so a slow one never
+# stalls the event loop (and every other session on it). Almost any command
+# may block: the user's branch may have to be loaded back from the
+# BranchStore on disk first (and another branch spilled to make room), the
+# registry and branch locks may be held by a thread doing just that, COMMIT
+# and BATCH wait for the log, SHOW may write out a new version of the official
+# file, GREP may wait for the search index, and MERGE and DIFF are heavy on
+# large files. Only replies that need no lock are made on the loop itself.
+LOOP_COMMANDS = (None,) # An unknown or malformed command: the usual error reply
+
+async def handle_async_client(reader, writer):
+    """
+    asyncio counterpart of server.handle_client_connection: one coroutine per
+    client instead of one thread, running the same protocol command table.
+    Broadcast notices are written by the connection's writer task (see
+    pubsub.AsyncSubscriber).
+    """
+    loop = asyncio.get_running_loop()
+    client_address = writer.get_extra_info("peername")
+    subscriber = None
+    username = "Unknown"
+    metrics.connection_opened()
+
+    try:
+        # 1. Handshake: Receive the Username and capabilities
+        hello = await read_frame_async(reader)
+        if hello is None:
+            return
+        opcode, _, body = hello
+        if opcode != OP_HELLO:
+            raise FrameError(f"Expected HELLO frame, got opcode {opcode}.")
+        username, offered = parse_hello(body)
+        if not vcs.is_open:
+            # Wait for the store off the event loop, so other connections keep being served
+            await loop.run_in_executor(None, vcs.get)
+
+        subscriber = AsyncSubscriber(loop, writer, username).start()
+        branch_name = await loop.run_in_executor(None, vcs.register_user, username, subscriber) # Takes the registry lock
+        welcome_msg = f"Welcome {username}! You are currently on branch '{branch_name}'. Type HELP for commands."
+        if offered is not None:
+            accepted, subscriber.encoding = negotiate(offered)
+            welcome_msg = f"CAPS:{','.join(accepted)}\n{welcome_msg}"
+        await subscriber.send(OP_RESPONSE, welcome_msg)
+
+        # 2. Main Communication Loop
+        while True:
+            frame = await read_frame_async(reader)
+            if frame is None:
+                break
+
+            opcode, flags, body = frame
+            if opcode != OP_COMMAND:
+                await subscriber.send(OP_RESPONSE, f"[ERROR] Unexpected frame type {opcode}.")
+                continue
+            request_id = None
+            if flags & FLAG_REQUEST_ID:
+                request_id, body = split_request_id(body)
+
+            name, argument = parse_command(body)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("[%s] Command received: %s...", username, bytes(body[:40]).decode(errors="replace").partition("\n")[0])
+            started = perf_counter()
+            try:
+                if name in LOOP_COMMANDS:
+                    response = dispatch_command(username, name, argument)
+                else:
+                    response = await loop.run_in_executor(None, dispatch_command, username, name, argument)
+            except Exception as e:
+                response = f"[ERROR] Command processing failed: {e}"
+                logger.error("[ERROR] while handling command from %s: %s", username, e)
+            elapsed = perf_counter() - started
+
+            sent = await subscriber.send(OP_RESPONSE, response, request_id)
+            metrics.observe_command(name or "OTHER", elapsed, HEADER.size + len(body), sent)
+
+    except (ConnectionError, FrameError) as e:
+        logger.error("[ERROR] Connection with %s (%s) failed: %s", username, client_address, e)
+
+    finally:
+        # 3. Connection Cleanup
+        metrics.connection_closed()
+        if subscriber is not None:
+            vcs.unregister_client(subscriber)
+            subscriber.close()
+        end_session(username)
+        writer.close()
+
+async def _serve(host, port):
+    server = await asyncio.start_server(handle_async_client, host, port,
+                                        backlog=LISTEN_BACKLOG, reuse_address=True)
+    print(f"--- 🚀 Distributed VCS Server (asyncio) Running on {host}:{port} ---")
+    print("Waiting for client connections...")
+    async with server:
+        await server.serve_forever()
+
+def start_async_vcs_server(host=SRVR_HOST, port=PORT):
+    """
+    Entry point for the asyncio server mode. All sessions share one event loop,
+    so thousands of mostly idle clients cost a coroutine each rather than a thread.
+    """
+    try:
+        asyncio.run(_serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.critical("[FATAL ERROR] Server failed to start: %s", e)
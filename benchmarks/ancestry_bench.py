@@ -0,0 +1,116 @@
+"""
+Merge-base and is-ancestor latency on a large revision DAG, compared with a full
+ancestor walk.
+
+The graph is a mainline with feature branches forking off it; most are merged
+back, the newest ones are still open.
+
+    python -m benchmarks.ancestry_bench --revisions 100000 --output ancestry.json
+"""
+import argparse
+import random
+import time
+
+from commit_graph import CommitGraph
+from benchmarks.common import latency_summary, write_results
+
+
+def build_graph(args, rng):
+    graph = CommitGraph()
+    mainline = [graph.add("root", timestamp=0)]
+    open_features, merged_features = [], []
+    count = 1
+    while count < args.revisions:
+        # 1. A run of mainline edits
+        for _ in range(rng.randint(1, args.feature_every)):
+            mainline.append(graph.add(f"m{count}", (mainline[-1],), timestamp=count))
+            count += 1
+
+        # 2. A feature branch forked from a recent mainline revision
+        head = rng.choice(mainline[-args.fork_window:])
+        for _ in range(rng.randint(1, args.feature_length)):
+            head = graph.add(f"f{count}", (head,), timestamp=count)
+            count += 1
+        open_features.append(head)
+
+        # 3. Older features get merged back into the mainline
+        if len(open_features) > args.open_features:
+            feature = open_features.pop(0)
+            mainline.append(graph.add(f"merge{count}", (mainline[-1], feature), timestamp=count))
+            merged_features.append(feature)
+            count += 1
+    return graph, mainline, open_features, merged_features
+
+
+def full_walk_merge_base(graph, first, second):
+    """Reference implementation: every ancestor of `first`, then a walk over `second`."""
+    seen, stack = {first}, [first]
+    while stack:
+        for parent in graph.parents(stack.pop()):
+            if parent not in seen:
+                seen.add(parent)
+                stack.append(parent)
+    best, stack, visited = None, [second], {second}
+    while stack:
+        revision_id = stack.pop()
+        if revision_id in seen:
+            if best is None or graph.generation(revision_id) > graph.generation(best):
+                best = revision_id
+            continue
+        for parent in graph.parents(revision_id):
+            if parent not in visited:
+                visited.add(parent)
+                stack.append(parent)
+    return best
+
+
+def timed_queries(queries, fn):
+    samples = []
+    for first, second in queries:
+        t0 = time.perf_counter()
+        fn(first, second)
+        samples.append(time.perf_counter() - t0)
+    return latency_summary(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--revisions", type=int, default=100000)
+    parser.add_argument("--feature-every", type=int, default=20, help="Max mainline edits between forks")
+    parser.add_argument("--feature-length", type=int, default=30, help="Max edits per feature branch")
+    parser.add_argument("--fork-window", type=int, default=50, help="Forks start from the last N mainline revisions")
+    parser.add_argument("--open-features", type=int, default=20, help="Features left unmerged at any time")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--baseline-queries", type=int, default=20, help="Queries run with the full walk")
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    graph, mainline, open_features, merged_features = build_graph(args, rng)
+    build_seconds = time.perf_counter() - started
+
+    head = mainline[-1]
+    merge_base_queries = [(head, rng.choice(open_features)) for _ in range(args.queries)]
+    feature_pairs = [tuple(rng.sample(open_features, 2)) for _ in range(args.queries)]
+    deep_ancestor_queries = [(rng.choice(mainline), head) for _ in range(args.queries)]
+    merged_queries = [(rng.choice(merged_features), head) for _ in range(args.queries)]
+    negative_queries = [(rng.choice(open_features), head) for _ in range(args.queries)]
+
+    results = {
+        "revisions": len(graph),
+        "build_seconds": build_seconds,
+        "merge_base_mainline_vs_feature": timed_queries(merge_base_queries, graph.merge_base),
+        "merge_base_feature_vs_feature": timed_queries(feature_pairs, graph.merge_base),
+        "is_ancestor_mainline_revision": timed_queries(deep_ancestor_queries, graph.is_ancestor),
+        "is_ancestor_merged_feature": timed_queries(merged_queries, graph.is_ancestor),
+        "is_ancestor_open_feature": timed_queries(negative_queries, graph.is_ancestor),
+        "merge_base_full_walk": timed_queries(merge_base_queries[:args.baseline_queries],
+                                              lambda a, b: full_walk_merge_base(graph, a, b)),
+    }
+    write_results(args.output, "ancestry", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
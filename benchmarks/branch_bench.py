@@ -0,0 +1,94 @@
+"""
+Memory held for branches as their number grows, with the branch cache on
+(--cache-entries branches in memory, the rest spilled to disk) and off.
+
+Each run creates --branches branches with --edits edits each in a fresh
+process, then reports the RSS growth, how many branches stayed in memory,
+the size of the spill directory and CHECKOUT latency for a branch that is
+still in memory versus one that has to be loaded back from disk.
+Edits add revisions to the shared commit graph and object store, which stay
+in memory with or without the cache, so --edits 0 isolates the branches.
+
+    python -m benchmarks.branch_bench --branches 50000 --edits 0 --cache-entries 1024 --output branches.json
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.common import latency_summary, rss_bytes, write_results
+
+
+def directory_bytes(path):
+    with os.scandir(path) as entries:
+        return sum(entry.stat().st_size for entry in entries)
+
+
+def run(args, cache_entries, results):
+    os.chdir(tempfile.mkdtemp(prefix="vcs-branches-")) # The VCS keeps its data files in the cwd
+    with contextlib.redirect_stdout(io.StringIO()):
+        from vcs_core import VersionControlSystem
+        vcs = VersionControlSystem(branch_cache_entries=cache_entries)
+    user = "bench"
+    vcs.register_user(user, None)
+    rss_start = rss_bytes()
+    started = time.perf_counter()
+    for i in range(args.branches):
+        vcs.switch_branch(user, "master")
+        vcs.create_branch(user, f"b{i}")
+        vcs.switch_branch(user, f"b{i}")
+        for n in range(args.edits):
+            vcs.edit(user, f"branch {i} edit {n}\n")
+    created = time.perf_counter() - started
+    rss_end = rss_bytes()
+
+    # Recently used branches are in memory; the oldest ones are spilled (if the cache is on)
+    hot = [f"b{args.branches - 1 - i % 100}" for i in range(args.checkouts)]
+    cold = [f"b{i}" for i in range(args.checkouts)]
+    def checkouts(names):
+        samples = []
+        for name in names:
+            t0 = time.perf_counter()
+            vcs.switch_branch(user, name)
+            samples.append(time.perf_counter() - t0)
+        return latency_summary(samples)
+    hot_latency = checkouts(hot)
+    cold_latency = checkouts(cold)
+    results.put({
+        "create_seconds": created,
+        "rss_growth_bytes": rss_end - rss_start,
+        "branches_in_memory": len(vcs.branch_registry),
+        "branches_spilled": len(vcs.branch_store),
+        "spill_directory_bytes": directory_bytes(vcs.branch_store.directory),
+        "checkout_in_memory": hot_latency,
+        "checkout_spilled": cold_latency,
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--branches", type=int, default=50000)
+    parser.add_argument("--edits", type=int, default=0, help="Edits made on each branch")
+    parser.add_argument("--cache-entries", type=int, default=1024, help="Branches kept in memory with the cache on")
+    parser.add_argument("--checkouts", type=int, default=500, help="Checkouts timed per kind")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = {}
+    # Each configuration runs in its own process, so RSS growth is not shared between them
+    for label, cache_entries in (("cache", args.cache_entries), ("no_cache", args.branches + 1)):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run, args=(args, cache_entries, queue))
+        process.start()
+        results[label] = queue.get()
+        process.join()
+    write_results(args.output, "branches", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Commit latency with many subscribed clients, some of which never read.
+
+Starts `server.py --mode <mode>` in a subprocess, connects --subscribers
+sessions (--stalled of them stop reading right after the handshake and use a
+tiny receive buffer), then one session runs EDIT + COMMIT --commits times
+at --rate commits per second.
+Reports the COMMIT round trip, how long each commit notice took to reach the
+healthy subscribers, and which stalled clients the server evicted.
+
+The kernel buffers a few MB for each stalled socket before the server's
+writer blocks, so stalled clients are only evicted once that much has been
+sent to them; --message-bytes pads the commit messages to get there sooner.
+
+    python -m benchmarks.broadcast_bench --subscribers 1000 --stalled 50 --output broadcast.json
+"""
+import argparse
+import asyncio
+import multiprocessing
+import socket
+import tempfile
+import time
+
+from framing import read_frame_async, send_frame, recv_frame, OP_HELLO, OP_COMMAND, OP_RESPONSE, OP_NOTIFY
+from benchmarks.common import latency_summary, write_results
+from benchmarks.server_load import free_port, start_server, open_session, process_status
+
+STALLED_RCVBUF = 4096
+
+
+def open_stalled_session(port, username):
+    """Blocking session that completes the handshake and then never reads again."""
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, STALLED_RCVBUF)
+    sock.connect(("127.0.0.1", port))
+    send_frame(sock, OP_HELLO, username)
+    recv_frame(sock) # Welcome message
+    return sock
+
+
+def was_evicted(sock):
+    """True if the server has closed a stalled session (reads what is buffered until EOF)."""
+    sock.setblocking(False)
+    try:
+        while sock.recv(1 << 16):
+            pass
+        return True
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+    finally:
+        sock.close()
+
+
+async def subscriber(port, index, expected, arrivals, deadline):
+    """Records (commit_id, arrival time) for every commit notice until all have arrived."""
+    reader, writer = await open_session(port, f"sub{index}")
+    received = 0
+    try:
+        while received < expected:
+            frame = await asyncio.wait_for(read_frame_async(reader), max(0.01, deadline - time.perf_counter()))
+            if frame is None:
+                break
+            opcode, _, body = frame
+            if opcode == OP_NOTIFY and body.startswith(b"[COMMIT]"):
+                arrivals.append((bytes(body).split()[4].decode(), time.perf_counter()))
+                received += 1
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        writer.close()
+    return received
+
+
+def request(sock, command):
+    """Sends a command and returns its reply, skipping the notices in between."""
+    send_frame(sock, OP_COMMAND, command)
+    while True:
+        opcode, _, body = recv_frame(sock)
+        if opcode == OP_RESPONSE:
+            return body.decode()
+
+
+def committer(port, commits, rate, message_bytes, results):
+    """
+    Runs in its own process, so the commit round trip is not skewed by this
+    process being busy reading notices for hundreds of subscribers.
+    Sends back (commit latencies, { commit_id: start time }).
+    """
+    sock = socket.create_connection(("127.0.0.1", port))
+    send_frame(sock, OP_HELLO, "committer")
+    recv_frame(sock) # Welcome message
+    samples, started_at = [], {}
+    padding = "x" * message_bytes
+    first = time.perf_counter()
+    for i in range(commits):
+        if rate:
+            time.sleep(max(0.0, first + i / rate - time.perf_counter()))
+        request(sock, f"EDIT:revision {i}")
+        t0 = time.perf_counter()
+        response = request(sock, f"COMMIT:bench {i} {padding}")
+        samples.append(time.perf_counter() - t0)
+        started_at[response.split()[1]] = t0
+    sock.close()
+    results.put((samples, started_at))
+
+
+async def run_broadcast(port, args, pid):
+    healthy = args.subscribers - args.stalled
+    loop = asyncio.get_running_loop()
+
+    # 1. Stalled sessions first, then the healthy ones (in batches, to spare the accept backlog)
+    stalled = [await loop.run_in_executor(None, open_stalled_session, port, f"stalled{i}")
+               for i in range(args.stalled)]
+    arrivals = []
+    deadline = time.perf_counter() + args.timeout
+    tasks = []
+    for first in range(0, healthy, 200):
+        batch = [asyncio.ensure_future(subscriber(port, i, args.commits, arrivals, deadline))
+                 for i in range(first, min(healthy, first + 200))]
+        tasks.extend(batch)
+        await asyncio.sleep(0.2)
+    await asyncio.sleep(0.5) # Let every handshake finish before the first commit
+    status_connected = process_status(pid)
+
+    # 2. Commit from another process while everyone listens
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=committer, args=(port, args.commits, args.rate, args.message_bytes, results))
+    started = time.perf_counter()
+    process.start()
+    received = await asyncio.gather(*tasks)
+    samples, started_at = await loop.run_in_executor(None, results.get)
+    commit_seconds = time.perf_counter() - started
+    process.join()
+    status_after = process_status(pid)
+
+    delivery = [arrived - started_at[commit_id] for commit_id, arrived in arrivals if commit_id in started_at]
+    evicted = sum(await asyncio.gather(*(loop.run_in_executor(None, was_evicted, sock) for sock in stalled)))
+    return {
+        "healthy_subscribers": healthy,
+        "stalled_subscribers": args.stalled,
+        "commit_throughput_per_s": args.commits / commit_seconds,
+        "commit_latency": latency_summary(samples),
+        "notice_delivery": latency_summary(delivery),
+        "notices_missing": healthy * args.commits - sum(received),
+        "stalled_evicted": evicted,
+        "server_connected": status_connected,
+        "server_after_commits": status_after,
+    }
+
+
+def bench_mode(mode, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        proc = start_server(mode, port, workdir)
+        try:
+            return asyncio.run(run_broadcast(port, args, proc.pid))
+        finally:
+            proc.kill()
+            proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("thread", "asyncio", "both"), default="both")
+    parser.add_argument("--subscribers", type=int, default=1000, help="Connected sessions, stalled ones included")
+    parser.add_argument("--stalled", type=int, default=50, help="Sessions that never read their notices")
+    parser.add_argument("--commits", type=int, default=300)
+    parser.add_argument("--rate", type=float, default=10.0, help="Commits per second (0: back-to-back)")
+    parser.add_argument("--message-bytes", type=int, default=0, help="Padding added to every commit message")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Give up waiting for notices after this long")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    from server import raise_open_file_limit
+    raise_open_file_limit()
+
+    modes = ("thread", "asyncio") if args.mode == "both" else (args.mode,)
+    results = {mode: bench_mode(mode, args) for mode in modes}
+    write_results(args.output, "broadcast", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import json
+import os
+import platform
+import time
+
+
+def percentile(samples, pct):
+    """Returns the pct-th percentile (0-100) of a list of numbers (nearest-rank)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def latency_summary(samples_s):
+    """Summarises a list of latencies (in seconds) as milliseconds."""
+    return {
+        "count": len(samples_s),
+        "mean_ms": (sum(samples_s) / len(samples_s) * 1000) if samples_s else 0.0,
+        "p50_ms": percentile(samples_s, 50) * 1000,
+        "p99_ms": percentile(samples_s, 99) * 1000,
+        "p999_ms": percentile(samples_s, 99.9) * 1000,
+        "max_ms": max(samples_s) * 1000 if samples_s else 0.0,
+    }
+
+
+def rss_bytes():
+    """Current resident set size of this process (Linux /proc, falling back to peak RSS)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def write_results(path, benchmark, params, results):
+    """Writes a benchmark run to a JSON file so runs can be diffed against each other."""
+    report = {
+        "benchmark": benchmark,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "params": params,
+        "results": results,
+    }
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    return report
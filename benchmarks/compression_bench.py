@@ -0,0 +1,101 @@
+"""
+Bytes on the wire for full-draft replies with and without the compression
+and version tokens negotiated in the handshake.
+
+Starts a threaded server, commits a --lines line file of source-like text,
+then for a plain session and for each encoding available here times PEEK,
+SHOW and a SHOW:ETAG revalidation of an unchanged file. Loopback hides the
+link, so each reply also gets a modelled time on a --link-mbps link
+(measured latency + bytes on the wire / link rate).
+
+    python -m benchmarks.compression_bench --lines 20000 --link-mbps 10 --output compression.json
+"""
+import argparse
+import random
+import socket
+import tempfile
+import time
+
+from framing import send_frame, recv_frame, decompress_body, ENCODINGS, HEADER, OP_HELLO, OP_COMMAND, OP_RESPONSE
+from benchmarks.common import latency_summary, write_results
+from benchmarks.server_load import free_port, start_server
+
+WORDS = ("self", "return", "value", "index", "branch", "if", "else", "for", "in", "None", "name", "content",
+         "revision_id", "with", "lock", "path", "def", "import", "append", "len", "range", "0", "1", "(", ")", ":")
+
+
+def source_text(lines, seed):
+    """Indented lines of code-like words: repetitive like real source, unlike one line copied N times."""
+    rng = random.Random(seed)
+    return "\n".join(" " * (4 * rng.randint(0, 3)) + " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+                     for _ in range(lines))
+
+
+def connect(port, username, capabilities):
+    sock = socket.create_connection(("127.0.0.1", port))
+    hello = f"{username}\nCAPS:{','.join(capabilities)}" if capabilities is not None else username
+    send_frame(sock, OP_HELLO, hello)
+    request(sock, None)
+    return sock
+
+
+def request(sock, command):
+    """Sends a command (None: only read) and returns (reply text, bytes on the wire)."""
+    if command is not None:
+        send_frame(sock, OP_COMMAND, command)
+    while True:
+        opcode, flags, body = recv_frame(sock)
+        if opcode == OP_RESPONSE:
+            return decompress_body(body, flags).decode(errors="replace"), HEADER.size + len(body)
+
+
+def measure(sock, command, iterations, link_mbps):
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        _, wire_bytes = request(sock, command)
+        samples.append(time.perf_counter() - t0)
+    summary = latency_summary(samples)
+    summary["wire_bytes"] = wire_bytes
+    summary["modelled_ms"] = summary["mean_ms"] + wire_bytes * 8 / (link_mbps * 1e6) * 1000
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--link-mbps", type=float, default=10.0, help="Link rate for the modelled times")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        proc = start_server("thread", port, workdir)
+        try:
+            seeder = connect(port, "seeder", None)
+            request(seeder, "EDIT:" + source_text(args.lines, args.seed))
+            request(seeder, "COMMIT:benchmark file")
+            seeder.close()
+
+            for label, capabilities in [("plain", None)] + [(name, [name, "etag"]) for name in ENCODINGS]:
+                sock = connect(port, f"bench-{label}", capabilities)
+                results[label] = {
+                    "PEEK": measure(sock, "PEEK", args.iterations, args.link_mbps),
+                    "SHOW": measure(sock, "SHOW", args.iterations, args.link_mbps),
+                }
+                if capabilities is not None:
+                    etag = request(sock, "SHOW:ETAG")[0].partition("\n")[0][len("ETAG:"):]
+                    results[label]["SHOW:ETAG (unchanged)"] = measure(
+                        sock, f"SHOW:ETAG:{etag}", args.iterations, args.link_mbps)
+                sock.close()
+        finally:
+            proc.terminate()
+            proc.wait()
+    write_results(args.output, "compression", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
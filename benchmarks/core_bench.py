@@ -0,0 +1,96 @@
+"""
+Micro-benchmarks of VersionControlSystem operations called directly, without
+the network or the protocol layer: the cost of each command in vcs_core itself.
+
+    python -m benchmarks.core_bench --iterations 2000 --lines 1000 --output core.json
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from benchmarks.common import latency_summary, rss_bytes, write_results
+
+
+def timed(iterations, operation):
+    samples = []
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        operation(i)
+        samples.append(time.perf_counter() - t0)
+    return latency_summary(samples)
+
+
+def make_text(lines, tag):
+    return "".join(f"line {i} {tag}\n" for i in range(lines))
+
+
+def run_benchmarks(vcs, args):
+    user, other = "bench", "other"
+    vcs.register_user(user, None)
+    vcs.register_user(other, None)
+    base = make_text(args.lines, "base")
+    vcs.edit(user, base)
+    results = {}
+
+    # 1. Draft operations on one branch
+    def edit(i):
+        # Change one line in the middle, like a typical small edit
+        vcs.edit(user, base.replace(f"line {args.lines // 2} base", f"line {args.lines // 2} edit {i}"))
+    results["edit"] = timed(args.iterations, edit)
+    results["undo"] = timed(args.iterations, lambda i: vcs.undo(user))
+    results["redo"] = timed(args.iterations, lambda i: vcs.redo(user))
+    results["peek"] = timed(args.iterations, lambda i: vcs.get_active_branch(user).read_file(vcs.get_user_path(user)))
+    results["edit_other_file"] = timed(args.iterations, lambda i: vcs.edit(user, f"version {i}\n", path=f"docs/file{i % 50}.txt"))
+
+    # 2. Branches
+    results["branch"] = timed(args.iterations, lambda i: vcs.create_branch(user, f"b{i}"))
+    results["checkout"] = timed(args.iterations, lambda i: vcs.switch_branch(user, f"b{i}"))
+
+    # 3. Merges: both sides change different lines of the same file
+    vcs.switch_branch(user, "master")
+    vcs.create_branch(user, "theirs")
+    vcs.switch_branch(other, "theirs")
+    def merge(i):
+        theirs = vcs.get_active_branch(other).read_file(vcs.get_user_path(other))
+        vcs.edit(other, theirs.replace("line 0 ", f"line 0 theirs {i} ", 1))
+        ours = vcs.get_active_branch(user).read_file(vcs.get_user_path(user))
+        vcs.edit(user, ours + f"mine {i}\n")
+        t0 = time.perf_counter()
+        vcs.merge(user, "theirs")
+        return time.perf_counter() - t0
+    results["merge"] = latency_summary([merge(i) for i in range(max(1, args.iterations // 10))])
+
+    # 4. Commits and history queries
+    results["commit"] = timed(args.iterations, lambda i: vcs.commit(user, f"bench commit {i}"))
+    results["log"] = timed(args.iterations, lambda i: vcs.log(user))
+    results["diff"] = timed(args.iterations, lambda i: vcs.diff(user, "master", "b0"))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=1000, help="Lines in the file being edited")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    os.chdir(tempfile.mkdtemp(prefix="vcs-core-")) # The VCS keeps its data files in the cwd
+
+    with contextlib.redirect_stdout(io.StringIO()): # Silence broadcast prints
+        from vcs_core import VersionControlSystem # Imported here: it creates its data files in the cwd
+        vcs = VersionControlSystem()
+        started = time.perf_counter()
+        results = run_benchmarks(vcs, args)
+        results["seconds"] = time.perf_counter() - started
+        results["rss_bytes"] = rss_bytes()
+        vcs.close()
+    write_results(args.output, "core", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+GREP latency with the trigram index against scanning every branch head, with
+many branches and a deep commit history.
+
+Builds a repository of --files files (--lines lines each) on 'master', makes
+--commits commits on it (each changing one line of one file), then creates
+--branches branches, each changing one line of its own. It then times GREP
+for a string found on one branch, one found in one old commit only
+(GREP:ALL), one found on every branch, and a 2-character string (too short
+for the index, so every indexed version is read). The scan baseline walks
+every branch head and reads every file, which is what GREP would cost
+without the index. The index update cost per edit is the time the indexer
+needs for one queued edit (search_index.catch_up()).
+
+    python -m benchmarks.grep_bench --branches 2000 --commits 2000 --files 20 --output grep.json
+"""
+import argparse
+import contextlib
+import io
+import random
+import tempfile
+import time
+
+from benchmarks.common import latency_summary, rss_bytes, write_results
+
+WORDS = ("self", "return", "value", "index", "branch", "for", "in", "None", "name", "content", "lock", "path")
+
+
+def timed(action, iterations):
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        action()
+        samples.append(time.perf_counter() - t0)
+    return latency_summary(samples)
+
+
+def scan_heads(vcs, pattern):
+    """GREP without the index: every file at every branch head."""
+    lines = 0
+    for name in list(vcs.branch_registry) + [name for name, _ in vcs.branch_store.items()]:
+        tree_id = vcs.commit_graph.object_id(vcs.branch_head(name))
+        for path, _, blob_id in vcs.trees.diff(None, tree_id):
+            lines += sum(pattern in line for line in vcs.object_store.get(blob_id).split("\n"))
+    return lines
+
+
+def run(args, workdir):
+    rng = random.Random(args.seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        from vcs_core import VersionControlSystem
+        vcs = VersionControlSystem(data_dir=workdir, shared_file=f"{workdir}/server_repo.txt")
+    user = "bench"
+    vcs.register_user(user, None)
+    rss_start = rss_bytes()
+
+    # 1. The files, then --commits commits each changing one line
+    files = {f"src/module{i}.py": [" ".join(rng.choice(WORDS) for _ in range(8)) for _ in range(args.lines)]
+             for i in range(args.files)}
+    vcs.edit_files(user, {path: "\n".join(lines) for path, lines in files.items()})
+    started = time.perf_counter()
+    for n in range(args.commits):
+        path = rng.choice(list(files))
+        files[path][rng.randrange(args.lines)] = f"history marker {n}"
+        vcs.edit(user, "\n".join(files[path]), path=path)
+        vcs.commit(user, f"commit {n}")
+    commit_seconds = time.perf_counter() - started
+
+    # 2. One branch per line changed
+    started = time.perf_counter()
+    for n in range(args.branches):
+        vcs.switch_branch(user, "master")
+        vcs.create_branch(user, f"b{n}")
+        vcs.switch_branch(user, f"b{n}")
+        path = rng.choice(list(files))
+        lines = list(files[path])
+        lines[rng.randrange(args.lines)] = f"branch marker {n}"
+        vcs.edit(user, "\n".join(lines), path=path)
+    branch_seconds = time.perf_counter() - started
+    t0 = time.perf_counter()
+    vcs.search_index.catch_up()
+    backlog_seconds = time.perf_counter() - t0
+
+    # 3. Indexing cost of one edit
+    def one_edit():
+        lines[rng.randrange(args.lines)] = f"timed edit {rng.random()}"
+        vcs.edit(user, "\n".join(lines), path=path)
+    index_update = []
+    for _ in range(args.iterations):
+        one_edit()
+        t0 = time.perf_counter()
+        vcs.search_index.catch_up()
+        index_update.append(time.perf_counter() - t0)
+
+    # 4. Queries
+    rare = f"branch marker {args.branches // 2}"
+    old = "history marker 0"
+    results = {
+        "setup": {"commit_seconds": commit_seconds, "branch_seconds": branch_seconds,
+                  "index_backlog_seconds": backlog_seconds, "rss_growth_bytes": rss_bytes() - rss_start,
+                  "indexed_versions": len(vcs.search_index)},
+        "index_update_per_edit": latency_summary(index_update),
+        "grep_one_branch": timed(lambda: vcs.grep(rare), args.iterations),
+        "grep_all_old_commit": timed(lambda: vcs.grep(old, history=True), args.iterations),
+        "grep_every_branch": timed(lambda: vcs.grep("return value"), args.iterations),
+        "grep_short_pattern": timed(lambda: vcs.grep("zq"), max(1, args.iterations // 10)),
+        "scan_one_branch": timed(lambda: scan_heads(vcs, rare), 1),
+    }
+    results["speedup_one_branch"] = results["scan_one_branch"]["mean_ms"] / results["grep_one_branch"]["mean_ms"]
+    vcs.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--branches", type=int, default=2000)
+    parser.add_argument("--commits", type=int, default=2000, help="Commits on 'master' before branching")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=200, help="Lines per file")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(args, workdir)
+    write_results(args.output, "grep", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Compares delta-encoded history (ObjectStore) with the old full-copy Stack history.
+
+    python -m benchmarks.history_bench --edits 10000 --size 1048576 --output history.json
+"""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+
+from object_store import ObjectStore
+from benchmarks.common import latency_summary, write_results
+
+
+def generate_versions(size, edits, seed):
+    """Yields `edits` successive versions of a ~size-byte file, each changing one line."""
+    rng = random.Random(seed)
+    line_count = max(1, size // 64)
+    lines = [f"line {i:08d} " + "x" * 49 + "\n" for i in range(line_count)]
+    yield "".join(lines)
+    for n in range(edits):
+        index = rng.randrange(line_count)
+        lines[index] = f"edit {n:08d} " + "y" * 49 + "\n"
+        yield "".join(lines)
+
+
+def bench_delta_history(args):
+    """Builds the history through the object store and measures memory and undo time."""
+    store = ObjectStore(keyframe_interval=args.keyframe_interval)
+    history = []
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    head = None
+    for version in generate_versions(args.size, args.edits, args.seed):
+        head = store.put(version, base_id=head)
+        history.append(head)
+    build_s = time.perf_counter() - started
+    held_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Undo walks the history backwards; the read cache is cleared before each step
+    # to measure the worst case (rebuilding from the nearest keyframe).
+    cold, warm = [], []
+    for object_id in reversed(history[-args.undo_samples:]):
+        store._cache.clear()
+        store._cache_bytes = 0
+        t0 = time.perf_counter()
+        store.get(object_id)
+        cold.append(time.perf_counter() - t0)
+    for object_id in reversed(history[-args.undo_samples:]):
+        t0 = time.perf_counter()
+        store.get(object_id)
+        warm.append(time.perf_counter() - t0)
+
+    return {
+        "build_seconds": build_s,
+        "objects": len(store),
+        "keyframes": len(store._objects),
+        "stored_bytes": store.stored_bytes(),
+        "traced_bytes_held": held_bytes,
+        "undo_cold": latency_summary(cold),
+        "undo_sequential": latency_summary(warm),
+    }
+
+
+def bench_full_copy_history(args):
+    """
+    The previous design: every edit pushes the whole string onto a stack.
+    Memory is the sum of all retained strings. For large runs the strings are
+    only retained up to --baseline-limit-mb; the remainder is accounted but not kept.
+    """
+    stack = []
+    limit = args.baseline_limit_mb * 1024 * 1024
+    retained_bytes = 0
+    total_bytes = 0
+    started = time.perf_counter()
+    for version in generate_versions(args.size, args.edits, args.seed):
+        cost = sys.getsizeof(version)
+        total_bytes += cost
+        if retained_bytes + cost <= limit:
+            stack.append(version)
+            retained_bytes += cost
+    build_s = time.perf_counter() - started
+
+    undo = []
+    for _ in range(min(args.undo_samples, len(stack) - 1)):
+        t0 = time.perf_counter()
+        stack.pop()
+        stack[-1]
+        undo.append(time.perf_counter() - t0)
+
+    return {
+        "build_seconds": build_s,
+        "bytes_held": total_bytes,
+        "fully_retained": total_bytes == retained_bytes,
+        "undo": latency_summary(undo),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--edits", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="File size in bytes")
+    parser.add_argument("--keyframe-interval", type=int, default=16)
+    parser.add_argument("--undo-samples", type=int, default=1000)
+    parser.add_argument("--baseline-limit-mb", type=int, default=1024)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    results = {
+        "delta_history": bench_delta_history(args),
+        "full_copy_history": bench_full_copy_history(args),
+    }
+    results["memory_ratio"] = (results["full_copy_history"]["bytes_held"]
+                               / max(1, results["delta_history"]["traced_bytes_held"]))
+    write_results(args.output, "history", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Load generator: starts the server in this process on localhost and drives
+--clients simulated users, each sending commands back-to-back drawn from a
+weighted mix, for --duration seconds.
+
+Every client first creates and checks out its own branch, so MERGE has real
+work to do (it merges 'master' or another client's branch). The report has the
+overall and per-command throughput and latency (p50/p99/p999), error replies
+and the process RSS (server and clients together, since they share the process).
+
+    python -m benchmarks.loadgen --mode thread --clients 50 --duration 10 --output load.json
+    python -m benchmarks.loadgen --mix EDIT=60,PEEK=40 --baseline load.json
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from framing import read_frame_async, write_frame_async, OP_HELLO, OP_COMMAND, OP_RESPONSE
+from benchmarks.common import latency_summary, rss_bytes, write_results
+
+DEFAULT_MIX = "EDIT=40,PEEK=20,UNDO=10,REDO=5,BRANCH=3,CHECKOUT=5,MERGE=7,COMMIT=10"
+COMMANDS = ("EDIT", "PEEK", "UNDO", "REDO", "BRANCH", "CHECKOUT", "MERGE", "COMMIT")
+
+
+def parse_mix(text):
+    """'EDIT=40,PEEK=20' -> ([commands], [weights])."""
+    commands, weights = [], []
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip().upper()
+        if name not in COMMANDS:
+            raise argparse.ArgumentTypeError(f"Unknown command '{name}' in mix (use {', '.join(COMMANDS)}).")
+        commands.append(name)
+        weights.append(float(weight or 1))
+    return commands, weights
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_in_process_server(mode, port):
+    """Runs the chosen server mode on a daemon thread and waits until it accepts connections."""
+    if mode == "asyncio":
+        from async_server import start_async_vcs_server as serve
+    else:
+        from server import start_vcs_server as serve
+    threading.Thread(target=serve, args=("127.0.0.1", port), daemon=True).start()
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start listening in time.")
+
+
+class SimulatedClient:
+    """One user: a connection, its own branches, and the latencies it saw per command."""
+    def __init__(self, index, args, all_branches):
+        self.username = f"load{index}"
+        self.rng = random.Random(args.seed + index)
+        self.args = args
+        self.all_branches = all_branches
+        self.branches = []
+        self.count = 0
+        self.reader = self.writer = None
+
+    async def request(self, command):
+        await write_frame_async(self.writer, OP_COMMAND, command)
+        while True:
+            frame = await read_frame_async(self.reader)
+            if frame is None:
+                raise ConnectionError("Server closed the connection.")
+            if frame[0] == OP_RESPONSE: # Skip commit/merge notices
+                return bytes(frame[2])
+
+    async def connect(self, port):
+        self.reader, self.writer = await asyncio.open_connection("127.0.0.1", port)
+        await write_frame_async(self.writer, OP_HELLO, self.username)
+        await read_frame_async(self.reader) # Welcome message
+        await self.request(self.make_command("BRANCH"))
+        await self.request(f"CHECKOUT:{self.branches[-1]}")
+
+    def make_command(self, name):
+        self.count += 1
+        if name == "EDIT":
+            lines = "".join(f"{self.username} line {i} edit {self.count}\n" for i in range(self.args.edit_lines))
+            return f"EDIT:{lines}"
+        if name == "BRANCH":
+            branch = f"{self.username}-b{self.count}"
+            self.branches.append(branch)
+            self.all_branches.append(branch)
+            return f"BRANCH:{branch}"
+        if name == "CHECKOUT":
+            return f"CHECKOUT:{self.rng.choice(self.branches)}"
+        if name == "MERGE":
+            return f"MERGE:{self.rng.choice(['master', self.rng.choice(self.all_branches)])}"
+        if name == "COMMIT":
+            return f"COMMIT:load commit {self.count}"
+        return name
+
+    async def run(self, commands, weights, stop_at, latencies, errors):
+        while time.perf_counter() < stop_at:
+            name = self.rng.choices(commands, weights)[0]
+            command = self.make_command(name)
+            t0 = time.perf_counter()
+            reply = await self.request(command)
+            latencies[name].append(time.perf_counter() - t0)
+            if reply.startswith((b"Error", b"[ERROR]")):
+                errors[name] += 1
+        self.writer.close()
+
+
+async def run_load(port, args, commands, weights):
+    all_branches = []
+    clients = [SimulatedClient(i, args, all_branches) for i in range(args.clients)]
+    for first in range(0, len(clients), 100): # Batches spare the accept backlog
+        await asyncio.gather(*(client.connect(port) for client in clients[first:first + 100]))
+
+    latencies, errors = defaultdict(list), defaultdict(int)
+    rss_start = rss_bytes()
+    started = time.perf_counter()
+    await asyncio.gather(*(client.run(commands, weights, started + args.duration, latencies, errors)
+                           for client in clients))
+    elapsed = time.perf_counter() - started
+
+    every = [sample for samples in latencies.values() for sample in samples]
+    return {
+        "requests": len(every),
+        "throughput_rps": len(every) / elapsed,
+        "latency": latency_summary(every),
+        "commands": {
+            name: {"throughput_rps": len(samples) / elapsed, "errors": errors[name], "latency": latency_summary(samples)}
+            for name, samples in sorted(latencies.items())
+        },
+        "rss_bytes_start": rss_start,
+        "rss_bytes_end": rss_bytes(),
+    }
+
+
+def compare(baseline_path, results):
+    """Prints throughput and p99 changes against an earlier report of this benchmark."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    rows = [("total", baseline, results)] + [
+        (name, baseline["commands"][name], current)
+        for name, current in results["commands"].items() if name in baseline.get("commands", {})]
+    print(f"{'command':<10} {'rps before':>11} {'rps now':>11} {'p99 before':>11} {'p99 now':>11}")
+    for name, before, now in rows:
+        print(f"{name:<10} {before['throughput_rps']:>11.1f} {now['throughput_rps']:>11.1f} "
+              f"{before['latency']['p99_ms']:>9.2f}ms {now['latency']['p99_ms']:>9.2f}ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("thread", "asyncio"), default="thread")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Weighted command mix (default {DEFAULT_MIX})")
+    parser.add_argument("--edit-lines", type=int, default=20, help="Lines in each EDIT")
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    args = parser.parse_args(argv)
+    commands, weights = parse_mix(args.mix)
+
+    for name in ("output", "baseline"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    os.chdir(tempfile.mkdtemp(prefix="vcs-load-")) # The server keeps its data files in the cwd
+
+    port = free_port()
+    logging.getLogger().addHandler(logging.NullHandler()) # Keep server log messages out of the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull): # Silence the startup banner
+        from server import raise_open_file_limit
+        raise_open_file_limit()
+        start_in_process_server(args.mode, port)
+        results = asyncio.run(run_load(port, args, commands, weights))
+
+    write_results(args.output, "loadgen", vars(args), results)
+    if args.baseline:
+        compare(args.baseline, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Diff and three-way merge timings on large files with scattered edits.
+
+    python -m benchmarks.merge_bench --lines 100000 --edits 200 --output merge.json
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from merge import diff_lines, three_way_merge
+from benchmarks.common import latency_summary, write_results
+
+
+def make_base(lines):
+    return [f"{i:08d} the quick brown fox jumps over the lazy dog {i % 97}\n" for i in range(lines)]
+
+
+def scatter_edits(lines, count, rng, tag, positions=None):
+    """Returns a copy of `lines` with `count` replaced/inserted/deleted lines at random positions."""
+    edited = list(lines)
+    positions = sorted(positions or rng.sample(range(len(lines)), count), reverse=True)
+    for n, position in enumerate(positions):
+        kind = n % 3
+        if kind == 0:
+            edited[position] = f"{tag} changed line {position}\n"
+        elif kind == 1:
+            edited.insert(position, f"{tag} inserted before {position}\n")
+        else:
+            del edited[position]
+    return edited
+
+
+def timed(repeat, fn):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append(time.perf_counter() - t0)
+    return result, latency_summary(samples)
+
+
+def bench_case(args, overlap):
+    rng = random.Random(args.seed)
+    base = make_base(args.lines)
+    ours_positions = rng.sample(range(args.lines), args.edits)
+    if overlap:
+        # Half of the edits on the other side hit the same lines -> conflicts
+        theirs_positions = ours_positions[:args.edits // 2] + rng.sample(range(args.lines), args.edits // 2)
+        theirs_positions = list(set(theirs_positions))
+    else:
+        free = list(set(range(args.lines)) - {p + d for p in ours_positions for d in (-1, 0, 1)})
+        theirs_positions = rng.sample(free, args.edits)
+    ours = scatter_edits(base, args.edits, rng, "ours", ours_positions)
+    theirs = scatter_edits(base, len(theirs_positions), rng, "theirs", theirs_positions)
+
+    base_text, ours_text, theirs_text = "".join(base), "".join(ours), "".join(theirs)
+    hunks, diff_time = timed(args.repeat, lambda: diff_lines(base, ours))
+    (merged, conflicts), merge_time = timed(
+        args.repeat, lambda: three_way_merge(base_text, ours_text, theirs_text))
+    return {
+        "file_bytes": len(base_text),
+        "diff_hunks": len(hunks),
+        "diff": diff_time,
+        "merge": merge_time,
+        "conflicts": len(conflicts),
+        "merged_bytes": len(merged),
+    }
+
+
+def bench_vcs_merge(args):
+    """End-to-end VersionControlSystem.merge (merge-base lookup + three-way merge + store)."""
+    rng = random.Random(args.seed)
+    base = make_base(args.lines)
+    with tempfile.TemporaryDirectory() as workdir, contextlib.redirect_stdout(io.StringIO()):
+        os.chdir(workdir)
+        from config import DEFAULT_PATH
+        from vcs_core import VersionControlSystem
+        vcs = VersionControlSystem(data_dir=os.path.join(workdir, "data"))
+        vcs.register_user("u", None)
+        vcs.edit("u", "".join(base))
+        samples = []
+        for n in range(args.repeat):
+            branch = f"feature{n}"
+            vcs.create_branch("u", branch)
+            vcs.switch_branch("u", branch)
+            current = vcs.get_active_branch("u").read_file(DEFAULT_PATH).splitlines(keepends=True)
+            vcs.edit("u", "".join(scatter_edits(current, args.edits, rng, f"f{n}")))
+            vcs.switch_branch("u", "master")
+            current = vcs.get_active_branch("u").read_file(DEFAULT_PATH).splitlines(keepends=True)
+            vcs.edit("u", "".join(scatter_edits(current, args.edits, rng, f"m{n}")))
+            t0 = time.perf_counter()
+            vcs.merge("u", branch)
+            samples.append(time.perf_counter() - t0)
+        vcs.wal.close()
+    return latency_summary(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--edits", type=int, default=200, help="Scattered edits per side")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = {
+        "disjoint_edits": bench_case(args, overlap=False),
+        "overlapping_edits": bench_case(args, overlap=True),
+        "vcs_merge": bench_vcs_merge(args),
+    }
+    write_results(args.output, "merge", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+A scripted workflow over a high-latency link: lockstep (one command per round
+trip, like the interactive client), pipelined with request IDs, and as one
+atomic BATCH.
+
+Starts a threaded server behind a proxy that delays every chunk by half of
+--rtt-ms in each direction. Each workflow run creates a branch, checks it
+out, makes --edits edits, merges 'master' and commits, using
+client.ScriptClient. The same workflows are also run without the proxy to
+show the local cost.
+
+    python -m benchmarks.pipeline_bench --rtt-ms 50 --edits 20 --runs 5 --output pipeline.json
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from threading import Thread
+
+from client import ScriptClient
+from benchmarks.common import latency_summary, write_results
+from benchmarks.server_load import free_port, start_server
+
+
+async def _pipe(reader, writer, delay):
+    """Copies one direction of a connection, delivering each chunk `delay` seconds after it arrived."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def deliver():
+        while True:
+            due, data = await queue.get()
+            if data is None:
+                writer.close()
+                return
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            writer.write(data)
+            await writer.drain()
+
+    delivery = asyncio.ensure_future(deliver())
+    while True:
+        data = await reader.read(65536)
+        queue.put_nowait((loop.time() + delay, data or None))
+        if not data:
+            break
+    await delivery
+
+
+def start_delay_proxy(target_port, delay):
+    """Runs a TCP proxy to target_port on a background thread; returns its port."""
+    port = free_port()
+
+    async def handle(client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection("127.0.0.1", target_port)
+        await asyncio.gather(_pipe(client_reader, server_writer, delay), _pipe(server_reader, client_writer, delay),
+                             return_exceptions=True)
+
+    async def serve():
+        server = await asyncio.start_server(handle, "127.0.0.1", port)
+        async with server:
+            await server.serve_forever()
+
+    Thread(target=asyncio.run, args=(serve(),), name="delay-proxy", daemon=True).start()
+    time.sleep(0.2)
+    return port
+
+
+def workflow(run, edits):
+    """The commands of one run: new branch, edits, merge master, commit."""
+    branch = f"script{run}"
+    changes = [f"EDIT:{branch} version {i}\n" + "shared line\n" * 50 for i in range(edits)]
+    return [f"BRANCH:{branch}", f"CHECKOUT:{branch}"], changes + ["MERGE:master", f"COMMIT:{branch} done"]
+
+
+def run_lockstep(client, run, edits):
+    setup, changes = workflow(run, edits)
+    for command in setup + changes:
+        client.request(command)
+
+
+def run_pipelined(client, run, edits):
+    setup, changes = workflow(run, edits)
+    client.run(setup + changes)
+
+
+def run_batch(client, run, edits):
+    setup, changes = workflow(run, edits)
+    futures = [client.submit(command) for command in setup]
+    reply = client.batch(changes)
+    for future in futures:
+        future.result()
+    if reply.startswith("Error"):
+        raise RuntimeError(reply)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rtt-ms", type=float, default=50.0, help="Round-trip time added by the proxy")
+    parser.add_argument("--edits", type=int, default=20, help="Edits per workflow run")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        proc = start_server("thread", port, workdir)
+        try:
+            links = {"local": port, f"rtt {args.rtt_ms:g}ms": start_delay_proxy(port, args.rtt_ms / 2000)}
+            run_number = 0
+            for link, link_port in links.items():
+                results[link] = {}
+                for style, runner in (("lockstep", run_lockstep), ("pipelined", run_pipelined), ("batch", run_batch)):
+                    samples = []
+                    with ScriptClient(f"bench-{style}", "127.0.0.1", link_port) as client:
+                        for _ in range(args.runs):
+                            run_number += 1
+                            t0 = time.perf_counter()
+                            runner(client, run_number, args.edits)
+                            samples.append(time.perf_counter() - t0)
+                    results[link][style] = latency_summary(samples)
+        finally:
+            proc.kill()
+            proc.wait()
+    write_results(args.output, "pipeline", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Read-only follower replication: how long a new follower takes to catch up
+with a primary, and how far behind it stays.
+
+Starts a threaded primary with a replication port and fills it with
+--branches branches of --edits edits each (every branch also commits). It
+then starts a follower and times how long it takes until the follower serves
+the primary's official version (catch-up: connecting, loading the snapshot,
+applying the log written meanwhile). Replication lag is the time from a
+COMMIT reply on the primary until LOG:official on the follower shows that
+commit, measured --probes times with the primary idle, then again while
+--writers clients edit their own branches back-to-back.
+
+    python -m benchmarks.replication_bench --branches 200 --edits 20 --probes 200 --output replication.json
+"""
+import argparse
+import tempfile
+import threading
+import time
+
+from client import ScriptClient
+from benchmarks.common import latency_summary, write_results
+from benchmarks.server_load import free_port, start_server
+
+
+def fill(port, branches, edits, lines):
+    """Creates the branches, each with `edits` edits of a `lines`-line file and a commit."""
+    body = "\n".join(f"line {i} of the shared file" for i in range(lines))
+    with ScriptClient("filler", "127.0.0.1", port) as client:
+        for b in range(branches):
+            commands = [f"BRANCH:fill{b}", f"CHECKOUT:fill{b}", f"OPEN:src/file{b % 10}.txt"]
+            commands += [f"EDIT:{body}\nbranch {b} edit {e}" for e in range(edits)]
+            client.run(commands + [f"COMMIT:fill {b}", "CHECKOUT:master"])
+
+
+def official_head(client):
+    return client.request("LOG:official").partition(" ")[0]
+
+
+def wait_until(condition, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise RuntimeError("The follower did not catch up in time.")
+
+
+def measure_lag(primary, follower, probes):
+    """Commits on the primary and polls the follower until it shows each commit."""
+    samples = []
+    for n in range(probes):
+        primary.request(f"EDIT:probe {n}")
+        commit_id = primary.request(f"COMMIT:probe {n}").split()[1]
+        t0 = time.perf_counter()
+        wait_until(lambda: official_head(follower) == commit_id)
+        samples.append(time.perf_counter() - t0)
+    return latency_summary(samples)
+
+
+def write_load(port, index, stop, counts):
+    with ScriptClient(f"writer{index}", "127.0.0.1", port) as client:
+        client.run([f"BRANCH:load{index}", f"CHECKOUT:load{index}"])
+        n = 0
+        while not stop.is_set():
+            client.request(f"EDIT:writer {index} edit {n}\n" + "filler line\n" * 50)
+            n += 1
+        counts[index] = n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--branches", type=int, default=200, help="Branches made before the follower starts")
+    parser.add_argument("--edits", type=int, default=20, help="Edits per branch")
+    parser.add_argument("--lines", type=int, default=200, help="Lines of each edited file")
+    parser.add_argument("--probes", type=int, default=200, help="Commits timed for each lag measurement")
+    parser.add_argument("--writers", type=int, default=4, help="Clients editing during the loaded lag measurement")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        port, follower_port, replication_port = free_port(), free_port(), free_port()
+        processes = [start_server("thread", port, workdir, ["--replication-port", str(replication_port)])]
+        try:
+            # 1. A primary with some history
+            t0 = time.perf_counter()
+            fill(port, args.branches, args.edits, args.lines)
+            results["fill_seconds"] = time.perf_counter() - t0
+
+            with ScriptClient("prober", "127.0.0.1", port) as primary:
+                target = official_head(primary)
+
+                # 2. Catch-up of a new follower
+                t0 = time.perf_counter()
+                processes.append(start_server("thread", follower_port, workdir, ["--follow", str(replication_port)]))
+                with ScriptClient("prober", "127.0.0.1", follower_port) as follower:
+                    wait_until(lambda: official_head(follower) == target, timeout=300)
+                    results["catch_up_seconds"] = time.perf_counter() - t0
+
+                    # 3. Lag, idle and under write load
+                    results["lag_idle"] = measure_lag(primary, follower, args.probes)
+                    stop = threading.Event()
+                    counts = [0] * args.writers
+                    writers = [threading.Thread(target=write_load, args=(port, i, stop, counts))
+                               for i in range(args.writers)]
+                    t0 = time.perf_counter()
+                    for writer in writers:
+                        writer.start()
+                    results["lag_under_load"] = measure_lag(primary, follower, args.probes)
+                    stop.set()
+                    for writer in writers:
+                        writer.join()
+                    results["load_edits_per_second"] = sum(counts) / (time.perf_counter() - t0)
+                    results["follower_stats"] = [line for line in follower.request("STATS").split("\n")
+                                                 if "primary" in line or "Revisions" in line]
+        finally:
+            for proc in processes:
+                proc.kill()
+                proc.wait()
+    write_results(args.output, "replication", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
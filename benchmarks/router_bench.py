@@ -0,0 +1,62 @@
+"""
+Per-request routing cost against payload size: the command table
+(protocol.parse_command) versus the previous decode + strip + upper +
+startswith chain, for PEEK and for EDIT bodies from a few bytes to --max-bytes.
+Only routing is timed; the handler that finally uses the body is not.
+
+    python -m benchmarks.router_bench --iterations 2000 --max-bytes 4194304 --output router.json
+"""
+import argparse
+import time
+
+from protocol import parse_command
+from benchmarks.common import latency_summary, write_results
+
+LEGACY_PREFIXES = ("PATCH:", "EDIT:", "SYNC", "UNDO", "REDO", "BRANCH:", "CHECKOUT:", "MERGE:", "COMMIT",
+                   "LOG", "DIFF:", "OPEN:", "LS", "RM:", "STATS", "PEEK", "SHOW")
+
+
+def legacy_route(body):
+    """The previous path: decode the frame, upper-case it to spot COMMIT, strip, then a startswith chain."""
+    command = bytes(body).decode()
+    command.strip().upper().startswith("COMMIT") # The server's COMMIT check
+    data = command.strip()
+    for prefix in LEGACY_PREFIXES:
+        if data.startswith(prefix):
+            return prefix, data[len(prefix):]
+    return None, data
+
+
+def timed(iterations, route, body):
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        route(body)
+        samples.append(time.perf_counter() - t0)
+    return latency_summary(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--max-bytes", type=int, default=1 << 22, help="Largest EDIT body")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    bodies = {"PEEK": bytearray(b"PEEK")}
+    size = 16
+    while size <= args.max_bytes:
+        bodies[f"EDIT {size}B"] = bytearray(b"EDIT:" + b"line of text\n" * (size // 13))
+        size *= 16
+
+    results = {}
+    for label, body in bodies.items():
+        results[label] = {
+            "legacy": timed(args.iterations, legacy_route, body),
+            "table": timed(args.iterations, parse_command, body),
+        }
+    write_results(args.output, "router", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
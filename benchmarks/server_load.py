@@ -0,0 +1,146 @@
+"""
+Load test for the threaded and asyncio server modes with many concurrent sessions.
+
+Starts `server.py --mode <mode>` in a subprocess on localhost, opens --idle
+sessions that only complete the handshake, and drives --active sessions that
+send PEEK/EDIT commands back-to-back for --duration seconds.
+
+    python -m benchmarks.server_load --mode both --idle 5000 --active 200 --output load.json
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from framing import read_frame_async, write_frame_async, OP_HELLO, OP_COMMAND
+from benchmarks.common import latency_summary, write_results
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_status(pid):
+    """Reads RSS and thread count of another process from /proc (Linux only)."""
+    status = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key == "VmRSS":
+                    status["rss_bytes"] = int(value.split()[0]) * 1024
+                elif key == "Threads":
+                    status["threads"] = int(value)
+    except OSError:
+        pass
+    return status
+
+
+def start_server(mode, port, workdir, extra_args=()):
+    """Launches server.py in a subprocess and waits until it accepts connections."""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(REPO_ROOT, "server.py"), "--mode", mode,
+         "--host", "127.0.0.1", "--port", str(port), *extra_args],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError("Server did not start listening in time.")
+
+
+async def open_session(port, username):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    await write_frame_async(writer, OP_HELLO, username)
+    await read_frame_async(reader) # Welcome message
+    return reader, writer
+
+
+async def active_session(port, index, stop_at, latencies):
+    reader, writer = await open_session(port, f"active{index}")
+    count = 0
+    while time.perf_counter() < stop_at:
+        command = "PEEK" if count % 2 else f"EDIT:session {index} edit {count}"
+        t0 = time.perf_counter()
+        await write_frame_async(writer, OP_COMMAND, command)
+        await read_frame_async(reader)
+        latencies.append(time.perf_counter() - t0)
+        count += 1
+    writer.close()
+    return count
+
+
+async def run_load(port, idle, active, duration, pid):
+    # 1. Open the idle sessions in batches (avoids overflowing the accept backlog)
+    idle_sessions = []
+    started = time.perf_counter()
+    batch = 200
+    for first in range(0, idle, batch):
+        idle_sessions.extend(await asyncio.gather(
+            *(open_session(port, f"idle{i}") for i in range(first, min(idle, first + batch)))))
+    connect_s = time.perf_counter() - started
+    status_idle = process_status(pid)
+
+    # 2. Drive the active sessions while the idle ones stay connected
+    latencies = []
+    stop_at = time.perf_counter() + duration
+    counts = await asyncio.gather(*(active_session(port, i, stop_at, latencies) for i in range(active)))
+    status_loaded = process_status(pid)
+
+    for _, writer in idle_sessions:
+        writer.close()
+
+    return {
+        "idle_sessions": len(idle_sessions),
+        "idle_connect_seconds": connect_s,
+        "server_after_idle": status_idle,
+        "server_under_load": status_loaded,
+        "requests": sum(counts),
+        "throughput_rps": sum(counts) / duration,
+        "latency": latency_summary(latencies),
+    }
+
+
+def bench_mode(mode, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        proc = start_server(mode, port, workdir)
+        try:
+            return asyncio.run(run_load(port, args.idle, args.active, args.duration, proc.pid))
+        finally:
+            proc.kill()
+            proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("thread", "asyncio", "both"), default="both")
+    parser.add_argument("--idle", type=int, default=5000, help="Sessions that connect and stay idle")
+    parser.add_argument("--active", type=int, default=200, help="Sessions sending commands continuously")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    from server import raise_open_file_limit
+    raise_open_file_limit()
+
+    modes = ("thread", "asyncio") if args.mode == "both" else (args.mode,)
+    results = {mode: bench_mode(mode, args) for mode in modes}
+    write_results(args.output, "server_load", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
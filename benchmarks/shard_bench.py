@@ -0,0 +1,149 @@
+"""
+Merge-heavy throughput of the sharded server (--mode sharded) against the
+single-process threaded server, on a --lines line file.
+
+--writers clients each own a source branch and keep changing one line of
+their own part of the file on it (EDIT). --clients mergers each own a branch
+and keep merging a random source branch into it (MERGE). Both sides change
+the file between merges, so every merge is a real three-way merge of the whole
+file, and the sources never merge anything, so none of them conflict. With N
+shards the branches are spread over N worker processes and merges on
+different shards run on different cores; on a machine with fewer cores than
+shards the extra processes only add overhead.
+
+    python -m benchmarks.shard_bench --shards 1,2,4 --clients 16 --duration 10 --output shard.json
+"""
+import argparse
+import asyncio
+import os
+import random
+import signal
+import tempfile
+import time
+
+from config import DEFAULT_PATH
+from framing import read_frame_async, write_frame_async, OP_COMMAND, OP_RESPONSE
+from benchmarks.common import latency_summary, write_results
+from benchmarks.server_load import free_port, open_session, start_server
+
+DRAFT_TITLE = f"--- Current Draft: {DEFAULT_PATH} ---\n"
+
+
+class BenchClient:
+    """One user on its own branch, holding the draft from the server's last reply."""
+    def __init__(self, name):
+        self.branch = name
+        self.draft = ""
+        self.reader = self.writer = None
+
+    async def request(self, command):
+        await write_frame_async(self.writer, OP_COMMAND, command)
+        while True:
+            frame = await read_frame_async(self.reader)
+            if frame is None:
+                raise ConnectionError("Server closed the connection.")
+            if frame[0] == OP_RESPONSE: # Skip merge notices
+                reply = bytes(frame[2]).decode()
+                if DRAFT_TITLE in reply:
+                    self.draft = reply.partition(DRAFT_TITLE)[2]
+                return reply
+
+    async def connect(self, port):
+        self.reader, self.writer = await open_session(port, self.branch)
+        await self.request(f"BRANCH:{self.branch}")
+        await self.request(f"CHECKOUT:{self.branch}")
+
+    async def timed(self, name, command, latencies, errors):
+        t0 = time.perf_counter()
+        reply = await self.request(command)
+        latencies[name].append(time.perf_counter() - t0)
+        if reply.startswith(("Error", "[ERROR]")) or "conflict" in reply.partition("\n")[0]:
+            errors[name] += 1
+
+    async def write(self, line, stop_at, latencies, errors):
+        """Writer loop: change `line` of the draft over and over."""
+        count = 0
+        while time.perf_counter() < stop_at:
+            count += 1
+            lines = self.draft.split("\n")
+            lines[line] = f"{self.branch} edit {count}"
+            await self.timed("EDIT", "EDIT:" + "\n".join(lines), latencies, errors)
+        self.writer.close()
+
+    async def merge(self, sources, rng, stop_at, latencies, errors):
+        """Merger loop: merge a random source branch, over and over."""
+        while time.perf_counter() < stop_at:
+            await self.timed("MERGE", f"MERGE:{rng.choice(sources)}", latencies, errors)
+        self.writer.close()
+
+
+async def run_load(port, args):
+    # 1. The shared starting point: a --lines line file on 'master'
+    seeder = BenchClient("seeder")
+    seeder.reader, seeder.writer = await open_session(port, "seeder")
+    await seeder.request("EDIT:" + "\n".join(f"{i:06d} shared line of the benchmark file" for i in range(args.lines)))
+    seeder.writer.close()
+
+    # 2. Every client on its own branch, then the writer and merger loops together
+    writers = [BenchClient(f"source{i}") for i in range(args.writers)]
+    mergers = [BenchClient(f"merge{i}") for i in range(args.clients)]
+    await asyncio.gather(*(client.connect(port) for client in writers + mergers))
+    sources = [writer.branch for writer in writers]
+    block = args.lines // args.writers
+    latencies = {"EDIT": [], "MERGE": []}
+    errors = {"EDIT": 0, "MERGE": 0}
+    started = time.perf_counter()
+    stop_at = started + args.duration
+    await asyncio.gather(
+        *(writer.write(i * block + block // 2, stop_at, latencies, errors) for i, writer in enumerate(writers)),
+        *(merger.merge(sources, random.Random(args.seed + i), stop_at, latencies, errors)
+          for i, merger in enumerate(mergers)))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": sum(len(samples) for samples in latencies.values()),
+        "throughput_rps": sum(len(samples) for samples in latencies.values()) / elapsed,
+        "merges_per_second": len(latencies["MERGE"]) / elapsed,
+        "commands": {name: {"count": len(samples), "errors": errors[name], "latency": latency_summary(samples)}
+                     for name, samples in latencies.items()},
+    }
+
+
+def bench(mode, extra_args, args):
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        proc = start_server(mode, port, workdir, extra_args)
+        try:
+            return asyncio.run(run_load(port, args))
+        finally:
+            # Ctrl+C equivalent, so the shards shut down before the directory is removed
+            proc.send_signal(signal.SIGINT)
+            try:
+                proc.wait(timeout=60)
+            except Exception:
+                proc.kill()
+                proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shards", default="1,2,4", help="Comma-separated shard counts to run")
+    parser.add_argument("--clients", type=int, default=16, help="Clients merging")
+    parser.add_argument("--writers", type=int, default=4, help="Clients editing the source branches")
+    parser.add_argument("--lines", type=int, default=2000, help="Lines in the shared file")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=5)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    results = {"cpu_count": os.cpu_count(), "thread": bench("thread", (), args)}
+    for count in (int(value) for value in args.shards.split(",")):
+        results[f"sharded-{count}"] = bench("sharded", ("--shards", str(count)), args)
+    for result in results.values():
+        if isinstance(result, dict):
+            result["speedup_vs_thread"] = result["merges_per_second"] / results["thread"]["merges_per_second"]
+    write_results(args.output, "shard_bench", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
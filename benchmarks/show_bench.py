@@ -0,0 +1,86 @@
+"""
+SHOW on a large official file: the previous full-string read versus the
+memory-mapped file, and paging through it with byte and line ranges.
+
+Commits one file of --lines lines, then times each kind of read and records
+the Python heap it allocates (tracemalloc peak; pages of a memory map are
+not Python allocations).
+
+    python -m benchmarks.show_bench --lines 2000000 --pages 1000 --output show.json
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.common import latency_summary, write_results
+
+
+def measure(operation):
+    """Runs the operation once; returns (seconds, peak Python heap bytes)."""
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    operation()
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=2000000)
+    parser.add_argument("--pages", type=int, default=1000, help="Random pages read")
+    parser.add_argument("--page-lines", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    os.chdir(tempfile.mkdtemp(prefix="vcs-show-")) # The VCS keeps its data files in the cwd
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from protocol import process_client_request
+        from vcs_core import vcs
+    user = "bench"
+    vcs.register_user(user, None)
+    vcs.edit(user, "".join(f"line {i} of the official file\n" for i in range(args.lines)))
+    vcs.commit(user, "big file")
+    path = vcs.get_user_path(user)
+    size = vcs.official_file(path).size
+
+    results = {"file_bytes": size}
+    # 1. The whole file: the previous string read, then the memory map (first SHOW writes the file out)
+    seconds, peak = measure(lambda: (vcs.read_file(vcs.official_revision_id, path) or "").encode())
+    results["full_string"] = {"ms": seconds * 1000, "heap_peak_bytes": peak}
+    for mapped in vcs.mapped_files._files.values(): # A checkpoint may have written it out already
+        os.remove(mapped.path)
+    vcs.mapped_files._files.clear()
+    seconds, peak = measure(lambda: process_client_request(user, "SHOW"))
+    results["full_mapped_first"] = {"ms": seconds * 1000, "heap_peak_bytes": peak}
+    seconds, peak = measure(lambda: process_client_request(user, "SHOW"))
+    results["full_mapped"] = {"ms": seconds * 1000, "heap_peak_bytes": peak}
+
+    # 2. Random pages (the line index is built by the first line read)
+    seconds, peak = measure(lambda: process_client_request(user, "SHOW:LINES:1:1"))
+    results["line_index_build"] = {"ms": seconds * 1000, "heap_peak_bytes": peak}
+    rng = random.Random(args.seed)
+    for kind, make in (("byte_range", lambda: f"SHOW:{rng.randrange(size)}:4096"),
+                       ("line_range", lambda: f"SHOW:LINES:{rng.randint(1, args.lines)}:{args.page_lines}")):
+        samples = []
+        for _ in range(args.pages):
+            command = make()
+            t0 = time.perf_counter()
+            process_client_request(user, command)
+            samples.append(time.perf_counter() - t0)
+        results[kind] = latency_summary(samples)
+    vcs.close()
+    write_results(args.output, "show", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
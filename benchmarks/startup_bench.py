@@ -0,0 +1,108 @@
+"""
+Cold-start time of the client and the server.
+
+Client: wall time of a fresh interpreter importing `client` (what every
+client launch pays before it connects). Server: a fresh `server.py` on a
+repository prepared with --branches branches of --edits edits each, timing
+how long until it accepts a connection and how long until the first
+session's welcome message arrives (the store is open by then).
+
+    python -m benchmarks.startup_bench --runs 5 --branches 200 --edits 50 --output startup.json
+"""
+import argparse
+import contextlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from framing import send_frame, recv_frame, OP_HELLO
+from benchmarks.common import latency_summary, write_results
+from benchmarks.server_load import REPO_ROOT, free_port
+
+
+def child_env():
+    return dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+
+def time_import(module, workdir):
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=workdir, env=child_env(), check=True)
+    return time.perf_counter() - t0
+
+
+def prepare_repository(workdir, args):
+    """Builds the repository the server will recover (a checkpoint plus a log tail)."""
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            from vcs_core import VersionControlSystem
+            vcs = VersionControlSystem()
+        vcs.register_user("prep", None)
+        for i in range(args.branches):
+            vcs.switch_branch("prep", "master")
+            vcs.create_branch("prep", f"b{i}")
+            vcs.switch_branch("prep", f"b{i}")
+            for n in range(args.edits):
+                vcs.edit("prep", "".join(f"branch {i} line {k} edit {n}\n" for k in range(20)))
+        vcs.close()
+    finally:
+        os.chdir(cwd)
+
+
+def time_server_start(workdir):
+    """Returns (seconds until a connection is accepted, seconds until the first welcome message)."""
+    port = free_port()
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "server.py"), "--host", "127.0.0.1",
+                             "--port", str(port)], cwd=workdir, env=child_env(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                sock = socket.create_connection(("127.0.0.1", port), timeout=30)
+                break
+            except OSError:
+                time.sleep(0.002)
+        accepted = time.perf_counter() - t0
+        send_frame(sock, OP_HELLO, "startup")
+        recv_frame(sock) # Welcome message, sent once the store is open
+        ready = time.perf_counter() - t0
+        sock.close()
+        return accepted, ready
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--branches", type=int, default=200)
+    parser.add_argument("--edits", type=int, default=50, help="Edits per branch in the prepared repository")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        client_import = [time_import("client", workdir) for _ in range(args.runs)]
+        client_files = sorted(os.listdir(workdir)) # Should stay empty: the client loads no server state
+        interpreter = [time_import("sys", workdir) for _ in range(args.runs)]
+
+        prepare_repository(workdir, args)
+        starts = [time_server_start(workdir) for _ in range(args.runs)]
+
+    write_results(args.output, "startup", vars(args), {
+        "interpreter": latency_summary(interpreter),
+        "client_import": latency_summary(client_import),
+        "client_created_files": client_files,
+        "server_accepting": latency_summary([accepted for accepted, _ in starts]),
+        "server_first_welcome": latency_summary([ready for _, ready in starts]),
+    })
+
+
+if __name__ == "__main__":
+    main()
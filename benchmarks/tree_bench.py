@@ -0,0 +1,77 @@
+"""
+Cost of editing and committing one file as the repository grows.
+
+Each run imports a repository of --files files spread over nested directories,
+then edits and commits single random files. With tree objects only the trees
+on the edited path are rewritten, so the latency and the number of new objects
+per commit should stay flat from the small to the large repository.
+
+    python -m benchmarks.tree_bench --files 5000 50000 --edits 200 --output tree.json
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.common import latency_summary, write_results
+
+
+def repository_files(count):
+    """{ path: content } for `count` files, about 40 files per directory, three levels deep."""
+    return {f"pkg{i % 50}/mod{i // 50 % 25}/file{i}.txt": f"file {i}\n" + "line\n" * (i % 20)
+            for i in range(count)}
+
+
+def bench_size(args, count, workdir):
+    from vcs_core import VersionControlSystem
+    rng = random.Random(args.seed)
+    vcs = VersionControlSystem(data_dir=os.path.join(workdir, f"data{count}"))
+    vcs.register_user("u", None)
+
+    files = repository_files(count)
+    started = time.perf_counter()
+    vcs.edit_files("u", files, message="Import")
+    vcs.commit("u", "Import")
+    import_seconds = time.perf_counter() - started
+
+    paths = list(files)
+    objects_before = len(vcs.object_store)
+    samples = []
+    for n in range(args.edits):
+        path = rng.choice(paths)
+        t0 = time.perf_counter()
+        vcs.edit("u", f"{files[path]}edit {n}\n", path=path)
+        vcs.commit("u")
+        samples.append(time.perf_counter() - t0)
+
+    result = {
+        "import_seconds": import_seconds,
+        "edit_and_commit": latency_summary(samples),
+        "new_objects_per_edit": (len(vcs.object_store) - objects_before) / args.edits,
+    }
+    vcs.wal.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[5000, 50000])
+    parser.add_argument("--edits", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=3)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with contextlib.redirect_stdout(io.StringIO()): # Silence broadcast prints
+            results = {f"{count}_files": bench_size(args, count, workdir) for count in args.files}
+    write_results(args.output, "tree", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
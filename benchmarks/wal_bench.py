@@ -0,0 +1,101 @@
+"""
+Commit throughput of the write-ahead log versus rewriting the whole file per commit,
+plus recovery (log replay) time.
+
+    python -m benchmarks.wal_bench --threads 8 --commits 200 --size 1048576 --output wal.json
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+from benchmarks.common import latency_summary, write_results
+
+
+def run_threads(count, target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def make_vcs(data_dir, legacy):
+    from vcs_core import VersionControlSystem
+
+    class RewriteOnCommitVCS(VersionControlSystem):
+        """The previous commit path: rewrite the whole repository file on every commit."""
+        def commit(self, username):
+            branch = self.get_active_branch(username)
+            with self._commit_lock:
+                self.official_revision_id = branch.head_revision_id
+                self._save_to_disk()
+            return "Commit successful! Server repository updated."
+
+    return (RewriteOnCommitVCS if legacy else VersionControlSystem)(data_dir=data_dir)
+
+
+def bench_commits(args, workdir, legacy):
+    """Each thread puts a distinct file of --size bytes on its own branch, then commits repeatedly."""
+    vcs = make_vcs(os.path.join(workdir, "legacy" if legacy else "wal"), legacy)
+    for index in range(args.threads):
+        username = f"user{index}"
+        vcs.register_user(username, None)
+        vcs.create_branch(username, f"b{index}")
+        vcs.switch_branch(username, f"b{index}")
+        vcs.edit(username, f"{index}".ljust(args.size, "x"))
+
+    latencies = []
+    def worker(index):
+        for _ in range(args.commits):
+            t0 = time.perf_counter()
+            vcs.commit(f"user{index}")
+            latencies.append(time.perf_counter() - t0)
+
+    elapsed = run_threads(args.threads, worker)
+    total = args.threads * args.commits
+    result = {
+        "seconds": elapsed,
+        "commits_per_second": total / elapsed,
+        "commit_latency": latency_summary(latencies),
+    }
+
+    if not legacy:
+        # Recovery: a fresh instance replays the checkpoint and the log written above
+        vcs.wal.flush()
+        started = time.perf_counter()
+        recovered = make_vcs(vcs.data_dir, legacy=False)
+        result["replay_seconds"] = time.perf_counter() - started
+        result["replay_matches"] = recovered.official_revision_id == vcs.official_revision_id
+        recovered.wal.close()
+    vcs.wal.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--commits", type=int, default=200, help="Commits per thread")
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="File size in bytes")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args(argv)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        with contextlib.redirect_stdout(io.StringIO()): # Silence broadcast prints
+            results = {
+                "wal_group_commit": bench_commits(args, workdir, legacy=False),
+                "rewrite_file_per_commit": bench_commits(args, workdir, legacy=True),
+            }
+    write_results(args.output, "wal", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import hashlib
+import os
+import pickle
+import shutil
+
+
+class BranchStore:
+    """
+    On-disk home of the branches evicted from memory (see BRANCH_CACHE_ENTRIES):
+    one small file per branch holding its head and its undo/redo history.
+
+    The store only stands in for memory. Checkpoints and the write-ahead log
+    still describe every branch, so the directory is emptied whenever the
+    server starts and recovery rebuilds it. Callers hold the VCS registry lock,
+    so the store needs no lock of its own.
+
+    Snapshots pin() the stored branches instead of reading them while every
+    lock is held: until read_pinned() has read a pinned branch, take() and
+    discard() move its file aside rather than deleting it, so it is read as
+    it was at pin() even if it was loaded, changed and spilled again meanwhile.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.clear()
+
+    def clear(self):
+        """Deletes every stored branch."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory)
+        self._names = set()
+        self._pinned = set()
+        self._kept = set() # Pinned branches whose file was moved aside
+
+    def _path(self, name):
+        # Branch names may contain characters that are not valid in file names
+        return os.path.join(self.directory, hashlib.sha1(name.encode()).hexdigest() + ".branch")
+
+    def _kept_path(self, name):
+        return self._path(name) + ".pinned"
+
+    def save(self, name, head_id, history, future):
+        """Writes a branch out; it is read back (and removed) by take()."""
+        with open(self._path(name), "wb") as f:
+            pickle.dump((name, head_id, history, future), f, protocol=pickle.HIGHEST_PROTOCOL)
+        self._names.add(name)
+
+    def take(self, name):
+        """Removes a branch from the store. Returns (head_id, history, future), or None if it is not here."""
+        if name not in self._names:
+            return None
+        with open(self._path(name), "rb") as f:
+            _, head_id, history, future = pickle.load(f)
+        self._remove(name)
+        return head_id, history, future
+
+    def discard(self, name):
+        """Deletes a branch without reading it. Returns False if it is not here."""
+        if name not in self._names:
+            return False
+        self._remove(name)
+        return True
+
+    def _remove(self, name):
+        if name in self._pinned and name not in self._kept:
+            os.replace(self._path(name), self._kept_path(name))
+            self._kept.add(name)
+        else:
+            os.remove(self._path(name))
+        self._names.discard(name)
+
+    def contains(self, name):
+        return name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def items(self):
+        """Yields (name, (head_id, history, future)) for every stored branch."""
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".branch"):
+                    continue
+                with open(entry.path, "rb") as f:
+                    name, head_id, history, future = pickle.load(f)
+                yield name, (head_id, history, future)
+
+    def pin(self):
+        """Pins every stored branch (dropping any earlier pins). Returns their names."""
+        self.unpin()
+        self._pinned = set(self._names)
+        return list(self._pinned)
+
+    def read_pinned(self, name):
+        """Returns (head_id, history, future) of a pinned branch as it was when pinned, and unpins it."""
+        kept = name in self._kept
+        path = self._kept_path(name) if kept else self._path(name)
+        with open(path, "rb") as f:
+            _, head_id, history, future = pickle.load(f)
+        if kept:
+            os.remove(path)
+            self._kept.discard(name)
+        self._pinned.discard(name)
+        return head_id, history, future
+
+    def unpin(self):
+        """Drops every pin, deleting the files kept for them."""
+        for name in self._kept:
+            try:
+                os.remove(self._kept_path(name))
+            except FileNotFoundError:
+                pass
+        self._pinned = set()
+        self._kept = set()
\ No newline at end of file
@@ -1,16 +1,236 @@
-from socket import socket, AF_INET, SOCK_STREAM
-from threading import Thread
-from config import HOST, PORT, BUFFER_SIZE
-from utils import display_server_content
-from vcs_core import vcs
+import itertools
+from collections import deque
+from concurrent.futures import Future
+from socket import socket, AF_INET, SOCK_STREAM, IPPROTO_TCP, TCP_NODELAY, SHUT_RDWR
+from select import select
+from threading import Thread, Lock
+from config import HOST, PORT, NOTIFY_QUEUE_LIMIT
+from framing import (send_frame, recv_frame, encode_frame, decompress_body, split_request_id, with_request_id,
+                     FrameError, ENCODINGS, FLAG_REQUEST_ID, REQUEST_ID, OP_HELLO, OP_COMMAND, OP_RESPONSE, OP_NOTIFY)
+from delta import compute_delta, apply_delta, encode_delta, decode_delta
 
 
+# Offered in the handshake, most preferred first (zstd only if the zstandard module is installed)
+CAPABILITIES = [name for name in ("zstd", "zlib") if name in ENCODINGS] + ["etag"]
 
+# Commands a read-only follower runs (the read_only commands of protocol.py)
+READ_COMMANDS = ("SHOW", "PEEK", "LOG", "DIFF", "LS", "GREP", "STATS")
 
 
 # The asynchronous listener is removed to fix the race condition and hang.
 # All socket reads now happen synchronously in the main loop.
 
+def receive_response(sock):
+    """
+    Reads frames until the server's RESPONSE arrives, printing any broadcast
+    NOTIFY frames received in the meantime. Returns None if the server closed.
+    """
+    while True:
+        frame = recv_frame(sock)
+        if frame is None:
+            return None
+        opcode, flags, body = frame
+        if opcode == OP_NOTIFY:
+            print(f"\n{body.decode()}")
+            continue
+        if opcode == OP_RESPONSE:
+            # The flags name the compression of the reply (none unless negotiated);
+            # a SHOW byte range may end in the middle of a multi-byte character
+            return decompress_body(body, flags).decode(errors="replace")
+
+class LocalDraft:
+    """
+    The client's copy of its branch draft. After one SYNC, the server only
+    sends deltas (or just a version ID) and edits go out as PATCH deltas.
+    """
+    def __init__(self):
+        self.revision_id = None
+        self.content = ""
+
+    def apply_response(self, response, pending_content=None):
+        """
+        Updates the copy from a DRAFT_* response and returns its status text.
+        `pending_content` is the text of a PATCH we just sent, adopted if the
+        server reports it as the new version. Returns None if the response is
+        not a draft response or does not match our copy (caller must SYNC).
+        """
+        header, _, rest = response.partition("\n")
+        kind, _, fields = header.partition(":")
+        if kind == "DRAFT_VERSION":
+            if pending_content is not None and fields != self.revision_id:
+                self.content = pending_content
+            self.revision_id = fields
+            return rest
+        if kind == "DRAFT_DELTA":
+            from_id, _, to_id = fields.partition(":")
+            if from_id != self.revision_id:
+                return None
+            ops, end = decode_delta(rest, base_length=len(self.content))
+            self.content = apply_delta(self.content, ops)
+            self.revision_id = to_id
+            return rest[end:]
+        if kind == "DRAFT_FULL":
+            revision_id, _, length = fields.partition(":")
+            self.content = rest[:int(length)]
+            self.revision_id = revision_id
+            return rest[int(length):]
+        return None
+
+    def print_draft(self, status):
+        if status:
+            print(status)
+        print(f"--- Current Draft (version {self.revision_id[:12]}) ---")
+        print(self.content)
+
+def encode_batch(commands):
+    """The BATCH command running `commands` (strings) as one unit: BATCH:<length>:<command>..."""
+    parts = ["BATCH:"]
+    for command in commands:
+        parts.append(f"{len(command.encode())}:{command}")
+    return "".join(parts)
+
+class ScriptClient:
+    """
+    Non-interactive client for scripts. Commands are pipelined: submit() sends
+    a command tagged with a request ID and returns a Future straight away, and
+    a reader thread completes each Future when its reply comes back, so a
+    script of N commands waits about one round trip instead of N. Broadcast
+    notices are kept in `notices` (the newest NOTIFY_QUEUE_LIMIT of them).
+
+    Given `followers` ((host, port) of read-only followers of the server), the
+    READ_COMMANDS are sent to them in turn and everything else to the server.
+    A follower is a few milliseconds behind, so a read right after a write
+    may not see it yet.
+
+        with ScriptClient("alice", host, port) as client:
+            client.run(["BRANCH:feature", "CHECKOUT:feature"])
+            print(client.batch(["EDIT:new text", "MERGE:master", "COMMIT:done"]))
+    """
+    def __init__(self, username, host=HOST, port=PORT, followers=()):
+        self.username = username
+        self.notices = deque(maxlen=NOTIFY_QUEUE_LIMIT)
+        self.sock = socket(AF_INET, SOCK_STREAM)
+        self.sock.connect((host, port))
+        # Pipelined commands are separate small frames: Nagle's algorithm would hold each one back
+        self.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        send_frame(self.sock, OP_HELLO, f"{username}\nCAPS:{','.join(CAPABILITIES + ['request-id'])}")
+        welcome = receive_response(self.sock)
+        if welcome is None:
+            raise ConnectionError("Server closed the connection.")
+        caps_line, _, self.welcome = welcome.partition("\n")
+        if not caps_line.startswith("CAPS:") or "request-id" not in caps_line[5:].split(","):
+            self.sock.close()
+            raise ConnectionError("The server does not support request IDs (pipelining).")
+
+        self._pending = {} # { request_id: Future }
+        self._next_id = 0
+        self._send_lock = Lock()
+        self._closed = False
+        self._reader = Thread(target=self._read_replies, name=f"replies-{username}", daemon=True)
+        self._reader.start()
+        self.followers = [ScriptClient(username, *address) for address in followers]
+        self._next_follower = itertools.cycle(self.followers)
+
+    def submit(self, command):
+        """Sends a command without waiting and returns a Future of its reply text."""
+        return self._send([command])[0]
+
+    def request(self, command, timeout=None):
+        """Sends a command and waits for its reply."""
+        return self.submit(command).result(timeout)
+
+    def run(self, commands, timeout=None):
+        """Sends every command at once, in order, then waits for all the replies (returned in order)."""
+        return [future.result(timeout) for future in self._send(commands)]
+
+    def batch(self, commands, timeout=None):
+        """
+        Runs OPEN/EDIT/RM/MERGE commands and an optional final COMMIT on the
+        current branch as one unit: all of them are applied, or none.
+        """
+        return self.request(encode_batch(commands), timeout)
+
+    def _send(self, commands):
+        """Sends the commands, the reads to the followers if there are any. Returns their reply Futures."""
+        if not self.followers:
+            return self._write(commands)
+        futures = [None] * len(commands)
+        own = []
+        for index, command in enumerate(commands):
+            if command.partition(":")[0].strip().upper() in READ_COMMANDS:
+                futures[index] = next(self._next_follower)._write([command])[0]
+            else:
+                own.append(index)
+        for index, future in zip(own, self._write([commands[index] for index in own])):
+            futures[index] = future
+        return futures
+
+    def _write(self, commands):
+        futures = []
+        frames = []
+        with self._send_lock:
+            if self._closed:
+                raise ConnectionError("Connection to the server is closed.")
+            for command in commands:
+                request_id = self._new_request_id()
+                future = self._pending[request_id] = Future()
+                futures.append(future)
+                frames.append(encode_frame(OP_COMMAND, with_request_id(request_id, command), FLAG_REQUEST_ID))
+            self.sock.sendall(b"".join(frames))
+        return futures
+
+    def _new_request_id(self):
+        """
+        The next request ID (the caller holds _send_lock). IDs are 4 bytes on the
+        wire, so they wrap around, skipping any still waiting for its reply.
+        """
+        while True:
+            request_id = self._next_id
+            self._next_id = (request_id + 1) % (1 << 8 * REQUEST_ID.size)
+            if request_id not in self._pending:
+                return request_id
+
+    def _read_replies(self):
+        try:
+            while True:
+                frame = recv_frame(self.sock)
+                if frame is None:
+                    break
+                opcode, flags, body = frame
+                if opcode == OP_NOTIFY:
+                    self.notices.append(body.decode())
+                elif opcode == OP_RESPONSE and flags & FLAG_REQUEST_ID:
+                    request_id, body = split_request_id(body)
+                    with self._send_lock:
+                        future = self._pending.pop(request_id, None)
+                    if future is not None: # A reply to no request waiting for one is dropped
+                        future.set_result(str(decompress_body(body, flags), "utf-8", errors="replace"))
+        except (OSError, FrameError):
+            pass
+        finally:
+            with self._send_lock:
+                self._closed = True
+                pending, self._pending = self._pending, {}
+            for future in pending.values():
+                future.set_exception(ConnectionError("Server closed the connection."))
+
+    def close(self):
+        """Disconnects (replies still on their way are lost)."""
+        for follower in self.followers:
+            follower.close()
+        try:
+            self.sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+        self._reader.join()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 def start_client():
     """
     Main function to initialize the client application and handle user input.
@@ -25,30 +245,57 @@ def start_client():
     
     # 1. Authentication Handshake
     username = input("Enter your Username: ").strip()
-    sock.sendall(username.encode())
+    send_frame(sock, OP_HELLO, f"{username}\nCAPS:{','.join(CAPABILITIES)}")
 
 
     # 2. Receive initial welcome message and display commands
     try:
         # Receive initial welcome message (blocking call)
-        welcome_msg = sock.recv(BUFFER_SIZE).decode()
+        welcome_msg = receive_response(sock)
+        if welcome_msg is None:
+            raise ConnectionError("Server closed the connection.")
+        # The first line of the welcome lists what the server agreed to use
+        server_capabilities = []
+        if welcome_msg.startswith("CAPS:"):
+            caps_line, _, welcome_msg = welcome_msg.partition("\n")
+            server_capabilities = caps_line[5:].split(",")
         print("\n" + "=" * 60)
         print(welcome_msg)
         print("\n--- AVAILABLE COMMANDS ---")
+        print("  OPEN:[path] -> Choose the file EDIT/PEEK/SHOW work on (new paths are created on EDIT).")
+        print("  LS[:dir] -> List the files of your branch.")
+        print("  RM:[path] -> Delete a file or directory from your branch.")
         print("  EDIT -> Modify your current branch's file content.")
         print("  UNDO -> Revert the last change in your current branch.")
         print("  REDO -> Re-apply an undone change.")
         print("  BRANCH:[name] -> Create a new branch from current state.")
-        print("  CHECKOUT:[name] -> Switch your active branch.")
+        print("  CHECKOUT:[name] -> Switch your active branch (or check out a version ID).")
+        print("  DELETE_BRANCH:[name] -> Delete a branch and its undo history.")
         print("  MERGE:[name] -> Merge a named branch into your current branch.")
-        print("  COMMIT -> Save your branch content as the official server file.")
+        print("  COMMIT[:message] -> Record a commit and make it the official server file.")
+        print("  LOG[:branch|id] -> Show the history of your branch (or of a branch/version).")
+        print("  DIFF:[a]..[b] -> Show the line differences between two branches or versions.")
+        print("  GREP:[text] / GREP:ALL:[text] -> Find a string at every branch head (ALL: and in every commit).")
+        print("  STATS -> Show server statistics (connections, traffic, command latencies).")
         print("  PEEK -> View your current branch's draft content.")
+        print("  SYNC -> Re-download your branch's draft (it is normally kept up to date automatically).")
         print("  SHOW -> View the current official server file content (opens new window).")
+        print("  SHOW:[offset]:[length] / SHOW:LINES:[first]:[count] -> Print part of the official file.")
         print("  EXIT -> Disconnect and quit.")
         print("=" * 60)
     except Exception:
         print("Server disconnected during initial connection.")
         return
+
+    # 3. Download the draft once; from now on it is kept in step by deltas
+    draft = LocalDraft()
+    send_frame(sock, OP_COMMAND, "SYNC")
+    response = receive_response(sock)
+    if response is None or draft.apply_response(response) is None:
+        print("Server disconnected during initial connection.")
+        return
+    # The last official file shown, (etag, SHOW response): SHOW only downloads it again once it changed
+    official_copy = None
     
     
         
@@ -66,15 +313,14 @@ def start_client():
             if not cmd:
 
                 #########################
-                sock.settimeout(0.1)
-                try:
-                    incoming = sock.recv(BUFFER_SIZE).decode()
-                    if incoming:
-                        print(f"\n{incoming}")
-                except:
-                    pass
-                finally:
-                    sock.settimeout(None)
+                # Poll briefly for broadcast notices; frames are only read when data is waiting
+                readable, _, _ = select([sock], [], [], 0.1)
+                while readable:
+                    frame = recv_frame(sock)
+                    if frame is None:
+                        break
+                    print(f"\n{frame[2].decode()}")
+                    readable, _, _ = select([sock], [], [], 0)
                 ###################
                 continue
 
@@ -90,29 +336,61 @@ def start_client():
                         break
                     content_lines.append(line)
                 
-                # Format the command for the server: EDIT:full_content
+                # Only the difference from the local copy is sent: PATCH:<base version>\n<delta>
                 full_content = "\n".join(content_lines)
-                command_to_send = f"EDIT:{full_content}"
+                ops = compute_delta(draft.content, full_content)
+                command_to_send = (f"PATCH:{draft.revision_id}\n", *encode_delta(ops))
+                pending_content = full_content
                 
+            elif cmd.upper() == 'SHOW' and "etag" in server_capabilities:
+                command_to_send = f"SHOW:ETAG:{official_copy[0]}" if official_copy else "SHOW:ETAG"
+                pending_content = None
+
             else:
                 command_to_send = cmd
+                pending_content = None
 
             # Send the command to the server
-            sock.sendall(command_to_send.encode())
+            send_frame(sock, OP_COMMAND, command_to_send)
             
             # Receive and Process Server Response (Blocking) 
-            response = sock.recv(BUFFER_SIZE).decode()
+            response = receive_response(sock)
             
-            if not response:
+            if response is None:
                 # Server disconnected
                 print("\nServer has shut down.")
                 break
 
+            # A tagged SHOW: remember the file, or reuse the copy if it has not changed
+            if response.startswith("NOT_MODIFIED:") and official_copy:
+                response = official_copy[1]
+            elif response.startswith("ETAG:"):
+                etag_line, _, response = response.partition("\n")
+                official_copy = (etag_line[5:], response)
+
+            # Draft responses update the local copy (a delta, or just a version ID)
+            if response.startswith("DRAFT_"):
+                status = draft.apply_response(response, pending_content)
+                if status is None:
+                    # Our copy no longer matches the server's idea of it: download it again
+                    send_frame(sock, OP_COMMAND, "SYNC")
+                    response = receive_response(sock)
+                    if response is None:
+                        print("\nServer has shut down.")
+                        break
+                    status = draft.apply_response(response)
+                print("\n" + "-" * 30)
+                draft.print_draft(status)
+                print("-" * 30)
+
             # Check for the SHOW command prefix
-            if response.startswith("SHOW_CONTENT:"):
+            elif response.startswith("SHOW_CONTENT:"):
                 # Extract content by removing the prefix
                 content = response[14:].strip() 
                 
+                # Tkinter is only loaded once a window is needed, so the client starts quickly
+                from utils import display_server_content
+
                 # Run the blocking GUI in a NEW THREAD so the main loop can continue
                 gui_thread = Thread(target=display_server_content, args=(content,), daemon=True)
                 gui_thread.start()
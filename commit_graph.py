@@ -0,0 +1,233 @@
+import hashlib
+import heapq
+import time
+from collections import namedtuple
+from threading import Lock
+
+# One node of the revision DAG.
+#   object_id   -> root tree of the repository at this revision (ObjectStore ID)
+#   parents     -> parent revision IDs: none for the root, one for an edit, two for a merge
+#   generation  -> 1 + max(parent generations); roots have generation 1
+#   depth       -> number of first-parent steps down to the root
+#   jump        -> a first-parent ancestor used to skip down the chain in O(log n) steps
+#   merge_depth -> depth of the nearest merge on the first-parent chain (-1 if none)
+#   author, timestamp, kind ("root", "edit", "merge" or "commit"), message
+Revision = namedtuple("Revision", "object_id parents generation depth jump merge_depth "
+                                  "author timestamp kind message")
+
+_FLAG_FIRST, _FLAG_SECOND = 1, 2
+
+
+class CommitGraph:
+    """
+    The revision DAG shared by every branch. Each revision points at the object
+    ID of its root tree and at its parent revisions: one parent for an edit,
+    two for a merge. Branch heads and history entries are revision IDs, so the
+    ancestry of any two branch states can be compared to find their merge base.
+
+    Ancestry queries are indexed rather than full walks:
+      - generation numbers prune any revision too old to matter,
+      - jump pointers on the first-parent chain (skew-binary skip list) find the
+        ancestor at a given depth in O(log n) steps,
+      - merge_depth lets a walk skip whole runs of single-parent revisions.
+    """
+    def __init__(self):
+        # Nodes: { "revision_id": Revision }
+        self._nodes = {}
+        self._lock = Lock()
+
+        # Optional persistence hook, called as on_new_revision(revision_id, node)
+        # with the graph lock held (same contract as ObjectStore.on_new_object).
+        self.on_new_revision = None
+
+    @staticmethod
+    def hash_revision(object_id, parents, author="", timestamp=0.0, kind="edit", message=""):
+        header = f"revision {object_id} {' '.join(parents)}\n{author}\n{timestamp!r}\n{kind}\n{message}"
+        return hashlib.sha1(header.encode()).hexdigest()
+
+    def add(self, object_id, parents=(), author="", message="", kind=None, timestamp=None):
+        """Records a new revision and returns its ID."""
+        parents = tuple(parents)
+        kind = kind or ("edit" if len(parents) == 1 else "merge" if parents else "root")
+        timestamp = time.time() if timestamp is None else timestamp
+        revision_id = self.hash_revision(object_id, parents, author, timestamp, kind, message)
+        with self._lock:
+            if revision_id not in self._nodes:
+                node = self._build_node(revision_id, object_id, parents, author, timestamp, kind, message)
+                self._nodes[revision_id] = node
+                if self.on_new_revision:
+                    self.on_new_revision(revision_id, node)
+        return revision_id
+
+    def _build_node(self, revision_id, object_id, parents, author, timestamp, kind, message):
+        """Computes the index fields (generation, depth, jump, merge_depth) of a new revision."""
+        nodes = self._nodes
+        generation = 1 + max((nodes[p].generation for p in parents), default=0)
+        if not parents:
+            return Revision(object_id, parents, generation, 0, revision_id, -1,
+                            author, timestamp, kind, message)
+
+        parent_id = parents[0]
+        parent = nodes[parent_id]
+        depth = parent.depth + 1
+        # Skew-binary jump pointer: if the parent's jump and its jump's jump
+        # cover equal distances, jump over both; otherwise jump to the parent.
+        # The jump target's depth depends only on `depth`, which lets two chains
+        # be walked down in lockstep (see _first_parent_meet).
+        jump = nodes[parent.jump]
+        if parent.depth - jump.depth == jump.depth - nodes[jump.jump].depth:
+            jump_id = jump.jump
+        else:
+            jump_id = parent_id
+        merge_depth = depth if len(parents) > 1 else parent.merge_depth
+        return Revision(object_id, parents, generation, depth, jump_id, merge_depth,
+                        author, timestamp, kind, message)
+
+    def get(self, revision_id):
+        return self._nodes[revision_id]
+
+    def object_id(self, revision_id):
+        return self._nodes[revision_id].object_id
+
+    def parents(self, revision_id):
+        return self._nodes[revision_id].parents
+
+    def generation(self, revision_id):
+        return self._nodes[revision_id].generation
+
+    def contains(self, revision_id):
+        return revision_id in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def resolve_prefix(self, prefix):
+        """Full revision ID for a unique ID prefix (at least 4 characters), else None."""
+        if prefix in self._nodes:
+            return prefix
+        if len(prefix) < 4:
+            return None
+        matches = [revision_id for revision_id in list(self._nodes) if revision_id.startswith(prefix)]
+        return matches[0] if len(matches) == 1 else None
+
+    def first_parent_history(self, revision_id, limit):
+        """Up to `limit` (revision_id, Revision) pairs following first parents from revision_id."""
+        history = []
+        while revision_id is not None and len(history) < limit:
+            node = self._nodes[revision_id]
+            history.append((revision_id, node))
+            revision_id = node.parents[0] if node.parents else None
+        return history
+
+    # --- Ancestry ---
+    def ancestor_at_depth(self, revision_id, depth):
+        """The first-parent ancestor of revision_id at the given depth, in O(log n) steps."""
+        nodes = self._nodes
+        node = nodes[revision_id]
+        while node.depth > depth:
+            jump = nodes[node.jump]
+            if jump.depth >= depth:
+                revision_id, node = node.jump, jump
+            else:
+                revision_id = node.parents[0]
+                node = nodes[revision_id]
+        return revision_id
+
+    def _first_parent_meet(self, first, second):
+        """Where the first-parent chains of two revisions join (None if they never do)."""
+        nodes = self._nodes
+        depth = min(nodes[first].depth, nodes[second].depth)
+        first = self.ancestor_at_depth(first, depth)
+        second = self.ancestor_at_depth(second, depth)
+        while first != second:
+            a, b = nodes[first], nodes[second]
+            if not a.parents: # Two different roots
+                return None
+            if a.jump != b.jump:
+                first, second = a.jump, b.jump
+            else:
+                first, second = a.parents[0], b.parents[0]
+        return first
+
+    def is_ancestor(self, ancestor, revision_id):
+        """True if `ancestor` is reachable from revision_id (a revision is its own ancestor)."""
+        if ancestor == revision_id:
+            return True
+        nodes = self._nodes
+        target = nodes[ancestor]
+        # Most queries are answered by the first-parent chain alone
+        if target.depth <= nodes[revision_id].depth and self.ancestor_at_depth(revision_id, target.depth) == ancestor:
+            return True
+        stack = [revision_id]
+        expanded = set()
+        while stack:
+            current = stack.pop()
+            if current == ancestor:
+                return True
+            node = nodes[current]
+            if node.generation <= target.generation:
+                continue
+            # The run of single-parent revisions from `current` down to its nearest
+            # merge is checked with one depth lookup instead of being walked
+            if node.merge_depth <= target.depth <= node.depth:
+                if self.ancestor_at_depth(current, target.depth) == ancestor:
+                    return True
+            if node.merge_depth < 0:
+                continue
+            merge_id = self.ancestor_at_depth(current, node.merge_depth)
+            if merge_id in expanded:
+                continue
+            expanded.add(merge_id)
+            stack.extend(nodes[merge_id].parents)
+        return False
+
+    def merge_base(self, first, second):
+        """
+        Best common ancestor of two revisions (None if the histories are unrelated).
+
+        1. The point where both first-parent chains join is found with jump
+           pointers. If neither chain has a merge above it, it is the answer.
+        2. Otherwise both histories are painted newest-generation-first; the first
+           revision reached from both sides is a best common ancestor. Revisions
+           older than the join point are never visited.
+        """
+        if first == second:
+            return first
+        nodes = self._nodes
+        meet = self._first_parent_meet(first, second)
+        if meet is not None:
+            meet_depth = nodes[meet].depth
+            if nodes[first].merge_depth <= meet_depth and nodes[second].merge_depth <= meet_depth:
+                return meet
+        floor = nodes[meet].generation if meet is not None else 0
+
+        flags = {first: _FLAG_FIRST, second: _FLAG_SECOND}
+        heap = [(-nodes[first].generation, first), (-nodes[second].generation, second)]
+        heapq.heapify(heap)
+        while heap:
+            _, revision_id = heapq.heappop(heap)
+            flag = flags[revision_id]
+            if flag == _FLAG_FIRST | _FLAG_SECOND:
+                return revision_id
+            for parent in nodes[revision_id].parents:
+                if nodes[parent].generation < floor:
+                    continue
+                if parent not in flags:
+                    flags[parent] = flag
+                    heapq.heappush(heap, (-nodes[parent].generation, parent))
+                else:
+                    flags[parent] |= flag
+        return meet
+
+    # --- Persistence support ---
+    def load_entry(self, revision_id, node):
+        with self._lock:
+            self._nodes[revision_id] = Revision(*node)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._nodes)
+
+    def restore(self, nodes):
+        with self._lock:
+            self._nodes = {revision_id: Revision(*node) for revision_id, node in nodes.items()}
@@ -5,4 +5,34 @@ SRVR_HOST = '0.0.0.0'
 HOST = '' # => wifi ipv4 with which servered system is connected 
 PORT = 5050             # The communication line
 SHARED_FILE = "server_repo.txt" # Where the final commit lives
-BUFFER_SIZE = 4096      # How much data we receive at once
\ No newline at end of file
+BUFFER_SIZE = 4096      # How much data we receive at once
+DELTA_KEYFRAME_INTERVAL = 16  # Store a full copy of a file every N versions (the rest are deltas)
+OBJECT_CACHE_BYTES = 8 * 1024 * 1024  # Decompressed versions kept hot in memory
+MAX_FRAME_SIZE = 256 * 1024 * 1024  # Largest single message accepted from the network
+STREAM_CHUNK_SIZE = 64 * 1024  # Chunk size when streaming large message bodies
+LISTEN_BACKLOG = 1024   # Pending connections the OS queues before accept()
+SERVER_MODE = "thread"  # "thread" (one thread per client) or "asyncio" (one event loop)
+DATA_DIR = "vcs_data"   # Write-ahead log and checkpoints (branches, history, sessions)
+WAL_FLUSH_INTERVAL = 0.005  # Seconds between background log flushes (commits flush immediately)
+WAL_CHECKPOINT_BYTES = 64 * 1024 * 1024  # Compact the log into a checkpoint after this many bytes
+LOG_LIMIT = 20  # Revisions listed by LOG
+TREE_CACHE_ENTRIES = 4096  # Parsed directory trees kept in memory
+DEFAULT_PATH = "server_repo.txt"  # Repository path of the imported SHARED_FILE; where new sessions start
+NOTIFY_QUEUE_LIMIT = 256  # Notices queued for one client before it is evicted as a slow consumer
+LOG_LEVEL = "INFO"  # Server log level; DEBUG also logs every command received
+METRICS_FILE = None  # Path for a periodic Prometheus-format metrics dump (None: disabled)
+METRICS_INTERVAL = 10  # Seconds between metrics dumps
+HISTORY_DEPTH_LIMIT = 1000  # Undo states kept per branch (None: unlimited); older ones are dropped
+BRANCH_CACHE_ENTRIES = 1024  # Branches kept in memory; the least recently used are spilled to disk
+MAPPED_FILE_ENTRIES = 16  # Official file versions kept written out and memory-mapped for SHOW
+SHARD_COUNT = None  # Worker processes in sharded mode (None: one per CPU core)
+SHARD_WORKER_THREADS = 16  # Commands one shard runs at once (waits for disk overlap; CPU work uses one core per shard)
+COMPRESS_MIN_BYTES = 1024  # Replies smaller than this are sent uncompressed even when the session negotiated compression
+COMPRESSION_LEVEL = 3  # zlib (1-9) / zstd (1-22) level for replies; low levels keep the CPU cost per reply small
+GREP_LIMIT = 100  # Matching lines GREP lists per section (branch heads, committed versions); the rest are only counted
+SEARCH_INDEX_DELAY = 0.5  # Seconds the GREP indexer lets changes pile up between batches (a search never waits for it)
+REPLICATION_PORT = None  # Port where the server streams its log to read-only followers (None: disabled)
+REPLICATION_HOST = '127.0.0.1'  # Address the replication port listens on (any other than loopback needs REPLICATION_SECRET)
+REPLICATION_SECRET = None  # Secret shared by a primary and its followers (the VCS_REPLICATION_SECRET environment variable overrides it)
+REPLICATION_QUEUE_BYTES = 64 * 1024 * 1024  # Log bytes queued for one follower before it is dropped (it reconnects and reloads a snapshot)
+REPLICATION_RETRY_INTERVAL = 1.0  # Seconds a follower waits between attempts to reach its primary
@@ -0,0 +1,153 @@
+from merge import diff_lines, common_prefix_length, common_suffix_length
+
+# A delta is a list of operations that rebuild a target text from a base text:
+#   ("copy", start, end)  -> append base[start:end]
+#   ("insert", text)      -> append the literal text
+
+
+def compute_delta(base, target):
+    """
+    Computes a compact delta that turns `base` into `target`.
+    Common prefixes and suffixes are trimmed first, so a small local edit on a
+    large file costs O(size of the change) in the resulting delta.
+    """
+    # 1. Trim the common prefix and suffix (the usual case for an interactive edit)
+    limit = min(len(base), len(target))
+    prefix = common_prefix_length(base, target, limit)
+    suffix = common_suffix_length(base, target, limit - prefix)
+
+    ops = []
+    if prefix:
+        ops.append(("copy", 0, prefix))
+
+    # 2. Line-diff the changed middle so scattered edits still share unchanged lines
+    base_mid = base[prefix:len(base) - suffix]
+    target_mid = target[prefix:len(target) - suffix]
+    ops.extend(_line_ops(base_mid, target_mid, prefix))
+
+    if suffix:
+        ops.append(("copy", len(base) - suffix, len(base)))
+    return _coalesce(ops)
+
+
+def _line_ops(base_mid, target_mid, offset):
+    """Diffs the middle section line by line; returns ops with absolute base offsets."""
+    if not base_mid or not target_mid:
+        return [("insert", target_mid)] if target_mid else []
+
+    base_lines = base_mid.splitlines(keepends=True)
+    target_lines = target_mid.splitlines(keepends=True)
+    if len(base_lines) == 1 or len(target_lines) == 1:
+        return [("insert", target_mid)]
+
+    # Character offset of every line start in the base middle
+    starts = [0]
+    for line in base_lines:
+        starts.append(starts[-1] + len(line))
+
+    ops = []
+    base_pos = 0
+    for b_start, b_end, t_start, t_end in diff_lines(base_lines, target_lines):
+        if b_start > base_pos:
+            ops.append(("copy", offset + starts[base_pos], offset + starts[b_start]))
+        if t_end > t_start:
+            ops.append(("insert", "".join(target_lines[t_start:t_end])))
+        base_pos = b_end
+    if base_pos < len(base_lines):
+        ops.append(("copy", offset + starts[base_pos], offset + starts[len(base_lines)]))
+    return ops
+
+
+def _coalesce(ops):
+    """Merges adjacent copy ranges and adjacent inserts."""
+    merged = []
+    for op in ops:
+        if merged and op[0] == merged[-1][0]:
+            last = merged[-1]
+            if op[0] == "copy" and last[2] == op[1]:
+                merged[-1] = ("copy", last[1], op[2])
+                continue
+            if op[0] == "insert":
+                merged[-1] = ("insert", last[1] + op[1])
+                continue
+        merged.append(op)
+    return merged
+
+
+def apply_delta(base, ops):
+    """Rebuilds the target text from the base text and a delta."""
+    parts = []
+    for op in ops:
+        if op[0] == "copy":
+            parts.append(base[op[1]:op[2]])
+        else:
+            parts.append(op[1])
+    return "".join(parts)
+
+
+def check_delta(ops, base_length):
+    """Raises ValueError if a copy in the delta falls outside a base of `base_length` characters."""
+    for op in ops:
+        if op[0] == "copy":
+            _check_copy(op[1], op[2], base_length)
+
+
+def _check_copy(start, end, base_length):
+    if start < 0 or end < start or (base_length is not None and end > base_length):
+        raise ValueError(f"Copy range {start}-{end} is outside the base.")
+
+
+def delta_size(ops):
+    """Approximate number of characters a delta costs to store."""
+    return sum(len(op[1]) if op[0] == "insert" else 16 for op in ops)
+
+
+# --- Wire encoding ---
+# A delta travels as text: a count line, then one line per op.
+#   "C start end\n"       -> ("copy", start, end)
+#   "I length\n" + text   -> ("insert", text), length in characters
+# The encoding is self-delimiting, so it can be followed by other text.
+
+def encode_delta(ops):
+    """Returns the delta as a list of string parts (insert texts are not copied)."""
+    parts = [f"{len(ops)}\n"]
+    for op in ops:
+        if op[0] == "copy":
+            parts.append(f"C {op[1]} {op[2]}\n")
+        else:
+            parts.append(f"I {len(op[1])}\n")
+            parts.append(op[1])
+    return parts
+
+
+def decode_delta(text, pos=0, base_length=None):
+    """
+    Parses an encoded delta starting at `pos`. Returns (ops, end_position).
+    Raises ValueError if the encoding is malformed or a copy range falls
+    outside a base of `base_length` characters.
+    """
+    def read_line():
+        nonlocal pos
+        end = text.find("\n", pos)
+        if end < 0:
+            raise ValueError("Truncated delta.")
+        line, pos = text[pos:end], end + 1
+        return line
+
+    count = int(read_line())
+    ops = []
+    for _ in range(count):
+        fields = read_line().split(" ")
+        if fields[0] == "C" and len(fields) == 3:
+            start, end = int(fields[1]), int(fields[2])
+            _check_copy(start, end, base_length)
+            ops.append(("copy", start, end))
+        elif fields[0] == "I" and len(fields) == 2:
+            length = int(fields[1])
+            if length < 0 or pos + length > len(text):
+                raise ValueError("Truncated insert.")
+            ops.append(("insert", text[pos:pos + length]))
+            pos += length
+        else:
+            raise ValueError(f"Unknown delta op '{fields[0]}'.")
+    return ops, pos
@@ -0,0 +1,266 @@
+import struct
+import zlib
+from config import MAX_FRAME_SIZE, STREAM_CHUNK_SIZE, COMPRESS_MIN_BYTES, COMPRESSION_LEVEL
+
+try:
+    import zstandard # Optional (pip install zstandard); zlib is always available
+except ImportError:
+    zstandard = None
+
+# Wire format of every message exchanged between client and server:
+#
+#   +--------+-------+----------------+------------------+
+#   | opcode | flags | body length    | body             |
+#   | 1 byte | 1 byte| 8 bytes (u64)  | <length> bytes   |
+#   +--------+-------+----------------+------------------+
+#
+# The length header means a message is always read whole, no matter how the
+# TCP stream splits or merges it, and the body is binary-safe.
+
+HEADER = struct.Struct(">BBQ")
+
+# --- Opcodes ---
+OP_HELLO = 1      # client -> server: handshake, body is the username
+OP_COMMAND = 2    # client -> server: a command string (EDIT:..., UNDO, ...)
+OP_RESPONSE = 3   # server -> client: the reply to the last command
+OP_NOTIFY = 4     # server -> client: an unsolicited broadcast (commit/merge notices)
+
+# --- Notification types (the flags byte of a NOTIFY frame) ---
+NOTIFY_INFO = 0
+NOTIFY_COMMIT = 1
+NOTIFY_MERGE = 2
+
+# --- Body encodings (the flags byte of a RESPONSE frame) ---
+# A session only gets compressed replies after it asked for them in the
+# handshake (see protocol.negotiate), so the flags of a reply to a client
+# that did not are always ENCODING_NONE.
+ENCODING_NONE = 0
+ENCODING_ZLIB = 1
+ENCODING_ZSTD = 2
+
+# --- Request IDs (a flag bit of COMMAND and RESPONSE frames) ---
+# A client that agreed to 'request-id' in the handshake may start a command's
+# body with a 4-byte ID and set FLAG_REQUEST_ID; the reply carries the same ID
+# and flag. The client can then send many commands without waiting (pipelining)
+# and match each reply to its command. The encoding is in the other flag bits.
+FLAG_REQUEST_ID = 0x80
+REQUEST_ID = struct.Struct(">I")
+
+# { "capability name": encoding } of the encodings this process can use
+ENCODINGS = {"zlib": ENCODING_ZLIB}
+if zstandard is not None:
+    ENCODINGS["zstd"] = ENCODING_ZSTD
+
+OPCODE_NAMES = {
+    OP_HELLO: "HELLO",
+    OP_COMMAND: "COMMAND",
+    OP_RESPONSE: "RESPONSE",
+    OP_NOTIFY: "NOTIFY",
+}
+
+
+class FrameError(Exception):
+    """Raised when the peer sends a malformed or oversized frame."""
+
+
+def _as_parts(body):
+    """Normalises a body (str, bytes-like, or a sequence of those) into a list of bytes-like parts."""
+    if isinstance(body, (list, tuple)):
+        parts = body
+    else:
+        parts = (body,)
+    return [part.encode() if isinstance(part, str) else part for part in parts]
+
+
+def body_length(body):
+    """Size in bytes of a body in any of the forms send_frame() accepts."""
+    return sum(memoryview(part).nbytes for part in _as_parts(body))
+
+
+def compress_body(body, encoding, min_bytes=COMPRESS_MIN_BYTES, level=COMPRESSION_LEVEL):
+    """
+    Compresses a body (any form send_frame() accepts) with an ENCODING_*.
+    Parts are fed to the compressor one by one, so a large reply is not joined
+    first. Returns (body, flags): the compressed bytes and the encoding, or the
+    body unchanged and ENCODING_NONE if it is small or does not shrink.
+    """
+    if encoding == ENCODING_NONE:
+        return body, ENCODING_NONE
+    parts = _as_parts(body)
+    length = sum(memoryview(part).nbytes for part in parts)
+    if length < min_bytes:
+        return parts, ENCODING_NONE
+
+    if encoding == ENCODING_ZSTD:
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    else:
+        compressor = zlib.compressobj(level)
+    chunks = [compressor.compress(part) for part in parts if part]
+    chunks.append(compressor.flush())
+    compressed = b"".join(chunks)
+    if len(compressed) >= length:
+        return parts, ENCODING_NONE
+    return compressed, encoding
+
+
+def decompress_body(body, flags):
+    """Inverse of compress_body(): the original bytes of a received body, from the flags of its frame."""
+    encoding = flags & ~FLAG_REQUEST_ID
+    if encoding == ENCODING_ZLIB:
+        return zlib.decompress(body)
+    if encoding == ENCODING_ZSTD:
+        if zstandard is None:
+            raise FrameError("Received a zstd-compressed frame, but the zstandard module is not installed.")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+    if encoding != ENCODING_NONE:
+        raise FrameError(f"Unknown body encoding {encoding}.")
+    return body
+
+
+def split_request_id(body):
+    """(request ID, memoryview of the rest) of the body of a frame flagged FLAG_REQUEST_ID."""
+    if len(body) < REQUEST_ID.size:
+        raise FrameError("Frame is too short for its request ID.")
+    view = memoryview(body)
+    return REQUEST_ID.unpack(view[:REQUEST_ID.size])[0], view[REQUEST_ID.size:]
+
+
+def with_request_id(request_id, body):
+    """A body (any form send_frame() accepts) as a list of parts that starts with the request ID."""
+    return [REQUEST_ID.pack(request_id), *_as_parts(body)]
+
+
+def send_frame(sock, opcode, body=b"", flags=0):
+    """
+    Sends one frame. The body may be a str, any bytes-like object, or a list/tuple
+    of those; parts are written one after another so a large payload never has
+    to be joined into a single buffer first. Returns the number of bytes sent.
+    """
+    parts = _as_parts(body)
+    length = sum(memoryview(part).nbytes for part in parts)
+    if length <= STREAM_CHUNK_SIZE:
+        # One write for a small frame: a lone header segment would make Nagle's
+        # algorithm hold the body back until the peer's delayed ACK (~40ms)
+        sock.sendall(HEADER.pack(opcode, flags, length) + b"".join(parts))
+        return HEADER.size + length
+    sock.sendall(HEADER.pack(opcode, flags, length))
+    for part in parts:
+        if part:
+            sock.sendall(part)
+    return HEADER.size + length
+
+
+def encode_frame(opcode, body=b"", flags=0):
+    """Returns a whole frame as one bytes object (for small bodies sent to many peers)."""
+    parts = _as_parts(body)
+    return HEADER.pack(opcode, flags, sum(memoryview(part).nbytes for part in parts)) + b"".join(parts)
+
+
+def send_frame_stream(sock, opcode, length, chunks, flags=0):
+    """
+    Sends one frame whose body is produced by an iterable of bytes-like chunks
+    (e.g. reading a file piece by piece). `length` must be the exact total size.
+    """
+    sock.sendall(HEADER.pack(opcode, flags, length))
+    sent = 0
+    for chunk in chunks:
+        sock.sendall(chunk)
+        sent += memoryview(chunk).nbytes
+    if sent != length:
+        raise FrameError(f"Streamed body was {sent} bytes, header announced {length}.")
+
+
+def _recv_exact_into(sock, view):
+    """Fills the memoryview completely from the socket. Returns False on EOF."""
+    received = 0
+    total = view.nbytes
+    while received < total:
+        count = sock.recv_into(view[received:], total - received)
+        if count == 0:
+            return False
+        received += count
+    return True
+
+
+def recv_header(sock):
+    """
+    Reads one frame header. Returns (opcode, flags, length), or None if the peer
+    closed the connection cleanly before a new frame started.
+    """
+    header = bytearray(HEADER.size)
+    view = memoryview(header)
+    count = sock.recv_into(view, HEADER.size)
+    if count == 0:
+        return None
+    if count < HEADER.size and not _recv_exact_into(sock, view[count:]):
+        raise FrameError("Connection closed in the middle of a frame header.")
+
+    opcode, flags, length = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit.")
+    return opcode, flags, length
+
+
+def recv_frame(sock):
+    """
+    Reads one complete frame. Returns (opcode, flags, body) where body is a
+    bytearray of exactly the announced length, or None on a clean disconnect.
+    The body is received directly into one preallocated buffer.
+    """
+    header = recv_header(sock)
+    if header is None:
+        return None
+    opcode, flags, length = header
+
+    body = bytearray(length)
+    if length and not _recv_exact_into(sock, memoryview(body)):
+        raise FrameError("Connection closed in the middle of a frame body.")
+    return opcode, flags, body
+
+
+def iter_frame_body(sock, length, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yields the body of a frame (whose header was read with recv_header) in
+    chunks of at most chunk_size bytes, for consumers that stream to a file.
+    """
+    remaining = length
+    while remaining:
+        chunk = bytearray(min(chunk_size, remaining))
+        if not _recv_exact_into(sock, memoryview(chunk)):
+            raise FrameError("Connection closed in the middle of a frame body.")
+        remaining -= len(chunk)
+        yield chunk
+
+
+# --- asyncio stream variants (used by the asyncio server mode) ---
+# readexactly() raises asyncio.IncompleteReadError, a subclass of EOFError;
+# catching EOFError spares the client (which never uses these) importing asyncio.
+async def read_frame_async(reader):
+    """asyncio counterpart of recv_frame(): returns (opcode, flags, body) or None on EOF."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except EOFError as e:
+        if not e.partial:
+            return None
+        raise FrameError("Connection closed in the middle of a frame header.") from None
+
+    opcode, flags, length = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise FrameError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit.")
+    try:
+        body = await reader.readexactly(length) if length else b""
+    except EOFError:
+        raise FrameError("Connection closed in the middle of a frame body.") from None
+    return opcode, flags, body
+
+
+async def write_frame_async(writer, opcode, body=b"", flags=0):
+    """asyncio counterpart of send_frame(); waits for the transport to drain."""
+    parts = _as_parts(body)
+    length = sum(memoryview(part).nbytes for part in parts)
+    writer.write(HEADER.pack(opcode, flags, length))
+    for part in parts:
+        if part:
+            writer.write(part)
+    await writer.drain()
+    return HEADER.size + length
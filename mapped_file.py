@@ -0,0 +1,116 @@
+import mmap
+import os
+import shutil
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+
+# Granularity of the line index: the number of newlines before every block of
+# this many bytes. Finding a line scans at most one block, and the index of a
+# 1 GB file takes 512 KB.
+LINE_INDEX_BLOCK = 16 * 1024
+
+
+class MappedFile:
+    """
+    Read-only memory map of a file. read() returns memoryview slices of the
+    map, which the framing layer sends straight to the socket, so serving a
+    range never copies the file into a Python string. `object_id` names the
+    stored version it holds, if it came from a MappedFileCache.
+    """
+    def __init__(self, path, object_id=None):
+        self.path = path
+        self.object_id = object_id
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            # mmap cannot map an empty file
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self._newlines_before = None # array: newlines before each LINE_INDEX_BLOCK
+        self._newlines = 0
+        self._lock = Lock()
+
+    def read(self, offset=0, length=None):
+        """A memoryview of `length` bytes from `offset` (clipped to the end of the file)."""
+        end = self.size if length is None else min(self.size, offset + length)
+        return memoryview(self._map)[min(offset, self.size):end]
+
+    def line_count(self):
+        self._build_line_index()
+        ends_open = self.size and self._map[self.size - 1:self.size] != b"\n"
+        return self._newlines + (1 if ends_open else 0)
+
+    def line_offset(self, line):
+        """Byte offset where 0-based line `line` starts (the file size past the last line)."""
+        self._build_line_index()
+        if line <= 0:
+            return 0
+        if line > self._newlines:
+            return self.size
+        # The block holding the line-th newline, then a scan inside it
+        block = bisect_left(self._newlines_before, line) - 1
+        position = block * LINE_INDEX_BLOCK
+        for _ in range(line - self._newlines_before[block]):
+            position = self._map.find(b"\n", position) + 1
+        return position
+
+    def line_range(self, first, count):
+        """Byte range (start, end) of `count` lines starting at 0-based line `first`."""
+        return self.line_offset(first), self.line_offset(first + count)
+
+    def _build_line_index(self):
+        """Counts newlines per block once (one C-level count per block, not a Python step per line)."""
+        with self._lock:
+            if self._newlines_before is not None:
+                return
+            index = array("q", [0])
+            total = 0
+            for position in range(0, self.size, LINE_INDEX_BLOCK):
+                total += self._map[position:position + LINE_INDEX_BLOCK].count(b"\n")
+                index.append(total)
+            self._newlines = total
+            self._newlines_before = index
+
+
+class MappedFileCache:
+    """
+    Materialises stored file versions as plain files under `directory` (named
+    by object ID, so a file never changes once written) and keeps the `limit`
+    most recently used ones memory-mapped. A version is rebuilt from the
+    object store once; every read after that comes from the page cache.
+    The directory is emptied on startup.
+    """
+    def __init__(self, directory, object_store, limit):
+        self.directory = directory
+        self.object_store = object_store
+        self.limit = limit
+        self._files = OrderedDict()
+        # Held while a file is written and mapped, so eviction never removes a file being opened
+        self._lock = Lock()
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+    def open(self, object_id):
+        """Returns the MappedFile of a stored object, writing it out first if needed."""
+        with self._lock:
+            mapped = self._files.get(object_id)
+            if mapped is not None:
+                self._files.move_to_end(object_id)
+                return mapped
+
+            path = os.path.join(self.directory, object_id)
+            if not os.path.exists(path):
+                temp_path = f"{path}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(self.object_store.get(object_id).encode())
+                os.replace(temp_path, path)
+            mapped = self._files[object_id] = MappedFile(path, object_id)
+
+            while len(self._files) > self.limit:
+                _, evicted = self._files.popitem(last=False)
+                try:
+                    # Views handed out earlier keep the mapping alive after the file is gone
+                    os.remove(evicted.path)
+                except OSError:
+                    pass # Windows cannot remove a mapped file; it is cleared on the next start
+            return mapped
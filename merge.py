@@ -0,0 +1,296 @@
+from bisect import bisect_left
+from collections import Counter
+
+# Line diffs are described as change hunks (a_start, a_end, b_start, b_end):
+# lines a[a_start:a_end] of the old text are replaced by b[b_start:b_end].
+# Everything between hunks is unchanged.
+
+MYERS_MAX_COST = 1_000_000  # Above (region size x edit distance) a region is reported as one hunk
+
+
+def diff_lines(a, b):
+    """
+    Computes the change hunks that turn line list `a` into line list `b`.
+
+    1. Identical prefixes and suffixes are trimmed first (the fast path for
+       files with a few scattered edits).
+    2. The rest is split on lines that occur exactly once on both sides
+       (patience diff anchors), so unrelated regions are diffed separately.
+    3. Each remaining region is diffed with Myers' O(ND) algorithm.
+    """
+    if a == b:
+        return []
+    limit = min(len(a), len(b))
+    prefix = common_prefix_length(a, b, limit)
+    suffix = common_suffix_length(a, b, limit - prefix)
+
+    hunks = []
+    _patience(a, b, prefix, len(a) - suffix, prefix, len(b) - suffix, hunks)
+    return _coalesce(hunks)
+
+
+def common_prefix_length(a, b, limit):
+    """
+    Length of the common prefix of two sequences (str or list), at most `limit`.
+    Found by bisecting on slice comparisons, which run at C speed.
+    """
+    low, high = 0, limit
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[low:mid] == b[low:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def common_suffix_length(a, b, limit):
+    """Length of the common suffix of two sequences, at most `limit`."""
+    low, high = 0, limit
+    len_a, len_b = len(a), len(b)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[len_a - mid:len_a - low] == b[len_b - mid:len_b - low]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+def _patience(a, b, a_lo, a_hi, b_lo, b_hi, hunks):
+    """Recursively splits a region on unique common lines, then falls back to Myers."""
+    # Trim equal lines at the region edges
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        a_lo += 1
+        b_lo += 1
+    while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+    if a_lo == a_hi or b_lo == b_hi:
+        if a_lo != a_hi or b_lo != b_hi:
+            hunks.append((a_lo, a_hi, b_lo, b_hi))
+        return
+
+    anchors = _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi)
+    if not anchors:
+        _myers(a, b, a_lo, a_hi, b_lo, b_hi, hunks)
+        return
+
+    prev_a, prev_b = a_lo, b_lo
+    for anchor_a, anchor_b in anchors:
+        if anchor_a != prev_a or anchor_b != prev_b: # Skip empty gaps between adjacent anchors
+            _patience(a, b, prev_a, anchor_a, prev_b, anchor_b, hunks)
+        prev_a, prev_b = anchor_a + 1, anchor_b + 1
+    _patience(a, b, prev_a, a_hi, prev_b, b_hi, hunks)
+
+
+def _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi):
+    """Lines unique on both sides, reduced to their longest increasing subsequence."""
+    count_a = Counter(a[a_lo:a_hi])
+    count_b = Counter(b[b_lo:b_hi])
+    position_b = {}
+    for j in range(b_lo, b_hi):
+        line = b[j]
+        if count_b[line] == 1 and count_a.get(line) == 1:
+            position_b[line] = j
+    pairs = [(i, position_b[a[i]]) for i in range(a_lo, a_hi) if a[i] in position_b]
+    if not pairs:
+        return []
+
+    # Patience sorting: longest increasing subsequence of b positions
+    tails, tail_index, previous = [], [], [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        slot = bisect_left(tails, j)
+        if slot == len(tails):
+            tails.append(j)
+            tail_index.append(k)
+        else:
+            tails[slot] = j
+            tail_index[slot] = k
+        previous[k] = tail_index[slot - 1] if slot else None
+    result = []
+    k = tail_index[-1]
+    while k is not None:
+        result.append(pairs[k])
+        k = previous[k]
+    result.reverse()
+    return result
+
+
+def _myers(a, b, a_lo, a_hi, b_lo, b_hi, hunks):
+    """Myers' greedy shortest-edit-script diff on one region, appending change hunks."""
+    n, m = a_hi - a_lo, b_hi - b_lo
+    max_d = n + m
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace = []
+    for d in range(max_d + 1):
+        if (n + m) * d > MYERS_MAX_COST:
+            # Too expensive (very different region): report it as a single replacement
+            hunks.append((a_lo, a_hi, b_lo, b_hi))
+            return
+        trace.append(v[offset - d:offset + d + 1])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                _myers_backtrack(trace, d, n, m, a_lo, b_lo, hunks)
+                return
+
+
+def _myers_backtrack(trace, final_d, n, m, a_lo, b_lo, hunks):
+    """Walks the saved V arrays backwards and emits the hunks in forward order."""
+    edits = [] # (x, y) points where a single delete/insert starts
+    x, y = n, m
+    for d in range(final_d, 0, -1):
+        v = trace[d] # V before step d, indexed by k + d
+        k = x - y
+        if k == -d or (k != d and v[k - 1 + d] < v[k + 1 + d]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k + d]
+        prev_y = prev_x - prev_k
+        # Skip the diagonal (equal lines) back to the end of the edit
+        x, y = prev_x + (1 if prev_k == k - 1 else 0), prev_y + (0 if prev_k == k - 1 else 1)
+        edits.append((prev_x, prev_y, x, y))
+        x, y = prev_x, prev_y
+    edits.reverse()
+    for x0, y0, x1, y1 in edits:
+        hunks.append((a_lo + x0, a_lo + x1, b_lo + y0, b_lo + y1))
+
+
+def _coalesce(hunks):
+    """Sorts hunks and merges ones that touch."""
+    hunks.sort()
+    merged = []
+    for hunk in hunks:
+        if merged and merged[-1][1] == hunk[0] and merged[-1][3] == hunk[2]:
+            last = merged[-1]
+            merged[-1] = (last[0], hunk[1], last[2], hunk[3])
+        else:
+            merged.append(hunk)
+    return merged
+
+
+def three_way_merge(base, ours, theirs, ours_label="ours", theirs_label="theirs"):
+    """
+    Merges two texts that both descend from `base`.
+    Returns (merged_text, conflicts). Non-overlapping changes from both sides are
+    combined; overlapping changes that differ produce a conflict block with
+    git-style markers, and one entry in `conflicts`:
+        {"base": (start, end), "ours": (start, end), "theirs": (start, end)}
+    with 1-based, inclusive-exclusive line ranges.
+    """
+    if ours == theirs or theirs == base:
+        return ours, []
+    if ours == base:
+        return theirs, []
+
+    base_lines = base.splitlines(keepends=True)
+    ours_lines = ours.splitlines(keepends=True)
+    theirs_lines = theirs.splitlines(keepends=True)
+    changes = ([(h, 0) for h in diff_lines(base_lines, ours_lines)] +
+               [(h, 1) for h in diff_lines(base_lines, theirs_lines)])
+    changes.sort(key=lambda item: (item[0][0], item[0][1]))
+
+    # 1. Group changes whose base ranges overlap or touch
+    groups = []
+    for hunk, side in changes:
+        if groups and hunk[0] <= groups[-1]["hi"]:
+            group = groups[-1]
+            group["hi"] = max(group["hi"], hunk[1])
+            group["hunks"][side].append(hunk)
+        else:
+            groups.append({"lo": hunk[0], "hi": hunk[1], "hunks": ([], [])})
+            groups[-1]["hunks"][side].append(hunk)
+
+    # 2. Emit unchanged base lines between groups, and each group's resolution
+    shift = [0, 0] # Line offset of each side relative to base, before the current group
+    output, conflicts = [], []
+    base_pos = 0
+    for group in groups:
+        lo, hi = group["lo"], group["hi"]
+        output.extend(base_lines[base_pos:lo])
+        base_pos = hi
+
+        ranges = []
+        for side in (0, 1):
+            start = lo + shift[side]
+            growth = sum((h[3] - h[2]) - (h[1] - h[0]) for h in group["hunks"][side])
+            ranges.append((start, hi + shift[side] + growth))
+            shift[side] += growth
+
+        ours_block = ours_lines[ranges[0][0]:ranges[0][1]]
+        theirs_block = theirs_lines[ranges[1][0]:ranges[1][1]]
+        if not group["hunks"][1] or ours_block == theirs_block:
+            output.extend(ours_block)
+        elif not group["hunks"][0]:
+            output.extend(theirs_block)
+        else:
+            conflicts.append({"base": (lo + 1, hi + 1),
+                              "ours": (ranges[0][0] + 1, ranges[0][1] + 1),
+                              "theirs": (ranges[1][0] + 1, ranges[1][1] + 1)})
+            output.append(f"<<<<<<< {ours_label}\n")
+            output.extend(_terminated(ours_block))
+            output.append("=======\n")
+            output.extend(_terminated(theirs_block))
+            output.append(f">>>>>>> {theirs_label}\n")
+
+    output.extend(base_lines[base_pos:])
+    return "".join(output), conflicts
+
+
+def _terminated(lines):
+    """Makes sure a conflict block ends with a newline so the marker starts on its own line."""
+    if lines and not lines[-1].endswith("\n"):
+        return lines[:-1] + [lines[-1] + "\n"]
+    return lines
+
+
+def unified_diff(a, b, a_label="a", b_label="b", context=3):
+    """
+    Formats the diff of two line lists in unified diff format (as `diff -u`).
+    Returns a list of output lines; an empty list when there are no changes.
+    """
+    hunks = diff_lines(a, b)
+    if not hunks:
+        return []
+    output = [f"--- {a_label}\n", f"+++ {b_label}\n"]
+
+    # 1. Group change hunks whose context regions would overlap
+    groups = [[hunks[0]]]
+    for hunk in hunks[1:]:
+        if hunk[0] - groups[-1][-1][1] <= 2 * context:
+            groups[-1].append(hunk)
+        else:
+            groups.append([hunk])
+
+    # 2. Emit each group with its surrounding context
+    for group in groups:
+        a_start = max(group[0][0] - context, 0)
+        a_end = min(group[-1][1] + context, len(a))
+        b_start = group[0][2] - (group[0][0] - a_start)
+        b_end = group[-1][3] + (a_end - group[-1][1])
+        output.append(f"@@ -{_range(a_start, a_end)} +{_range(b_start, b_end)} @@\n")
+        position = a_start
+        for a0, a1, b0, b1 in group:
+            output.extend(" " + line for line in _terminated(a[position:a0]))
+            output.extend("-" + line for line in _terminated(a[a0:a1]))
+            output.extend("+" + line for line in _terminated(b[b0:b1]))
+            position = a1
+        output.extend(" " + line for line in _terminated(a[position:a_end]))
+    return output
+
+
+def _range(start, end):
+    """Unified diff line range: 1-based start and length (start is the line before an empty range)."""
+    length = end - start
+    return f"{start + 1 if length else start},{length}"
@@ -0,0 +1,158 @@
+import logging
+import os
+import time
+from bisect import bisect_left
+from threading import Lock, Thread
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency buckets: 50us doubling up to ~26s.
+# Fixed buckets make observe() one bisect and one increment, and let
+# Prometheus aggregate histograms from several servers.
+LATENCY_BUCKETS = tuple(0.00005 * 2 ** i for i in range(20))
+
+
+class LatencyHistogram:
+    """Counts of observed durations per bucket, plus their sum."""
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1) # Last slot: above the largest bucket
+        self.total = 0.0
+        self._lock = Lock()
+
+    def observe(self, seconds):
+        slot = bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            self.counts[slot] += 1
+            self.total += seconds
+
+    def snapshot(self):
+        """Returns (counts, sum) as a consistent copy."""
+        with self._lock:
+            return list(self.counts), self.total
+
+    @staticmethod
+    def quantile(counts, q):
+        """Upper bound of the bucket holding the q-th quantile (0-1) of a counts snapshot."""
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for slot, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                return LATENCY_BUCKETS[min(slot, len(LATENCY_BUCKETS) - 1)]
+        return LATENCY_BUCKETS[-1]
+
+
+class ServerMetrics:
+    """
+    Counters and per-command latency histograms for one server process.
+    Updating them is a few integer operations, cheap enough for every request;
+    formatting only happens when STATS is called or the metrics file is written.
+    The `vcs` passed to the report methods needs only a `broker` and gauges():
+    the VersionControlSystem, or the sharded server's router.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.commands = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections_active = 0
+        self.connections_total = 0
+        self._lock = Lock()
+
+    def observe_command(self, name, seconds, bytes_in, bytes_out):
+        histogram = self.commands.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = self.commands.setdefault(name, LatencyHistogram())
+        histogram.observe(seconds)
+        self.add_bytes(bytes_in, bytes_out)
+
+    def add_bytes(self, bytes_in=0, bytes_out=0):
+        with self._lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def connection_opened(self):
+        with self._lock:
+            self.connections_active += 1
+            self.connections_total += 1
+
+    def connection_closed(self):
+        with self._lock:
+            self.connections_active -= 1
+
+    def render_text(self, vcs):
+        """Human-readable report returned by the STATS command."""
+        lines = [f"Uptime: {time.time() - self.started:.0f}s",
+                 f"Connections: {self.connections_active} active, {self.connections_total} total, "
+                 f"{vcs.broker.evicted} evicted as slow consumers",
+                 f"Bytes: {self.bytes_in} in, {self.bytes_out} out (replies), {vcs.broker.notice_bytes} out (notices)"]
+        lines.extend(f"{help_text}: {value}" for _, help_text, value in vcs.gauges())
+        commands = sorted(self.commands.items())
+        width = max([len("Command")] + [len(name) for name, _ in commands]) + 1
+        lines.append(f"{'Command':<{width}}{'count':>9}{'mean':>11}{'p50':>11}{'p99':>11}{'p99.9':>11}")
+        for name, histogram in commands:
+            counts, total = histogram.snapshot()
+            count = sum(counts)
+            if not count:
+                continue
+            lines.append(f"{name:<{width}}{count:>9}{total / count * 1000:>9.2f}ms"
+                         + "".join(f"{LatencyHistogram.quantile(counts, q) * 1000:>9.2f}ms"
+                                   for q in (0.5, 0.99, 0.999)))
+        lines.append("(percentiles are bucket upper bounds)")
+        return "\n".join(lines)
+
+    def render_prometheus(self, vcs):
+        """The metrics in the Prometheus text exposition format."""
+        out = [
+            "# HELP vcs_command_duration_seconds Time spent processing a command.",
+            "# TYPE vcs_command_duration_seconds histogram",
+        ]
+        for name, histogram in sorted(self.commands.items()):
+            counts, total = histogram.snapshot()
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, counts):
+                cumulative += count
+                out.append(f'vcs_command_duration_seconds_bucket{{command="{name}",le="{bound:g}"}} {cumulative}')
+            cumulative += counts[-1]
+            out.append(f'vcs_command_duration_seconds_bucket{{command="{name}",le="+Inf"}} {cumulative}')
+            out.append(f'vcs_command_duration_seconds_sum{{command="{name}"}} {total}')
+            out.append(f'vcs_command_duration_seconds_count{{command="{name}"}} {cumulative}')
+
+        counters = [
+            ("bytes_received_total", "counter", "Bytes received from clients", self.bytes_in),
+            ("bytes_sent_total", "counter", "Bytes of replies sent to clients", self.bytes_out),
+            ("notice_bytes_total", "counter", "Bytes of commit/merge notices queued for clients", vcs.broker.notice_bytes),
+            ("connections_total", "counter", "Connections accepted", self.connections_total),
+            ("connections_active", "gauge", "Open connections", self.connections_active),
+            ("clients_evicted_total", "counter", "Clients disconnected for not reading their notices", vcs.broker.evicted),
+        ]
+        counters += [(name, "gauge", help_text, value) for name, help_text, value in vcs.gauges()]
+        for name, kind, help_text, value in counters:
+            out += [f"# HELP vcs_{name} {help_text}.", f"# TYPE vcs_{name} {kind}", f"vcs_{name} {value}"]
+        return "\n".join(out) + "\n"
+
+    def write_prometheus(self, vcs, path):
+        """Writes the Prometheus dump atomically (a scraper never sees half a file)."""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.render_prometheus(vcs))
+        os.replace(temp_path, path)
+
+    def start_prometheus_dump(self, vcs, path, interval):
+        """Rewrites the Prometheus file every `interval` seconds on a daemon thread."""
+        def dump_forever():
+            while True:
+                try:
+                    self.write_prometheus(vcs, path)
+                except OSError as e:
+                    logger.error("[METRICS ERROR] Could not write %s: %s", path, e)
+                time.sleep(interval)
+        Thread(target=dump_forever, name="metrics-dump", daemon=True).start()
+
+
+# Shared by the server modes and the STATS command
+metrics = ServerMetrics()
@@ -0,0 +1,176 @@
+import hashlib
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from config import DELTA_KEYFRAME_INTERVAL, OBJECT_CACHE_BYTES
+from delta import compute_delta, apply_delta, delta_size
+
+
+class ObjectStore:
+    """
+    Content-addressed storage for every version of every file in the VCS.
+    Each distinct piece of content is stored exactly once and is referenced
+    everywhere else by its SHA-1 object ID.
+
+    An object is kept either as a zlib-compressed keyframe (the full content)
+    or as a delta against a base object. Delta chains are capped at
+    `keyframe_interval` entries, so rebuilding any version applies a bounded
+    number of deltas.
+
+    The store is shared by every branch and is safe to use from many threads.
+    Delta computation and decompression happen outside the internal lock, so
+    only the dictionary and cache updates are serialised.
+    """
+    def __init__(self, compression_level=6, keyframe_interval=DELTA_KEYFRAME_INTERVAL,
+                 cache_bytes=OBJECT_CACHE_BYTES):
+        self.compression_level = compression_level
+        self.keyframe_interval = keyframe_interval
+
+        # Keyframes: { "object_id": compressed_bytes }
+        self._objects = {}
+        # Deltas: { "object_id": (base_object_id, chain_depth, delta_ops) }
+        self._deltas = {}
+
+        # Small LRU of decompressed content, so branch heads are not rebuilt on every read
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_limit = cache_bytes
+
+        self._lock = Lock()
+
+        # Optional persistence hook: called as on_new_object(object_id, entry) with the
+        # store lock held, so the object is logged before any other thread can see it.
+        # entry is ("k", compressed_bytes) or ("d", base_object_id, chain_depth, delta_ops).
+        self.on_new_object = None
+
+    @staticmethod
+    def hash_content(content):
+        """Computes the object ID for a piece of text content (git-style blob header)."""
+        data = content.encode()
+        header = f"blob {len(data)}\0".encode()
+        return hashlib.sha1(header + data).hexdigest()
+
+    def put(self, content, base_id=None):
+        """
+        Stores the content (if it is not already present) and returns its object ID.
+        Identical content always maps to the same ID, so duplicates cost nothing.
+        When `base_id` is given, the content is stored as a delta against it,
+        unless the chain is due for a keyframe or the delta would not be smaller.
+        """
+        object_id = self.hash_content(content)
+        if self.contains(object_id):
+            return object_id
+
+        depth = self._chain_depth(base_id) if base_id is not None else None
+        if depth is not None and depth + 1 < self.keyframe_interval:
+            ops = compute_delta(self.get(base_id), content)
+            if delta_size(ops) < len(content) // 2:
+                with self._lock:
+                    if not self.contains(object_id): # Another thread may have stored it meanwhile
+                        self._deltas[object_id] = (base_id, depth + 1, ops)
+                        if self.on_new_object:
+                            self.on_new_object(object_id, ("d", base_id, depth + 1, ops))
+                    self._remember(object_id, content)
+                return object_id
+
+        compressed = zlib.compress(content.encode(), self.compression_level)
+        with self._lock:
+            if not self.contains(object_id):
+                self._objects[object_id] = compressed
+                if self.on_new_object:
+                    self.on_new_object(object_id, ("k", compressed))
+            self._remember(object_id, content)
+        return object_id
+
+    def get(self, object_id):
+        """Returns the full text content for an object ID."""
+        with self._lock:
+            cached = self._cache.get(object_id)
+            if cached is not None:
+                self._cache.move_to_end(object_id)
+                return cached
+
+            # 1. Walk back along the delta chain until a keyframe (or cached version) is found
+            chain = []
+            current_id = object_id
+            while current_id in self._deltas and current_id not in self._cache:
+                base_id, _, ops = self._deltas[current_id]
+                chain.append(ops)
+                current_id = base_id
+            content = self._cache.get(current_id)
+
+        if content is None:
+            if current_id not in self._objects:
+                raise KeyError(f"Object '{object_id}' not found in store.")
+            content = zlib.decompress(self._objects[current_id]).decode()
+
+        # 2. Replay the deltas forward to rebuild the requested version
+        for ops in reversed(chain):
+            content = apply_delta(content, ops)
+
+        with self._lock:
+            self._remember(object_id, content)
+        return content
+
+    def contains(self, object_id):
+        return object_id in self._objects or object_id in self._deltas
+
+    def __len__(self):
+        return len(self._objects) + len(self._deltas)
+
+    def stored_bytes(self):
+        """Approximate bytes held by keyframes and deltas (excluding the read cache)."""
+        keyframes = sum(len(blob) for blob in self._objects.values())
+        deltas = sum(delta_size(ops) for _, _, ops in self._deltas.values())
+        return keyframes + deltas
+
+    # --- Persistence support ---
+    def load_entry(self, object_id, entry):
+        """
+        Re-inserts an object exactly as it was logged by on_new_object (used during
+        recovery, and by the shards of the sharded server to read each other's
+        objects). An object that is already present is kept as it is, so a version
+        stored differently elsewhere can never turn a delta chain into a loop.
+        """
+        with self._lock:
+            if self.contains(object_id):
+                return
+            if entry[0] == "k":
+                self._objects[object_id] = entry[1]
+            else:
+                self._deltas[object_id] = tuple(entry[1:])
+
+    def snapshot(self):
+        """Returns shallow copies of the keyframe and delta tables for a checkpoint."""
+        with self._lock:
+            return dict(self._objects), dict(self._deltas)
+
+    def restore(self, objects, deltas):
+        """Replaces the store contents with tables produced by snapshot()."""
+        with self._lock:
+            self._objects = dict(objects)
+            self._deltas = dict(deltas)
+            self._cache.clear()
+            self._cache_bytes = 0
+
+    # --- Internal helpers ---
+    def _chain_depth(self, object_id):
+        """Number of deltas between an object and its keyframe (None if unknown)."""
+        if object_id in self._deltas:
+            return self._deltas[object_id][1]
+        if object_id in self._objects:
+            return 0
+        return None
+
+    def _remember(self, object_id, content):
+        """Adds content to the LRU read cache (caller holds the lock), evicting the oldest entries."""
+        if len(content) > self._cache_limit:
+            return
+        if object_id in self._cache:
+            self._cache.move_to_end(object_id)
+            return
+        self._cache[object_id] = content
+        self._cache_bytes += len(content)
+        while self._cache_bytes > self._cache_limit:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
@@ -1,54 +1,412 @@
+import re
 from vcs_core import vcs
+from metrics import metrics
+from delta import compute_delta, encode_delta, decode_delta
+from framing import ENCODINGS, ENCODING_NONE
+
+# Clients that keep a local copy of their draft (they sent SYNC) get drafts as
+# deltas against the version they already hold instead of the full file.
+# { "username": (revision_id, path) of the copy the client holds, or None }
+synced_revisions = {}
+
+def _draft_response(status, draft, title="--- Current Draft ---"):
+    """
+    Builds a response as a (header, draft) tuple of parts. The server
+    sends the parts one after another, so a large draft is never concatenated
+    into a second full-size string.
+    """
+    prefix = f"{status}\n{title}\n" if status else f"{title}\n"
+    return (prefix, draft)
+
+def _sync_response(username, status, title="Current Draft", applied_revision_id=None):
+    """
+    Returns the user's draft after a command. Legacy clients get the full text.
+    Synced clients get one of (header line, payload, then the status text):
+      DRAFT_VERSION:<rev>            -> the client's copy is already up to date
+      DRAFT_DELTA:<from>:<to>        -> encoded delta from the client's copy
+      DRAFT_FULL:<rev>:<length>      -> the whole file (first sync)
+    `applied_revision_id` is a revision the client already holds locally (its own patch).
+    """
+    branch = vcs.get_active_branch(username)
+    path = vcs.get_user_path(username)
+    with branch.lock:
+        head_id = branch.head_revision_id
+
+    if username not in synced_revisions:
+        return _draft_response(status, vcs.read_file(head_id, path) or "", f"--- {title}: {path} ---")
+
+    known = synced_revisions[username]
+    if applied_revision_id is not None:
+        known = (applied_revision_id, path)
+    synced_revisions[username] = (head_id, path)
+    if known is None or known[1] != path or not vcs.commit_graph.contains(known[0]):
+        content = vcs.read_file(head_id, path) or ""
+        return (f"DRAFT_FULL:{head_id}:{len(content)}\n", content, status)
+
+    # Same file object on both sides (e.g. only other paths changed): just the new version ID
+    known_entry = vcs.trees.lookup(vcs.commit_graph.object_id(known[0]), path)
+    head_entry = vcs.trees.lookup(vcs.commit_graph.object_id(head_id), path)
+    if known[0] == head_id or known_entry == head_entry:
+        return (f"DRAFT_VERSION:{head_id}\n", status)
+
+    ops = compute_delta(vcs.read_file(known[0], path) or "", vcs.read_file(head_id, path) or "")
+    return (f"DRAFT_DELTA:{known[0]}:{head_id}\n", *encode_delta(ops), status)
+
+# --- Version tokens (ETags) ---
+# PEEK:ETAG and SHOW:ETAG put "ETAG:<token>" on a line before the usual reply;
+# the token is the object ID of the file version sent. A client that caches
+# the file sends the token back (PEEK:ETAG:<token>) and, while the file is
+# unchanged, gets only "NOT_MODIFIED:<token>" instead of the content again.
+MISSING_FILE_ETAG = "none" # Token of a file that does not exist
+
+def _tagged_response(etag, client_etag, build_response):
+    """The reply to an ETAG request: NOT_MODIFIED, or the tag followed by the parts build_response() returns."""
+    if client_etag == etag:
+        return f"NOT_MODIFIED:{etag}\n"
+    return (f"ETAG:{etag}\n", *build_response())
+
+def _etag_request(argument):
+    """
+    (True, client token or None) if a PEEK/SHOW argument is ETAG[:<token>],
+    (False, fields) otherwise, with the argument split at ':'.
+    """
+    fields = _text(argument).split(":")
+    if fields[0].upper() != "ETAG":
+        return False, fields
+    return True, (fields[1] if len(fields) > 1 else None)
+
+def end_session(username):
+    """Forgets the user's local-copy state when their connection closes."""
+    synced_revisions.pop(username, None)
+
+# --- Command routing ---
+# { "NAME": (handler, needs_argument, read_only) }. A handler is called as
+# handler(username, argument) where `argument` is a memoryview of the raw
+# bytes after "NAME:" (or after "NAME" for commands without a colon). Handlers
+# decode only what they use, so routing never copies a large EDIT/PATCH body.
+# A read-only follower (see replication.py) runs only the read_only commands.
+COMMAND_TABLE = {}
+
+_KEYWORD = re.compile(rb"\s*([A-Za-z_]+)(:?)")
+_KEYWORD_SCAN = 32 # Bytes examined to find the command keyword
+
+def register_command(name, needs_argument=False, read_only=False):
+    """
+    Decorator that adds a handler to COMMAND_TABLE (also the way to plug in a
+    new command). `needs_argument` commands are only matched as "NAME:<argument>".
+    `read_only` commands change nothing that is replicated, so followers run them.
+    """
+    def decorator(handler):
+        COMMAND_TABLE[name] = (handler, needs_argument, read_only)
+        return handler
+    return decorator
+
+def parse_command(payload):
+    """
+    Splits a raw command (any bytes-like object, or a str) into (name, argument)
+    without copying it: only the first few bytes are examined. `name` is the
+    upper-cased keyword, or None if it is unknown or misses its ':<argument>'.
+    `argument` is a memoryview of the rest of the payload.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode()
+    view = memoryview(payload)
+    match = _KEYWORD.match(bytes(view[:_KEYWORD_SCAN]))
+    if match is None:
+        return None, view[:0]
+    name = match.group(1).decode().upper()
+    entry = COMMAND_TABLE.get(name)
+    if entry is None or (entry[1] and not match.group(2)):
+        return None, view[:0]
+    return name, view[match.end():]
+
+_BATCH_ENTRY = re.compile(rb"\s*(\d{1,12}):")
+
+def parse_batch(argument):
+    """
+    Splits the body of a BATCH, a series of <byte length>:<command> entries
+    (whitespace may separate them), into the (name, argument) pairs that
+    parse_command returns, without copying the commands. Raises ValueError
+    if the body is malformed.
+    """
+    view = memoryview(argument)
+    commands = []
+    position = 0
+    while position < len(view):
+        head = bytes(view[position:position + _KEYWORD_SCAN])
+        if not head.strip():
+            position += len(head)
+            continue
+        match = _BATCH_ENTRY.match(head)
+        if match is None:
+            raise ValueError(f"expected '<length>:' at byte {position}")
+        start = position + match.end()
+        position = start + int(match.group(1))
+        if position > len(view):
+            raise ValueError(f"entry at byte {start} runs past the end")
+        commands.append(parse_command(view[start:position]))
+    return commands
+
+def parse_grep(argument):
+    """
+    Splits the argument of GREP into (pattern, history): GREP:<text> searches
+    the branch heads, GREP:ALL:<text> the committed versions as well. The text
+    is matched literally. Raises ValueError with the reason if it is unusable.
+    """
+    pattern = str(argument, "utf-8").strip("\r\n")
+    history = pattern[:4].upper() == "ALL:"
+    if history:
+        pattern = pattern[4:]
+    if not pattern:
+        raise ValueError("Use GREP:<text> or GREP:ALL:<text>.")
+    if "\n" in pattern:
+        raise ValueError("GREP matches within one line; the text cannot contain a line break.")
+    return pattern, history
+
+def dispatch_command(username, name, argument):
+    """Runs a parsed command. Returns either a string or a tuple of string parts that form the response body."""
+    if name is None:
+        return "Unknown or malformed command. Please check syntax."
+    handler, _, read_only = COMMAND_TABLE[name]
+    if not read_only and vcs.read_only:
+        return f"Error: This server is a read-only follower; send {name} to the primary server."
+    try:
+        return handler(username, argument)
+    except UnicodeDecodeError:
+        return "Error: Command is not valid UTF-8."
 
 def process_client_request(username, raw_data):
     """
-    Routes the client's command string to the correct Version Control System function.
+    Routes the client's command (bytes-like or str) to the correct Version Control System function.
+    Returns either a string or a tuple of string parts that form the response body.
+    """
+    name, argument = parse_command(raw_data)
+    return dispatch_command(username, name, argument)
+
+class LocalRouter:
+    """
+    Runs commands on this process's VersionControlSystem. The threaded server
+    hands every session to a router, so the sharded mode (sharding.ShardRouter)
+    can run the same commands in worker processes instead.
+    """
+    def register(self, username, subscriber):
+        """Starts the user's session and subscribes their connection to notices. Returns their branch name."""
+        return vcs.register_user(username, subscriber)
+
+    def execute(self, username, name, argument):
+        return dispatch_command(username, name, argument)
+
+    def unregister(self, username, subscriber):
+        """Ends the session of a closed connection (subscriber may be None if the handshake failed)."""
+        vcs.unregister_client(subscriber)
+        end_session(username)
+
+local_router = LocalRouter()
+
+# --- Handshake ---
+# The HELLO body is the username, optionally followed by a line naming what
+# the client can handle, most preferred first: "alice\nCAPS:zstd,zlib,etag".
+# A client that sent the line gets what the server agreed to as the first line
+# of the welcome ("CAPS:zlib,etag"); a compressed reply carries its encoding
+# in the frame flags. A HELLO without the line gets the plain protocol.
+FEATURES = ("etag", "request-id") # Capabilities other than encodings (request IDs: see framing.py)
+
+def parse_hello(body):
+    """Splits a HELLO body into (username, offered capabilities), the latter None if the client sent none."""
+    username, _, rest = body.decode().partition("\n")
+    offered = None
+    for line in rest.split("\n"):
+        if line.startswith("CAPS:"):
+            offered = [name.strip().lower() for name in line[5:].split(",") if name.strip()]
+    return username.strip() or "Guest", offered
+
+def negotiate(offered):
+    """
+    Chooses what a session uses from the capabilities its client offered:
+    the first encoding this server supports, plus the features it has.
+    Returns (accepted capability names, ENCODING_* for the replies).
     """
-    data = raw_data.strip()
+    accepted = []
+    encoding = ENCODING_NONE
+    for name in offered:
+        if name in ENCODINGS and encoding == ENCODING_NONE:
+            encoding = ENCODINGS[name]
+            accepted.append(name)
+        elif name in FEATURES:
+            accepted.append(name)
+    return accepted, encoding
 
-    # The client now sends the content as part of the EDIT command (EDIT:content)
-    if data.startswith("EDIT:"):
-        new_content = data[5:].strip()
-        status = vcs.edit(username, new_content)
-        return f"{status}\n--- Current Draft ---\n{vcs.get_active_branch(username).current_content}"
+def _text(argument):
+    """A short argument (a name, ref or path) decoded and stripped."""
+    return str(argument, "utf-8").strip()
 
-    elif data.startswith("UNDO"):
-        status = vcs.undo(username)
-        draft = vcs.get_active_branch(username).current_content
-        return f"{status}\n--- Current Draft ---\n{draft}"
+@register_command("PATCH", needs_argument=True)
+def _patch(username, argument):
+    # PATCH:<base_revision_id>\n<encoded delta> -- the body is not stripped,
+    # since trailing whitespace can be part of the inserted text
+    text = str(argument, "utf-8")
+    newline = text.find("\n")
+    if newline == -1:
+        return "Error: Malformed patch (no delta after the version ID)."
+    try:
+        ops, _ = decode_delta(text, newline + 1)
+    except ValueError as e:
+        return f"Error: Malformed patch ({e})."
+    status, applied_id = vcs.patch(username, text[:newline].strip(), ops)
+    return _sync_response(username, status, applied_revision_id=applied_id)
 
-    elif data.startswith("REDO"):
-        status = vcs.redo(username)
-        draft = vcs.get_active_branch(username).current_content
-        return f"{status}\n--- Current Draft ---\n{draft}"
+@register_command("EDIT", needs_argument=True)
+def _edit(username, argument):
+    # The client sends the content as part of the EDIT command (EDIT:content)
+    status = vcs.edit(username, str(argument, "utf-8").strip())
+    return _sync_response(username, status)
 
-    elif data.startswith("BRANCH:"):
-        name = data[7:].strip()
-        return vcs.create_branch(username, name)
+@register_command("SYNC")
+def _sync(username, argument):
+    # The client drops its local copy and receives the whole draft once
+    synced_revisions[username] = None
+    return _sync_response(username, f"Synchronized with branch '{vcs.get_active_branch(username).name}'.")
 
-    elif data.startswith("CHECKOUT:"):
-        name = data[9:].strip()
-        status = vcs.switch_branch(username, name)
-        draft = vcs.get_active_branch(username).current_content
-        return f"{status}\n--- Current Draft ---\n{draft}"
+@register_command("UNDO")
+def _undo(username, argument):
+    return _sync_response(username, vcs.undo(username))
 
-    elif data.startswith("MERGE:"):
-        source_name = data[6:].strip()
-        status = vcs.merge(username, source_name)
-        draft = vcs.get_active_branch(username).current_content
-        return f"{status}\n--- Current Draft ---\n{draft}"
+@register_command("REDO")
+def _redo(username, argument):
+    return _sync_response(username, vcs.redo(username))
 
-    elif data.startswith("COMMIT"):
-        return vcs.commit(username)
+@register_command("BRANCH", needs_argument=True)
+def _branch(username, argument):
+    return vcs.create_branch(username, _text(argument))
 
-    elif data.startswith("PEEK"):
-        draft = vcs.get_active_branch(username).current_content
-        return f"--- Your Draft ---\n{draft}"
+@register_command("DELETE_BRANCH", needs_argument=True)
+def _delete_branch(username, argument):
+    # Users on the deleted branch are moved to 'master', so the draft may change
+    return _sync_response(username, vcs.delete_branch(username, _text(argument)))
 
-    elif data.startswith("SHOW"):
-        content = vcs.official_repository_content
+@register_command("CHECKOUT", needs_argument=True)
+def _checkout(username, argument):
+    name = _text(argument)
+    status = vcs.switch_branch(username, name)
+    if status.startswith("Error:"):
+        # Not a branch: try it as a version ID (prefix)
+        status = vcs.checkout_revision(username, name)
+    return _sync_response(username, status)
+
+@register_command("MERGE", needs_argument=True)
+def _merge(username, argument):
+    return _sync_response(username, vcs.merge(username, _text(argument)))
+
+@register_command("COMMIT")
+def _commit(username, argument):
+    # COMMIT or COMMIT:<message>
+    status = vcs.commit(username, _text(argument))
+    if username in synced_revisions:
+        return _sync_response(username, status) # The commit is the new head of the branch
+    return status
+
+# The commands a BATCH may contain, and the VersionControlSystem.batch step each becomes
+BATCH_STEPS = {"OPEN": "open", "EDIT": "edit", "RM": "rm", "MERGE": "merge", "COMMIT": "commit"}
+
+@register_command("BATCH", needs_argument=True)
+def _batch(username, argument):
+    # BATCH:<length>:<command><length>:<command>... -- OPEN, EDIT, RM, MERGE and a
+    # final COMMIT applied to the user's branch as one unit, or not at all
+    try:
+        commands = parse_batch(argument)
+    except ValueError as e:
+        return f"Error: Malformed batch ({e})."
+    steps = []
+    for name, step_argument in commands:
+        if name not in BATCH_STEPS:
+            return "Error: A batch may only contain OPEN, EDIT, RM, MERGE and a final COMMIT."
+        steps.append((BATCH_STEPS[name], _text(step_argument)))
+    return _sync_response(username, vcs.batch(username, steps))
+
+@register_command("GREP", needs_argument=True, read_only=True)
+def _grep(username, argument):
+    # GREP:<text> (every branch head) or GREP:ALL:<text> (also every committed version)
+    try:
+        pattern, history = parse_grep(argument)
+    except ValueError as e:
+        return f"Error: {e}"
+    return vcs.grep(pattern, history)
+
+@register_command("LOG", read_only=True)
+def _log(username, argument):
+    # LOG (your branch) or LOG:<branch | version | official>
+    return vcs.log(username, _text(argument))
+
+@register_command("DIFF", needs_argument=True, read_only=True)
+def _diff(username, argument):
+    first, separator, second = _text(argument).partition("..")
+    if not separator:
+        return "Error: Use DIFF:<a>..<b> (branch names, version IDs or 'official')."
+    return vcs.diff(username, first, second)
+
+@register_command("OPEN", needs_argument=True)
+def _open(username, argument):
+    return _sync_response(username, vcs.open_path(username, _text(argument)))
+
+@register_command("LS", read_only=True)
+def _ls(username, argument):
+    # LS (repository root) or LS:<directory>
+    return vcs.list_path(username, _text(argument))
+
+@register_command("RM", needs_argument=True)
+def _rm(username, argument):
+    return _sync_response(username, vcs.remove_path(username, _text(argument)))
+
+@register_command("STATS", read_only=True)
+def _stats(username, argument):
+    # Server counters and per-command latency histograms
+    return metrics.render_text(vcs)
+
+@register_command("PEEK", read_only=True)
+def _peek(username, argument):
+    # PEEK, or PEEK:ETAG[:<token>] for a client that caches the draft itself
+    tagged, client_etag = _etag_request(argument)
+    if not tagged:
+        return _sync_response(username, "", title="Your Draft")
+    branch = vcs.get_active_branch(username)
+    path = vcs.get_user_path(username)
+    with branch.lock:
+        head_id = branch.head_revision_id
+    entry = vcs.trees.lookup(vcs.commit_graph.object_id(head_id), path)
+    etag = entry[1] if entry is not None and entry[0] == "blob" else MISSING_FILE_ETAG
+    return _tagged_response(etag, client_etag, lambda: _draft_response(
+        "", vcs.read_file(head_id, path) or "", f"--- Your Draft: {path} ---"))
+
+@register_command("SHOW", read_only=True)
+def _show(username, argument):
+    # SHOW (the whole official file), SHOW:<offset>:<length> (a byte range) or
+    # SHOW:LINES:<first>:<count> (1-based lines); SHOW:ETAG[:<token>] is the
+    # whole file for a client that caches it. The body is a view of the
+    # memory-mapped file, so a page of a huge file costs only that page.
+    official = vcs.official_file(vcs.get_user_path(username))
+    tagged, fields = _etag_request(argument)
+    if tagged:
+        etag = official.object_id if official else MISSING_FILE_ETAG
+        return _tagged_response(etag, fields, lambda: ("SHOW_CONTENT:\n", official.read() if official else ""))
+    if fields == [""]:
         # The prefix 'SHOW_CONTENT:\n' is used by the client to trigger the GUI.
-        return f"SHOW_CONTENT:\n{content}"
+        return ("SHOW_CONTENT:\n", official.read() if official else "")
+
+    by_lines = fields[0].upper() == "LINES"
+    try:
+        # Exactly two numbers (unpacking raises ValueError otherwise)
+        position, count = (int(field) for field in (fields[1:] if by_lines else fields))
+    except ValueError:
+        position = count = -1
+    if count < 0 or position < (1 if by_lines else 0):
+        return "Error: Use SHOW, SHOW:<offset>:<length> or SHOW:LINES:<first>:<count> (lines start at 1)."
+    if official is None:
+        return "Error: The file does not exist in the official version."
 
-    else:
-        return "Unknown or malformed command. Please check syntax."
\ No newline at end of file
+    if not by_lines:
+        body = official.read(position, count)
+        return (f"SHOW_RANGE:{position}:{body.nbytes}:{official.size}\n", body)
+    start, end = official.line_range(position - 1, count)
+    total = official.line_count()
+    shown = max(0, min(count, total - position + 1))
+    return (f"SHOW_LINES:{position}:{shown}:{total}\n", official.read(start, end - start))
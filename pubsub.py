@@ -0,0 +1,309 @@
+import logging
+import socket
+from collections import deque
+from socket import SHUT_RDWR
+from threading import Thread, Lock, Condition
+from config import NOTIFY_QUEUE_LIMIT, STREAM_CHUNK_SIZE
+from framing import (encode_frame, send_frame, write_frame_async, body_length, compress_body, with_request_id,
+                     OP_NOTIFY, ENCODING_NONE, FLAG_REQUEST_ID)
+
+# Notifications (commit/merge notices) are published once and fanned out by a
+# dispatcher thread into a bounded queue per connection. Each connection has
+# its own writer that drains that queue, so neither the committing client nor
+# the dispatcher ever waits on another client's socket. A client that stops
+# reading fills its queue and is evicted instead of holding everyone up.
+
+logger = logging.getLogger(__name__)
+
+# Non-blocking flag for a single send() on a blocking socket (0 where unsupported)
+_MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+class Subscriber:
+    """
+    The outbound side of one connection. Subclasses provide the writer
+    (a thread for blocking sockets, a task for asyncio streams).
+    Replies are compressed with `encoding` (set by the handshake); notices
+    are small and always go out as they are.
+    """
+    def __init__(self, name, limit=NOTIFY_QUEUE_LIMIT):
+        self.name = name
+        self.limit = limit
+        self.encoding = ENCODING_NONE
+        self.closed = False
+        self._queue = deque()
+        self._lock = Lock()
+
+    def offer(self, frame):
+        """
+        Queues an encoded NOTIFY frame without blocking.
+        Returns False if the queue is full (a slow consumer) or closed.
+        """
+        with self._lock:
+            if self.closed or len(self._queue) >= self.limit:
+                return False
+            self._queue.append(frame)
+            first = len(self._queue) == 1
+        if first:
+            self._wake()
+        return True
+
+    def _take_all(self):
+        """Removes and returns every queued frame joined into one buffer (b"" if none)."""
+        with self._lock:
+            frames = b"".join(self._queue)
+            self._queue.clear()
+        return frames
+
+    def _wake(self):
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+
+class ThreadSubscriber(Subscriber):
+    """
+    Subscriber for a blocking socket (threaded server). A writer thread sends
+    queued notices; replies are sent by the request thread. Both hold the same
+    send lock for a whole frame, so a notice never lands inside a reply.
+
+    When the writer has nothing to send and the socket is free, offer() writes
+    the notice itself with a non-blocking send, so the usual case costs no
+    thread switch. If the kernel takes only part of it, the rest is kept in
+    _rest: whoever takes the send lock next (the writer, which is woken for it,
+    or a reply) sends it before anything else.
+    """
+    def __init__(self, sock, name, limit=NOTIFY_QUEUE_LIMIT):
+        super().__init__(name, limit)
+        self.sock = sock
+        self._send_lock = Lock()
+        self._ready = Condition(self._lock)
+        self._writing = False # The writer has taken frames it has not sent yet
+        self._rest = b"" # Unsent end of a notice offer() sent part of (guarded by _send_lock)
+        self._writer = Thread(target=self._run, name=f"writer-{name}", daemon=True)
+
+    def start(self):
+        self._writer.start()
+        return self
+
+    def offer(self, frame):
+        # Only the dispatcher thread queues notices, so an idle writer stays idle here
+        with self._lock:
+            idle = not self._queue and not self._writing
+        if not _MSG_DONTWAIT or not idle or not self._send_lock.acquire(blocking=False):
+            return super().offer(frame)
+        try:
+            if self.closed:
+                return False
+            sent = 0
+            if not self._rest: # Otherwise the last notice is still half sent and this one goes after it
+                try:
+                    sent = self.sock.send(frame, _MSG_DONTWAIT)
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    self.close()
+                    return False
+            if sent == 0:
+                return super().offer(frame)
+            if sent < len(frame):
+                # Part of the frame is on the wire: the rest must be the very next bytes sent
+                self._rest = frame[sent:]
+                self._wake()
+            return True
+        finally:
+            self._send_lock.release()
+
+    def _send_rest(self):
+        """Sends what is left of a half-sent notice. The caller holds _send_lock."""
+        if self._rest:
+            rest, self._rest = self._rest, b""
+            self.sock.sendall(rest)
+
+    def send(self, opcode, body, request_id=None):
+        """
+        Sends a reply frame directly from the calling (request) thread, tagged
+        with the command's request ID if it had one. Returns the bytes sent.
+        """
+        body, flags = compress_body(body, self.encoding) # Before taking the lock: notices keep flowing
+        if request_id is not None:
+            body, flags = with_request_id(request_id, body), flags | FLAG_REQUEST_ID
+        with self._send_lock:
+            self._send_rest()
+            return send_frame(self.sock, opcode, body, flags)
+
+    def _wake(self):
+        with self._lock:
+            self._ready.notify()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._rest and not self.closed:
+                    self._ready.wait()
+                if self.closed:
+                    return
+                self._writing = True
+            frames = self._take_all()
+            try:
+                with self._send_lock:
+                    self._send_rest()
+                    self.sock.sendall(frames)
+            except OSError:
+                self.close()
+                return
+            finally:
+                with self._lock:
+                    self._writing = False
+
+    def close(self):
+        """Stops the writer and shuts the socket down, which also ends the request thread's read."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.clear()
+            self._ready.notify()
+        try:
+            self.sock.shutdown(SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class AsyncSubscriber(Subscriber):
+    """
+    Subscriber for an asyncio stream. The writer is a task on the event loop;
+    offer() may be called from any thread. Every write of a frame happens in
+    one loop callback, so notices and replies cannot interleave mid-frame.
+    """
+    def __init__(self, loop, writer, name, limit=NOTIFY_QUEUE_LIMIT):
+        import asyncio # Imported here so the threaded server does not load asyncio at startup
+        super().__init__(name, limit)
+        self.loop = loop
+        self.writer = writer
+        self._ready = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = self.loop.create_task(self._run())
+        return self
+
+    async def send(self, opcode, body, request_id=None):
+        """Writes a reply frame (tagged with a request ID, if given) from the connection's own coroutine. Returns the bytes sent."""
+        if self.encoding != ENCODING_NONE and body_length(body) > STREAM_CHUNK_SIZE:
+            # Compressing a large draft would stall every other session on the loop
+            body, flags = await self.loop.run_in_executor(None, compress_body, body, self.encoding)
+        else:
+            body, flags = compress_body(body, self.encoding)
+        if request_id is not None:
+            body, flags = with_request_id(request_id, body), flags | FLAG_REQUEST_ID
+        return await write_frame_async(self.writer, opcode, body, flags)
+
+    def _wake(self):
+        self.loop.call_soon_threadsafe(self._ready.set)
+
+    async def _run(self):
+        while not self.closed:
+            await self._ready.wait()
+            self._ready.clear()
+            frames = self._take_all()
+            if not frames:
+                continue
+            try:
+                self.writer.write(frames)
+                await self.writer.drain()
+            except (ConnectionError, OSError):
+                self.close()
+
+    def close(self):
+        """Stops the writer task and aborts the transport (safe from any thread)."""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._queue.clear()
+        try:
+            self.loop.call_soon_threadsafe(self._abort)
+        except RuntimeError:
+            pass # The event loop is already closed
+
+    def _abort(self):
+        self._ready.set()
+        self.writer.transport.abort()
+
+
+class Broker:
+    """
+    Publishes notifications to every subscriber. publish() encodes the frame
+    once and only appends it to a queue; a dispatcher thread (started on first
+    use) copies it into each subscriber's queue and never touches a socket.
+    """
+    def __init__(self):
+        self._subscribers = []
+        self._lock = Lock()
+        self._pending = deque()
+        self._ready = Condition()
+        self._dispatcher = None
+        self._stopped = False
+        self.evicted = 0
+        self.notice_bytes = 0 # Bytes of notices handed to subscribers
+
+    def subscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber):
+        """Removes a subscriber (no-op if it is already gone)."""
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def subscribers(self):
+        """Snapshot list of current subscribers."""
+        with self._lock:
+            return list(self._subscribers)
+
+    def publish(self, kind, message):
+        """Queues a notice of the given NOTIFY_* kind for every subscriber and returns at once."""
+        frame = encode_frame(OP_NOTIFY, message, flags=kind)
+        with self._ready:
+            if self._stopped:
+                return
+            self._pending.append(frame)
+            if self._dispatcher is None:
+                self._dispatcher = Thread(target=self._dispatch, name="notify-dispatcher", daemon=True)
+                self._dispatcher.start()
+            self._ready.notify()
+
+    def _dispatch(self):
+        while True:
+            with self._ready:
+                while not self._pending and not self._stopped:
+                    self._ready.wait()
+                if not self._pending:
+                    return
+                frame = self._pending.popleft()
+            delivered = 0
+            for subscriber in self.subscribers():
+                if subscriber.offer(frame):
+                    delivered += 1
+                elif not subscriber.closed:
+                    self._evict(subscriber)
+            self.notice_bytes += delivered * len(frame)
+
+    def _evict(self, subscriber):
+        """Disconnects a client whose notice queue is full."""
+        self.unsubscribe(subscriber)
+        subscriber.close()
+        self.evicted += 1
+        logger.warning("[EVICTED] %s: %d notices waiting, client is not reading.", subscriber.name, subscriber.limit)
+
+    def close(self):
+        """Delivers the notices already published, then stops the dispatcher."""
+        with self._ready:
+            self._stopped = True
+            self._ready.notify()
+            dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.join(timeout=5)
@@ -0,0 +1,338 @@
+import io
+import ipaddress
+import logging
+import os
+import pickle
+import socket
+import time
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+from threading import Condition, Lock, Thread
+from commit_graph import Revision
+from config import REPLICATION_QUEUE_BYTES, REPLICATION_RETRY_INTERVAL, REPLICATION_SECRET
+from wal import decode_records
+
+# Read-only followers (python server.py --replication-port 5060 on the primary,
+# python server.py --follow 5060 --port 5051 for each follower):
+#
+# A follower connects to the primary's replication port and gets
+# a snapshot of the whole state (what a checkpoint holds), then every write of
+# the primary's write-ahead log made after it, once the write is fsynced. It
+# applies the log records the way recovery replays them and serves the
+# read-only commands (SHOW, PEEK, LOG, DIFF, LS, GREP, STATS) from its copy;
+# the others are refused. A follower is behind the primary by the log flush
+# interval plus the time to send and apply a write.
+#
+# Peers share a secret (REPLICATION_SECRET, or the VCS_REPLICATION_SECRET
+# environment variable). Each connection starts with the HMAC challenge of
+# multiprocessing.connection in both directions, so the primary only sends its
+# repository to followers holding the secret, and a follower only takes state
+# from a primary holding it. Without a secret, the primary only listens on and
+# a follower only follows a loopback address.
+#
+# Messages, sent with multiprocessing.connection (pickled, length-prefixed):
+#   ("snapshot", state)          primary -> follower, once per connection
+#   ("log", flushed_at, data)    primary -> follower, log frames (see wal.py) in log order
+# The follower unpickles them (and the log records inside) with _loads, which
+# refuses every global but commit_graph.Revision, so a message cannot make it
+# run code.
+
+logger = logging.getLogger(__name__)
+
+
+def _no_delay(connection):
+    """
+    Turns off Nagle's algorithm on a connection's socket: a message is sent as
+    a header and a body, and the body would otherwise wait for the peer to
+    acknowledge the header (up to its delayed-ACK timeout).
+    """
+    try:
+        sock = socket.socket(fileno=os.dup(connection.fileno()))
+    except OSError:
+        return connection # Not a plain socket descriptor on this platform; keep the default
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    finally:
+        sock.close()
+    return connection
+
+
+def parse_address(text, default_host="127.0.0.1"):
+    """A '[host:]port' string as a (host, port) tuple."""
+    host, _, port = text.rpartition(":")
+    return host or default_host, int(port)
+
+
+def replication_secret():
+    """The shared secret as bytes (VCS_REPLICATION_SECRET overrides REPLICATION_SECRET), or None."""
+    secret = os.environ.get("VCS_REPLICATION_SECRET") or REPLICATION_SECRET
+    if not secret:
+        return None
+    return secret if isinstance(secret, bytes) else secret.encode()
+
+
+def is_loopback(host):
+    """True if host is a loopback address (or 'localhost')."""
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def _check_secret(host, secret, role):
+    """Raises ValueError if replication with host would be unauthenticated across the network."""
+    if secret is None and not is_loopback(host):
+        raise ValueError(f"{role} {host} is not a loopback address; set REPLICATION_SECRET "
+                         f"or VCS_REPLICATION_SECRET to replicate across the network")
+
+
+class _Unpickler(pickle.Unpickler):
+    """Unpickles replication messages, refusing every global but Revision."""
+    def find_class(self, module, name):
+        if (module, name) == ("commit_graph", "Revision"):
+            return Revision
+        raise pickle.UnpicklingError(f"Replication message refers to {module}.{name}")
+
+
+def _loads(data):
+    return _Unpickler(io.BytesIO(data)).load()
+
+
+def _receive(connection):
+    """Receives one message from the primary (ValueError if it is not a valid one)."""
+    data = connection.recv_bytes()
+    try:
+        return _loads(data)
+    except Exception as e:
+        raise ValueError(f"Malformed replication message ({e})") from None
+
+
+class _Feed:
+    """
+    The log writes waiting to be sent to one follower. push() only queues, so
+    the log flusher never waits for a follower; the follower's own thread sends
+    the queue in run(). Past REPLICATION_QUEUE_BYTES the feed gives up.
+    """
+    def __init__(self, connection, limit=REPLICATION_QUEUE_BYTES):
+        self.connection = connection
+        self.limit = limit
+        self.overflowed = False
+        self._queue = deque() # (flushed_at, data)
+        self._bytes = 0
+        self._closed = False
+        self._ready = Condition()
+
+    def push(self, flushed_at, data):
+        with self._ready:
+            if self._closed:
+                return
+            if self._bytes + len(data) > self.limit:
+                self.overflowed = self._closed = True
+            else:
+                self._queue.append((flushed_at, data))
+                self._bytes += len(data)
+            self._ready.notify()
+
+    def run(self):
+        """Sends the queued writes until the feed is closed or the follower goes away."""
+        while True:
+            with self._ready:
+                while not self._queue and not self._closed:
+                    self._ready.wait()
+                if self._closed:
+                    return
+                writes = list(self._queue)
+                self._queue.clear()
+                self._bytes = 0
+            # Writes that piled up go as one message, stamped with the oldest flush time
+            self.connection.send(("log", writes[0][0], b"".join(data for _, data in writes)))
+
+    def close(self):
+        with self._ready:
+            self._closed = True
+            self._ready.notify()
+
+
+class ReplicationSource:
+    """
+    Primary side: accepts followers on a local port and streams the log to
+    them. publish() is the write-ahead log's on_durable hook; it hands each
+    write to every follower's _Feed. A follower that falls more than
+    REPLICATION_QUEUE_BYTES behind is disconnected, and starts over from a
+    new snapshot when it reconnects. Followers must prove they hold the
+    secret (replication_secret() unless one is given) when there is one.
+    """
+    def __init__(self, vcs, port, host="127.0.0.1", secret=None):
+        self.vcs = vcs
+        self.address = (host, port)
+        self.secret = replication_secret() if secret is None else secret
+        self._feeds = []
+        self._lock = Lock() # Guards _feeds
+        self._listener = None
+
+    def start(self):
+        """
+        Listens (raising OSError if the port is taken, ValueError if the host is
+        not a loopback address and there is no secret) and accepts followers on
+        a background thread.
+        """
+        _check_secret(self.address[0], self.secret, "Replication host")
+        self._listener = Listener(self.address)
+        Thread(target=self._accept_loop, name="replication-accept", daemon=True).start()
+        logger.info("[REPLICATION] Streaming the log to followers on %s:%d.", *self.address)
+        return self
+
+    def _accept_loop(self):
+        self.vcs.ship_log(self) # Waits until the store is open
+        while True:
+            try:
+                connection = _no_delay(self._listener.accept())
+            except OSError:
+                return # Closed
+            Thread(target=self._serve, args=(connection, self._listener.last_accepted),
+                   name="replication-feed", daemon=True).start()
+
+    def _serve(self, connection, follower_address):
+        feed = _Feed(connection)
+        try:
+            if self.secret is not None:
+                # On the follower's own thread, so one that never answers holds up no one else
+                deliver_challenge(connection, self.secret)
+                answer_challenge(connection, self.secret)
+            started = time.perf_counter()
+            state = self.vcs.replication_snapshot(lambda: self._subscribe(feed))
+            connection.send(("snapshot", state))
+            logger.info("[REPLICATION] Follower %s connected; snapshot sent in %.3fs.",
+                        follower_address, time.perf_counter() - started)
+            feed.run()
+            if feed.overflowed:
+                logger.warning("[REPLICATION] Follower %s fell more than %d bytes behind; disconnected.",
+                               follower_address, feed.limit)
+        except AuthenticationError as e:
+            logger.warning("[REPLICATION] Follower %s refused: %s", follower_address, e)
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning("[REPLICATION] Follower %s disconnected: %s", follower_address, e)
+        finally:
+            with self._lock:
+                if feed in self._feeds:
+                    self._feeds.remove(feed)
+            feed.close()
+            connection.close()
+
+    def _subscribe(self, feed):
+        with self._lock:
+            self._feeds.append(feed)
+
+    def publish(self, data):
+        flushed_at = time.time()
+        with self._lock:
+            for feed in self._feeds:
+                feed.push(flushed_at, data)
+
+    def gauges(self):
+        with self._lock:
+            followers = len(self._feeds)
+        return [("replication_followers", "Followers receiving the log", followers)]
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.close()
+        with self._lock:
+            feeds, self._feeds = self._feeds, []
+        for feed in feeds:
+            feed.close()
+
+
+class Follower:
+    """
+    Follower side: keeps a VersionControlSystem in step with its primary.
+    start() returns once the first snapshot is loaded; a background thread
+    then applies the log as it arrives. If the primary goes away, the follower
+    goes on serving what it has and reconnects every REPLICATION_RETRY_INTERVAL
+    seconds, reloading a snapshot when it is back. It only takes state from a
+    primary holding the secret (replication_secret() unless one is given).
+    """
+    def __init__(self, address, vcs, retry_interval=REPLICATION_RETRY_INTERVAL, secret=None):
+        self.address = address
+        self.vcs = vcs
+        self.secret = replication_secret() if secret is None else secret
+        self.retry_interval = retry_interval
+        self.connected = False
+        self.snapshots = 0
+        self.records_applied = 0
+        self.lag = 0.0 # Seconds between the primary flushing the newest applied write and its apply
+        self._connection = None
+        self._closed = False
+
+    def start(self):
+        """Raises ValueError if the primary is not a loopback address and there is no secret."""
+        _check_secret(self.address[0], self.secret, "Primary")
+        if self._connect():
+            Thread(target=self._run, name="replication-follower", daemon=True).start()
+        return self
+
+    def _connect(self):
+        """Connects (retrying until the primary answers) and loads its snapshot. False if closed meanwhile."""
+        warned = False
+        while not self._closed:
+            connection = None
+            try:
+                connection = _no_delay(Client(self.address, authkey=self.secret))
+                _, state = _receive(connection)
+                break
+            except (OSError, EOFError, AuthenticationError, ValueError) as e:
+                if connection is not None:
+                    connection.close()
+                if not warned:
+                    logger.warning("[REPLICATION] Primary %s:%d unreachable or refused (%s); retrying.",
+                                   *self.address, e)
+                    warned = True
+                time.sleep(self.retry_interval)
+        else:
+            return False
+        started = time.perf_counter()
+        self.vcs.load_snapshot(state)
+        self._connection = connection
+        self.connected = True
+        self.snapshots += 1
+        logger.info("[REPLICATION] Following %s:%d; snapshot of %d revisions loaded in %.3fs.",
+                    *self.address, len(state["revisions"]), time.perf_counter() - started)
+        return True
+
+    def _run(self):
+        while not self._closed:
+            try:
+                _, flushed_at, data = _receive(self._connection)
+                records, length = decode_records(data, _loads)
+                if length != len(data):
+                    raise ValueError("Log write from the primary does not decode")
+                self.vcs.apply_replicated(records)
+            except (OSError, EOFError) as e:
+                if self._closed:
+                    return
+                logger.warning("[REPLICATION] Lost the primary (%s); serving the last state received.", e)
+            except Exception:
+                # The copy may no longer match the primary: start over from a snapshot
+                logger.exception("[REPLICATION] Could not apply the log; reloading a snapshot.")
+            else:
+                self.records_applied += len(records)
+                self.lag = time.time() - flushed_at
+                continue
+            self.connected = False
+            self._connection.close()
+            if not self._connect():
+                return
+
+    def gauges(self):
+        return [
+            ("replication_connected", "Connected to the primary (1) or not (0)", int(self.connected)),
+            ("replication_snapshots", "Snapshots loaded from the primary", self.snapshots),
+            ("replication_records_applied", "Log records applied since start", self.records_applied),
+            ("replication_lag_seconds", "Delay of the last applied log write behind the primary", round(self.lag, 6)),
+        ]
+
+    def close(self):
+        self._closed = True
+        if self._connection is not None:
+            self._connection.close()
@@ -0,0 +1,320 @@
+import heapq
+import logging
+import time
+from array import array
+from collections import deque
+from threading import Event, Lock, Thread
+from config import GREP_LIMIT, SEARCH_INDEX_DELAY
+
+logger = logging.getLogger(__name__)
+
+PLACES_LISTED = 5 # Branch names shown for a file version found on many branches
+
+
+def trigrams(text):
+    """The distinct 3-character substrings of a text."""
+    return set(map("".join, zip(text, text[1:], text[2:])))
+
+
+class SearchIndex:
+    """
+    Trigram index behind GREP: finds the file versions containing a string at
+    the branch heads and in the commits without reading every stored version.
+
+    Each indexed file version (blob) gets a number; `_postings` maps every
+    trigram to the ascending numbers of the blobs containing it. A search only
+    reads the blobs whose numbers appear in the postings of all the trigrams of
+    the pattern. Two reverse maps say where a blob is:
+      - `_heads`: { blob_id: {path: {branch names}} } at the current branch heads,
+      - `_committed`: { blob_id: {path: commit ID} }, the first commit that
+        held that version at that path.
+    Both are kept up to date from tree diffs, so the work per change follows
+    the size of the change, and a query never walks the branches.
+
+    The VCS only queues changes (head_moved, committed); a background thread
+    applies them in batches, SEARCH_INDEX_DELAY seconds apart, and a search
+    first applies whatever is still queued, so it always sees every change
+    made before it. Queued moves of the same branch are collapsed into the
+    last one, so a branch edited many times a second is indexed once. Blobs
+    that are no longer at any head or in any commit are dropped from the
+    postings once they are half of the index.
+    """
+    def __init__(self, trees, commit_graph, limit=GREP_LIMIT, delay=SEARCH_INDEX_DELAY):
+        self.trees = trees
+        self.commit_graph = commit_graph
+        self.limit = limit
+        self.delay = delay
+
+        # { "trigram": array of blob numbers } and the blob IDs by number
+        self._postings = {}
+        self._numbers = {}
+        self._blobs = []
+        # Where the indexed blobs are (see above)
+        self._head_trees = {}
+        self._heads = {}
+        self._committed = {}
+        self._commit_tree = None
+        # Index size that triggers the next _compact()
+        self._compact_at = 1024
+
+        # Changes waiting for the indexer: ("head", branch, revision_id or None) / ("commit", None, revision_id)
+        self._events = deque()
+        self._pending = Event()
+        self._lock = Lock() # Guards everything above except the queue
+        self._thread = None
+        self._closed = Event()
+
+    def __len__(self):
+        return len(self._blobs)
+
+    # --- Changes (called by the VCS; they only queue) ---
+    def head_moved(self, branch_name, revision_id):
+        """A branch head moved to revision_id (None: the branch was deleted)."""
+        self._events.append(("head", branch_name, revision_id))
+        self._pending.set()
+
+    def committed(self, revision_id):
+        """A revision became a committed version."""
+        self._events.append(("commit", None, revision_id))
+        self._pending.set()
+
+    def start(self):
+        self._thread = Thread(target=self._run, name="search-index", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._closed.set()
+        self._pending.set()
+
+    def _run(self):
+        while not self._closed.is_set():
+            self._pending.wait()
+            if self._closed.wait(self.delay): # Let more changes pile up
+                return
+            self._pending.clear()
+            self.catch_up()
+
+    def catch_up(self):
+        """Applies every queued change."""
+        with self._lock:
+            self._apply_queued()
+
+    def _apply_queued(self):
+        heads = {}
+        while self._events:
+            kind, branch_name, revision_id = self._events.popleft()
+            if kind == "head":
+                heads[branch_name] = revision_id # Only the newest head of a branch is searched
+            else:
+                self._guarded(self._add_commit, revision_id)
+        for branch_name, revision_id in heads.items():
+            self._guarded(self._move_head, branch_name, revision_id)
+        if len(self._blobs) > self._compact_at:
+            self._compact()
+
+    @staticmethod
+    def _guarded(update, *args):
+        # One bad change (e.g. a missing object) must not stop the indexer
+        try:
+            update(*args)
+        except Exception:
+            logger.exception("Search index: could not apply %s%r", update.__name__, args)
+
+    # --- Index maintenance (caller holds self._lock) ---
+    def _move_head(self, branch_name, revision_id):
+        old_tree = self._head_trees.pop(branch_name, None)
+        new_tree = self.commit_graph.object_id(revision_id) if revision_id else None
+        if new_tree:
+            self._head_trees[branch_name] = new_tree
+        for path, old_blob, new_blob in self.trees.diff(old_tree, new_tree):
+            if old_blob:
+                paths = self._heads[old_blob]
+                paths[path].discard(branch_name)
+                if not paths[path]:
+                    del paths[path]
+                    if not paths:
+                        del self._heads[old_blob]
+            if new_blob:
+                self._heads.setdefault(new_blob, {}).setdefault(path, set()).add(branch_name)
+                self._add_blob(new_blob)
+
+    def _add_commit(self, revision_id):
+        # Only the files that differ from the previous commit can be versions not seen before
+        tree_id = self.commit_graph.object_id(revision_id)
+        for path, _, new_blob in self.trees.diff(self._commit_tree, tree_id):
+            if new_blob:
+                self._committed.setdefault(new_blob, {}).setdefault(path, revision_id)
+                self._add_blob(new_blob)
+        self._commit_tree = tree_id
+
+    def _add_blob(self, blob_id):
+        if blob_id in self._numbers:
+            return
+        number = len(self._blobs)
+        self._numbers[blob_id] = number
+        self._blobs.append(blob_id)
+        postings = self._postings
+        for gram in trigrams(self.trees.object_store.get(blob_id)):
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = array("I", (number,))
+            else:
+                posting.append(number)
+
+    def _compact(self):
+        """Renumbers the blobs still at a head or in a commit and drops the others from the postings."""
+        live = [blob_id for blob_id in self._blobs if blob_id in self._heads or blob_id in self._committed]
+        renumber = [-1] * len(self._blobs)
+        for number, blob_id in enumerate(live):
+            renumber[self._numbers[blob_id]] = number
+        postings = {}
+        for gram, posting in self._postings.items():
+            kept = array("I", (renumber[number] for number in posting if renumber[number] >= 0))
+            if kept:
+                postings[gram] = kept
+        self._postings = postings
+        self._blobs = live
+        self._numbers = {blob_id: number for number, blob_id in enumerate(live)}
+        self._compact_at = max(1024, 2 * len(live))
+
+    # --- Queries ---
+    def search(self, pattern, history=False, skip_branches=()):
+        """
+        Finds the lines containing `pattern` (case-sensitive, within one line).
+        Matches are grouped by file version, since thousands of branches may
+        hold the same one. Returns (heads, commits), each a (groups, files,
+        complete) tuple: the groups listed, the number of matching files (one
+        per branch holding a version), and whether every matching line is
+        listed. commits is None unless `history` is set. A group is
+          (sort key, path, blob_id, files, places, [(line_number, line)])
+        where places are the first PLACES_LISTED branch names (heads) or the
+        commit ID (commits). At most `limit` lines are listed; past them,
+        candidates are not read, so `files` is an upper bound.
+        """
+        heads, commits = [], []
+        with self._lock:
+            self._apply_queued()
+            for blob_id in self._candidates(pattern):
+                for path, branches in self._heads.get(blob_id, {}).items():
+                    files = len(branches) - sum(name in branches for name in skip_branches)
+                    if files:
+                        places = [name for name in heapq.nsmallest(PLACES_LISTED + len(skip_branches), branches)
+                                  if name not in skip_branches][:PLACES_LISTED]
+                        heads.append(((path, places[0], blob_id), path, blob_id, files, places))
+                if history:
+                    for path, commit_id in self._committed.get(blob_id, {}).items():
+                        timestamp = self.commit_graph.get(commit_id).timestamp
+                        commits.append(((-timestamp, path, commit_id), path, blob_id, 1, [commit_id]))
+        return (self._list(pattern, heads, self.limit),
+                self._list(pattern, commits, self.limit) if history else None)
+
+    def _list(self, pattern, groups, limit):
+        """Reads the groups in order until `limit` lines are listed (see search())."""
+        groups.sort(key=lambda group: group[0])
+        files = sum(group[3] for group in groups)
+        listed = []
+        lines_of = {}
+        for group in groups:
+            blob_id = group[2]
+            if blob_id not in lines_of:
+                lines_of[blob_id] = _matching_lines(self.trees.object_store.get(blob_id), pattern)
+            lines = lines_of[blob_id]
+            if not lines: # Holds every trigram but not the pattern
+                files -= group[3]
+                continue
+            if limit <= 0:
+                return listed, files, False
+            listed.append((*group, lines[:limit]))
+            limit -= len(lines)
+        return listed, files, limit >= 0
+
+    def _candidates(self, pattern):
+        """IDs of the blobs holding every trigram of the pattern (all blobs for patterns under 3 characters)."""
+        grams = trigrams(pattern)
+        if not grams:
+            return list(self._blobs)
+        postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+        found = set(postings[0])
+        for posting in postings[1:]:
+            if not found:
+                break
+            found.intersection_update(posting)
+        return [self._blobs[number] for number in sorted(found)]
+
+
+def _matching_lines(content, pattern):
+    if pattern not in content:
+        return []
+    return [(number, line.rstrip("\r")) for number, line in enumerate(content.split("\n"), 1) if pattern in line]
+
+
+def merge_results(results, limit=GREP_LIMIT):
+    """
+    Combines the search() results of several indexes (the shards). Groups of
+    the same file version are joined; a version committed on more than one
+    shard is listed once, under its oldest commit.
+    """
+    heads = _merge_section([result[0] for result in results], limit, _join_heads)
+    if results[0][1] is None:
+        return heads, None
+    return heads, _merge_section([result[1] for result in results], limit, _oldest_commit)
+
+
+def _join_heads(first, second):
+    places = sorted(set(first[4]) | set(second[4]))[:PLACES_LISTED]
+    return ((first[1], places[0], first[2]), first[1], first[2], first[3] + second[3], places,
+            max(first[5], second[5], key=len))
+
+
+def _oldest_commit(first, second):
+    return max(first, second, key=lambda group: group[0][0]) # Keys hold -timestamp
+
+
+def _merge_section(parts, limit, join):
+    merged = {}
+    files = 0
+    for groups, part_files, _ in parts:
+        files += part_files
+        for group in groups:
+            key = (group[1], group[2])
+            if key in merged:
+                if join is _oldest_commit:
+                    files -= 1
+                group = join(merged[key], group)
+            merged[key] = group
+    listed = []
+    for group in sorted(merged.values(), key=lambda group: group[0]):
+        if limit <= 0:
+            break
+        listed.append((*group[:5], group[5][:limit]))
+        limit -= len(group[5])
+    complete = all(part[2] for part in parts) and len(listed) == len(merged) and limit >= 0
+    return listed, files, complete
+
+
+def format_matches(pattern, heads, commits=None):
+    """
+    The GREP reply: each matching file version as a '<path> on <branches>' (or
+    '<path> in <commit> (<time>)') line followed by its matching lines.
+    """
+    def on_branches(group):
+        more = f" and {group[3] - len(group[4])} more" if group[3] > len(group[4]) else ""
+        return f"{group[1]} on {', '.join(group[4])}{more}"
+
+    def in_commit(group):
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(-group[0][0]))
+        return f"{group[1]} in {group[4][0][:12]} ({when})"
+
+    sections = [("at branch heads", heads, on_branches)]
+    if commits is not None:
+        sections.append(("in committed versions", commits, in_commit))
+    lines = []
+    for title, (groups, files, complete), describe in sections:
+        bound = "" if complete else "up to "
+        lines.append(f"'{pattern}' found in {bound}{files} file(s) {title}{':' if files else '.'}")
+        for group in groups:
+            lines.append(describe(group))
+            lines.extend(f"  {number}: {line}" for number, line in group[5])
+        if not complete:
+            lines.append(f"... more matches not listed (GREP_LIMIT is {GREP_LIMIT} lines).")
+    return "\n".join(lines)
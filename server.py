@@ -1,121 +1,144 @@
-from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR
+import argparse
+import logging
+import os
+from time import perf_counter
+from socket import socket, AF_INET, SOCK_STREAM, SOL_SOCKET, SO_REUSEADDR, IPPROTO_TCP, TCP_NODELAY
 from threading import Thread, active_count
-from config import SRVR_HOST, PORT, BUFFER_SIZE
-from protocol import process_client_request # Renamed
+from config import (SRVR_HOST, PORT, LISTEN_BACKLOG, SERVER_MODE, LOG_LEVEL, METRICS_FILE, METRICS_INTERVAL,
+                    SHARD_COUNT, DATA_DIR, REPLICATION_PORT, REPLICATION_HOST)
+from framing import recv_frame, split_request_id, FrameError, HEADER, OP_HELLO, OP_COMMAND, OP_RESPONSE, FLAG_REQUEST_ID
+from protocol import parse_command, parse_hello, negotiate, local_router
 from vcs_core import vcs
+from pubsub import ThreadSubscriber
+from metrics import metrics
+from replication import ReplicationSource, parse_address, replication_secret, is_loopback
 
-# add: safe broadcast helper
-def broadcast_to_all(message, exclude=None):
-    """Best-effort broadcast to all registered client sockets."""
-    for client_sock in list(getattr(vcs, "connected_clients", [])):
-        if exclude is not None and client_sock is exclude:
-            continue
-        try:
-            client_sock.sendall(message.encode())
-        except Exception:
-            # remove dead sockets quietly
-            try:
-                vcs.connected_clients.remove(client_sock)
-                client_sock.close()
-            except Exception:
-                pass
+logger = logging.getLogger(__name__)
 
-def handle_client_connection(client_socket, client_address): # Improved names
+def handle_client_connection(client_socket, client_address, router=local_router): # Improved names
     """
     Runs in a dedicated thread for each connected client. Manages the 
     handshake, main communication loop, and connection cleanup.
+    Replies are sent from this thread; broadcast notices are sent by the
+    connection's own writer thread (see pubsub.ThreadSubscriber).
     
     Args:
         client_socket (socket.socket): The socket connection to the client.
         client_address (tuple): The IP address and port of the client.
+        router: Runs the commands (protocol.LocalRouter, or sharding.ShardRouter).
     """
-    print(f"[NEW CONNECTION] {client_address} connected.")
+    logger.info("[NEW CONNECTION] %s connected.", client_address)
+    metrics.connection_opened()
     username = "Unknown"
+    subscriber = None
     
     try:
-        # 1. Handshake: Receive the Username
-        username_data = client_socket.recv(BUFFER_SIZE).decode().strip()
-        username = username_data if username_data else "Guest"
+        # 1. Handshake: Receive the Username and capabilities (must be the first frame)
+        hello = recv_frame(client_socket)
+        if hello is None:
+            return
+        opcode, _, body = hello
+        if opcode != OP_HELLO:
+            raise FrameError(f"Expected HELLO frame, got opcode {opcode}.")
+        username, offered = parse_hello(body)
         
-        # Register user with the Core VCS Manager
-        vcs.register_user(username, client_socket)
+        # Register user with the Core VCS Manager and subscribe to notices
+        subscriber = ThreadSubscriber(client_socket, username).start()
+        branch_name = router.register(username, subscriber)
         
-        # Send a welcome message with current branch info
-        welcome_msg = f"Welcome {username}! You are currently on branch 'master'. Type HELP for commands."
-        client_socket.sendall(welcome_msg.encode())
+        # Send a welcome message with current branch info (and the agreed capabilities, if asked)
+        welcome_msg = f"Welcome {username}! You are currently on branch '{branch_name}'. Type HELP for commands."
+        if offered is not None:
+            accepted, subscriber.encoding = negotiate(offered)
+            welcome_msg = f"CAPS:{','.join(accepted)}\n{welcome_msg}"
+        subscriber.send(OP_RESPONSE, welcome_msg)
 
         # 2. Main Communication Loop
         while True:
-            # Wait for a command from the client
-            client_command = client_socket.recv(BUFFER_SIZE).decode()
+            # Wait for a complete command frame from the client
+            frame = recv_frame(client_socket)
             
-            if not client_command:
-                # Client disconnected gracefully (sent empty data)
+            if frame is None:
+                # Client disconnected gracefully (closed the socket)
                 break
             
-            print(f"[{username}] Command received: {client_command.splitlines()[0]}...")
+            opcode, flags, body = frame
+            if opcode != OP_COMMAND:
+                subscriber.send(OP_RESPONSE, f"[ERROR] Unexpected frame type {opcode}.")
+                continue
+            # A pipelining client tags each command with an ID that its reply carries back
+            request_id = None
+            if flags & FLAG_REQUEST_ID:
+                request_id, body = split_request_id(body)
+            
+            # Only the keyword is looked at here; the handler decodes the body itself
+            name, argument = parse_command(body)
+            if logger.isEnabledFor(logging.DEBUG):
+                summary = bytes(body[:40]).decode(errors="replace").partition("\n")[0] # Avoid copying a large EDIT body
+                logger.debug("[%s] Command received: %s...", username, summary)
+            started = perf_counter()
             
             # Detect COMMIT and handle it safely so server doesn't go down
-            if client_command.strip().upper().startswith("COMMIT"):
+            if name == "COMMIT":
                 # protect against protocol code that might raise SystemExit or other fatal signals
                 try:
-                    response = process_client_request(username, client_command)
+                    response = router.execute(username, name, argument)
                 except SystemExit as se:
                     # prevent process exit; report and continue
                     response = f"[ERROR] Commit handler attempted to exit: {se}"
-                    print(response)
+                    logger.error(response)
                 except KeyboardInterrupt as ki:
                     response = "[ERROR] Commit handler interrupted."
-                    print(response)
+                    logger.error(response)
                 except Exception as e:
                     response = f"[ERROR] Commit failed: {e}"
-                    print(response)
+                    logger.error(response)
+                elapsed = perf_counter() - started
                 
                 # send response to the client that issued the commit
+                sent = 0
                 try:
-                    client_socket.sendall(response.encode())
+                    sent = subscriber.send(OP_RESPONSE, response, request_id)
                 except Exception:
                     pass
-
-                # broadcast commit notice to everyone (best-effort)
-                commit_notice = f"[BROADCAST] {username} performed COMMIT: {client_command.strip()[6:].strip() or 'no message'}"
-                broadcast_to_all(commit_notice, exclude=None)
-                # continue processing further commands
+                metrics.observe_command("COMMIT", elapsed, HEADER.size + len(body), sent)
+                # The commit notice to everyone is queued by vcs.commit itself
                 continue
 
             # Non-commit normal processing (also protected)
             try:
-                response = process_client_request(username, client_command)
+                response = router.execute(username, name, argument)
             except Exception as e:
                 response = f"[ERROR] Command processing failed: {e}"
-                print(f"[ERROR] while handling command from {username}: {e}")
+                logger.error("[ERROR] while handling command from %s: %s", username, e)
+            elapsed = perf_counter() - started
             
             # Send the response back to the client
             try:
-                client_socket.sendall(response.encode())
+                sent = subscriber.send(OP_RESPONSE, response, request_id)
             except Exception:
                 # If sending fails, close connection loop gracefully
                 break
+            metrics.observe_command(name or "OTHER", elapsed, HEADER.size + len(body), sent)
 
     except Exception as e:
-        print(f"[ERROR] Connection with {username} ({client_address}) failed: {e}")
+        logger.error("[ERROR] Connection with %s (%s) failed: %s", username, client_address, e)
         
     finally:
         # 3. Connection Cleanup
-        print(f"[DISCONNECT] {username} has left.")
-        if client_socket in getattr(vcs, "connected_clients", []):
-            try:
-                vcs.connected_clients.remove(client_socket)
-            except Exception:
-                pass
+        logger.info("[DISCONNECT] %s has left.", username)
+        metrics.connection_closed()
+        router.unregister(username, subscriber)
+        if subscriber is not None:
+            subscriber.close()
         try:
             client_socket.close()
         except Exception:
             pass
 
-def start_vcs_server(): # Improved name
+def start_vcs_server(host=SRVR_HOST, port=PORT, router=local_router): # Improved name
     """
-    The main entry point for the VCS Server. Initializes the socket and 
+    The main entry point for the threaded VCS Server. Initializes the socket and 
     listens for incoming client connections indefinitely.
     """
     server_socket = socket(AF_INET, SOCK_STREAM)
@@ -124,28 +147,114 @@ def start_vcs_server(): # Improved name
     server_socket.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
     
     try:
-        server_socket.bind((SRVR_HOST, PORT))
-        server_socket.listen(5) # Max 5 queued connections
-        print(f"--- 🚀 Distributed VCS Server Running on {SRVR_HOST}:{PORT} ---")
+        server_socket.bind((host, port))
+        server_socket.listen(LISTEN_BACKLOG)
+        print(f"--- 🚀 Distributed VCS Server Running on {host}:{port} ---")
         print("Waiting for client connections...")
         
         while True:
             try:
                 # Blocking call: waits for a new client to connect
                 client_conn, client_addr = server_socket.accept()
+                # Frames are written whole, so Nagle's algorithm only adds delay
+                # (a reply right after a notice would wait for the client's ACK)
+                client_conn.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
                 
                 # Hand off the connection to a new dedicated thread
                 thread = Thread(target=handle_client_connection, 
-                                args=(client_conn, client_addr), 
+                                args=(client_conn, client_addr, router), 
                                 daemon=True)
                 thread.start()
-                print(f"[ACTIVE CONNECTIONS] {active_count() - 1}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("[ACTIVE CONNECTIONS] %d", active_count() - 1)
             except Exception as e:
                 # log and continue accepting new connections
-                print(f"[ERROR] Accept/dispatch error: {e}")
+                logger.error("[ERROR] Accept/dispatch error: %s", e)
                 continue
             
     except Exception as e:
-        print(f"[FATAL ERROR] Server failed to start: {e}")
+        logger.critical("[FATAL ERROR] Server failed to start: %s", e)
         
-start_vcs_server()
\ No newline at end of file
+def raise_open_file_limit():
+    """Lifts the soft open-file limit to the hard limit so thousands of sockets can be open."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass # Not supported on this platform; keep the default limit
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed VCS Server")
+    parser.add_argument("--mode", choices=("thread", "asyncio", "sharded"), default=SERVER_MODE,
+                        help="thread: one thread per client; asyncio: all clients on one event loop; "
+                             "sharded: branches split across worker processes (one thread per client in front)")
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT,
+                        help="Worker processes in sharded mode (default: one per CPU core)")
+    parser.add_argument("--host", default=SRVR_HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--log-level", default=LOG_LEVEL, choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        help="DEBUG logs every command; INFO logs connections and notices")
+    parser.add_argument("--metrics-file", default=METRICS_FILE,
+                        help="Write Prometheus-format metrics to this file periodically")
+    parser.add_argument("--replication-port", type=int, default=REPLICATION_PORT,
+                        help="Stream the log to read-only followers on this port")
+    parser.add_argument("--replication-host", default=REPLICATION_HOST,
+                        help="Address of the replication port (other than loopback: needs a replication secret)")
+    parser.add_argument("--follow", metavar="[HOST:]PORT",
+                        help="Run as a read-only follower of the primary with this replication port")
+    args = parser.parse_args()
+    if args.mode == "sharded" and (args.replication_port or args.follow):
+        parser.error("replication is not available in sharded mode")
+    if args.replication_port and args.follow:
+        parser.error("a follower cannot stream to followers of its own")
+    if args.follow and not is_loopback(parse_address(args.follow)[0]) and replication_secret() is None:
+        parser.error("following a primary on another host needs REPLICATION_SECRET or VCS_REPLICATION_SECRET")
+
+    logging.basicConfig(level=args.log_level, format="%(message)s")
+    if args.follow:
+        # The state comes from the primary; data_dir only holds spilled branches and mapped files
+        vcs.configure(data_dir=os.path.join(DATA_DIR, f"follower-{args.port}"), follow=parse_address(args.follow))
+    if args.mode == "sharded":
+        # The worker processes hold the repository; this process only routes commands
+        from sharding import ShardRouter, start_shards
+        try:
+            router = store = ShardRouter(start_shards(args.shards, args.log_level))
+        except (ValueError, ConnectionError) as e:
+            logger.critical("[FATAL ERROR] Shards failed to start: %s", e)
+            return
+    else:
+        if args.replication_port:
+            try:
+                ReplicationSource(vcs, args.replication_port, args.replication_host).start()
+            except OSError as e:
+                logger.critical("[FATAL ERROR] Replication port %d unavailable: %s", args.replication_port, e)
+                return
+            except ValueError as e:
+                logger.critical("[FATAL ERROR] Replication refused: %s", e)
+                return
+        # Recover the repository store (a follower: load the primary's snapshot) on a
+        # thread; connections are accepted meanwhile and their first command waits until it is open
+        vcs.open_in_background()
+        router, store = local_router, vcs
+    if args.metrics_file:
+        metrics.start_prometheus_dump(store, args.metrics_file, METRICS_INTERVAL)
+    raise_open_file_limit()
+    try:
+        if args.mode == "asyncio":
+            from async_server import start_async_vcs_server
+            start_async_vcs_server(args.host, args.port)
+        else:
+            start_vcs_server(args.host, args.port, router)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Last metrics first (the shards are gone once closed), then flush the
+        # write-ahead log(s) and leave a fresh checkpoint behind
+        if args.metrics_file and (store is router or vcs.is_open):
+            metrics.write_prometheus(store, args.metrics_file)
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,630 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock, Thread, local
+from config import DATA_DIR, SHARED_FILE, DEFAULT_PATH, SHARD_WORKER_THREADS
+from protocol import dispatch_command, parse_batch, parse_grep, synced_revisions, _sync_response
+from vcs_core import vcs
+from pubsub import Broker
+from metrics import metrics
+from wal import encode_record, read_records
+from search_index import merge_results, format_matches
+
+# Sharded mode (python server.py --mode sharded --shards N): N worker processes
+# each run their own VersionControlSystem under DATA_DIR/shard-<i>, and every
+# branch belongs to exactly one of them (shard_of). The server process is only
+# a front-end: it owns the client connections and the sessions, and sends each
+# command to the shard that owns the user's branch, so diff and merge work on
+# different shards runs on different cores instead of sharing one GIL.
+#
+# Shards share content through packs (SharedPack): each one appends every object
+# and revision it creates to DATA_DIR/shared/pack.<i> and reads the others' packs
+# when a command refers to a revision it has not seen. A merge of a branch from
+# another shard therefore sends only the branch name and head revision ID between
+# processes; the shard doing the merge reads the objects from the packs.
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(branch_name, count):
+    """The shard that owns a branch (a stable hash, so it survives restarts)."""
+    return zlib.crc32(branch_name.encode()) % count
+
+
+def check_shard_count(data_dir, count):
+    """Records the shard count on first start; refuses to reopen the data with a different one."""
+    directory = os.path.join(data_dir, "shared")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "shards")
+    if os.path.exists(path):
+        with open(path) as f:
+            stored = int(f.read())
+        if stored != count:
+            raise ValueError(f"The repository in '{data_dir}' was created with {stored} shards. "
+                             f"Start the server with --shards {stored}.")
+        return
+    with open(path, "w") as f:
+        f.write(str(count))
+
+
+class SharedPack:
+    """
+    The content store shared by the shards. pack.<i> holds every object and
+    revision that shard i created, framed like write-ahead log records. A shard
+    appends its own records (flush() before replying, so the others can read
+    them) and reads the other packs from where it last stopped (catch_up).
+    Objects and revisions are content-addressed, so one that is read twice or
+    from two packs is simply kept once.
+    """
+    def __init__(self, directory, index, count, vcs):
+        os.makedirs(directory, exist_ok=True)
+        self.index = index
+        self.vcs = vcs
+        self._paths = [os.path.join(directory, f"pack.{i}") for i in range(count)]
+        self._offsets = [0] * count
+        self._file = None
+        self._write_lock = Lock()
+        self._read_lock = Lock()
+
+    def open(self):
+        """
+        Reads every pack, appends whatever this shard holds that no pack has (the
+        whole store on the first sharded start, or records lost in a crash), and
+        from then on appends each new object and revision as it is created.
+        """
+        seen = set()
+        own_path = self._paths[self.index]
+        if os.path.exists(own_path):
+            records, valid_length = read_records(own_path)
+            seen.update(record[1] for record in records)
+            with open(own_path, "r+b") as f:
+                f.truncate(valid_length) # Drop a torn tail so new records append cleanly
+        self.catch_up(seen)
+
+        self._file = open(own_path, "ab")
+        objects, deltas = self.vcs.object_store.snapshot()
+        for object_id, compressed in objects.items():
+            if object_id not in seen:
+                self._append(("obj", object_id, ("k", compressed)))
+        # Shortest chains first, so every delta is written after its base
+        for object_id, (base_id, depth, ops) in sorted(deltas.items(), key=lambda item: item[1][1]):
+            if object_id not in seen:
+                self._append(("obj", object_id, ("d", base_id, depth, ops)))
+        for revision_id, node in self.vcs.commit_graph.snapshot().items():
+            if revision_id not in seen:
+                self._append(("rev", revision_id, tuple(node)))
+        self.flush()
+
+        # Keep logging to the shard's own write-ahead log as before
+        log_object = self.vcs.object_store.on_new_object
+        log_revision = self.vcs.commit_graph.on_new_revision
+        def on_new_object(object_id, entry):
+            log_object(object_id, entry)
+            self._append(("obj", object_id, entry))
+        def on_new_revision(revision_id, node):
+            log_revision(revision_id, node)
+            self._append(("rev", revision_id, tuple(node)))
+        self.vcs.object_store.on_new_object = on_new_object
+        self.vcs.commit_graph.on_new_revision = on_new_revision
+
+    def _append(self, record):
+        with self._write_lock:
+            self._file.write(encode_record(record))
+
+    def flush(self):
+        with self._write_lock:
+            self._file.flush()
+
+    def catch_up(self, seen=None):
+        """
+        Loads the records the other shards have added to their packs since the last call.
+        Every pack is read only up to the size it had before the first one was read:
+        a record appended later may refer to objects another shard appended after
+        its pack was read, and must wait for the next call.
+        """
+        with self._read_lock:
+            sizes = [os.path.getsize(path) if index != self.index and os.path.exists(path) else 0
+                     for index, path in enumerate(self._paths)]
+            for index, path in enumerate(self._paths):
+                if sizes[index] <= self._offsets[index]:
+                    continue
+                records, self._offsets[index] = read_records(path, self._offsets[index], sizes[index])
+                for kind, record_id, entry in records:
+                    if kind == "obj":
+                        self.vcs.object_store.load_entry(record_id, entry)
+                    elif not self.vcs.commit_graph.contains(record_id):
+                        self.vcs.commit_graph.load_entry(record_id, entry)
+                    if seen is not None:
+                        seen.add(record_id)
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+
+
+class _NoticeQueue:
+    """
+    Takes the place of the shard's Broker: the shard has no client connections,
+    so commit/merge notices wait here and go back to the front-end with the next
+    reply, which publishes them to every client.
+    """
+    def __init__(self):
+        self._notices = deque()
+
+    def publish(self, kind, message):
+        self._notices.append((kind, message))
+
+    def take_all(self):
+        notices = []
+        try:
+            while True:
+                notices.append(self._notices.popleft())
+        except IndexError: # Empty (another request may have taken the last ones)
+            return notices
+
+    def close(self):
+        pass
+
+
+# Marks a user without a local copy (not in protocol.synced_revisions)
+_NOT_SYNCED = object()
+
+
+def _picklable(response):
+    """A response with memoryview parts (SHOW) turned into bytes, so it can be sent to the front-end."""
+    if isinstance(response, tuple):
+        return tuple(bytes(part) if isinstance(part, memoryview) else part for part in response)
+    return bytes(response) if isinstance(response, memoryview) else response
+
+
+class ShardWorker:
+    """
+    One shard, inside its worker process: the VersionControlSystem for the
+    branches it owns, its shared pack, and the calls the front-end makes
+    (RPC_METHODS). Commands come with the user's session (branch, open file and
+    synced version), the official version and the heads of any branches from
+    other shards they name, since all of those are kept by the front-end.
+    """
+    RPC_METHODS = ("execute", "draft", "head", "create_branch", "delete_branch", "resolve",
+                   "official_state", "grep", "gauges")
+
+    def __init__(self, index, count, data_dir, sequence):
+        directory = os.path.join(data_dir, f"shard-{index}")
+        # The shard that owns 'master' imports and mirrors the usual shared file
+        shared_file = SHARED_FILE if index == shard_of("master", count) else \
+            os.path.join(directory, os.path.basename(SHARED_FILE))
+        vcs.configure(data_dir=directory, shared_file=shared_file)
+        self.vcs = vcs.get()
+        # Every shard keeps a 'master' of its own; only the owner's is the real one
+        self.copies = () if index == shard_of("master", count) else ("master",)
+        self.notices = _NoticeQueue()
+        self.vcs.broker = self.notices
+        # Heads of other shards' branches named by the command running on this thread
+        self._request = local()
+        self.vcs.ref_resolver = lambda name: getattr(self._request, "refs", {}).get(name)
+        # ...and the commit it made official, if any, with its sequence number
+        self.vcs.on_commit = lambda revision_id, number: setattr(self._request, "committed", (revision_id, number))
+        # Commits on every shard are numbered from the counter the front-end shares with them,
+        # which starts above every number already logged (no commit runs before every shard is open)
+        self.sequence = sequence
+        with sequence.get_lock():
+            sequence.value = max(sequence.value, self.vcs.official_sequence)
+        self.vcs.commit_sequence = self._next_sequence
+        self.pack = SharedPack(os.path.join(data_dir, "shared"), index, count, self.vcs)
+        self.pack.open()
+        # An official version adopted after the last checkpoint is only in the packs, which
+        # were not read when the store was recovered: index it now that it is readable
+        self.vcs.search_index.committed(self.vcs.official_revision_id)
+
+    def _next_sequence(self):
+        with self.sequence.get_lock():
+            self.sequence.value += 1
+            return self.sequence.value
+
+    def _run_in_session(self, username, session, official, refs, catch_up, action):
+        """Runs action() as `username` with the front-end's session state, then returns the reply tuple."""
+        graph = self.vcs.commit_graph
+        synced = session.get("synced")
+        needed = [official, *refs.values()] + ([synced[0]] if synced else [])
+        if catch_up or not all(graph.contains(revision_id) for revision_id in needed if revision_id):
+            self.pack.catch_up()
+        # Commits happen on every shard: catch up with the newest one the front-end knows of
+        if official and graph.contains(official[0]):
+            self.vcs.adopt_official(*official)
+        self.vcs.set_session(username, session["branch"], session["path"])
+        if "synced" in session:
+            synced_revisions[username] = synced
+        self._request.refs = refs
+        self._request.committed = None
+        try:
+            response = _picklable(action())
+        finally:
+            self._request.refs = {}
+            changed, self._request.committed = self._request.committed, None
+            synced = synced_revisions.pop(username, _NOT_SYNCED)
+            self.pack.flush() # New objects must be readable by the other shards before the reply
+
+        session = {"branch": self.vcs.get_active_branch(username).name, "path": self.vcs.get_user_path(username)}
+        if synced is not _NOT_SYNCED:
+            session["synced"] = synced
+        return response, session, changed, self.notices.take_all()
+
+    def execute(self, username, session, official, refs, catch_up, name, argument):
+        """
+        Runs one client command. Returns (response, session, official, notices): the
+        user's session afterwards, (revision ID, sequence number) of the commit it
+        made official (else None) and the notices it published.
+        """
+        return self._run_in_session(username, session, official, refs, catch_up,
+                                    lambda: dispatch_command(username, name, argument))
+
+    def draft(self, username, session, official, refs, catch_up, status):
+        """The user's draft with a status line, as the reply to a command the front-end handled."""
+        return self._run_in_session(username, session, official, refs, catch_up,
+                                    lambda: _sync_response(username, status))
+
+    def head(self, branch_name):
+        head = self.vcs.branch_head(branch_name)
+        # The request that made this head may not have flushed its records yet
+        self.pack.flush()
+        return head
+
+    def create_branch(self, username, branch_name, revision_id):
+        """Creates a branch at a revision from another shard (BRANCH when the new name belongs here)."""
+        if not self.vcs.commit_graph.contains(revision_id):
+            self.pack.catch_up()
+        status = self.vcs.create_branch(username, branch_name, revision_id)
+        self.pack.flush()
+        return status
+
+    def delete_branch(self, username, branch_name):
+        return self.vcs.delete_branch(username, branch_name)
+
+    def resolve(self, prefix):
+        """Full ID of a revision this shard holds, from a unique prefix (None if not found here)."""
+        revision_id = self.vcs.commit_graph.resolve_prefix(prefix)
+        self.pack.flush()
+        return revision_id
+
+    def official_state(self):
+        """(official revision ID, its sequence number), used by the front-end at startup."""
+        return self.vcs.official_revision_id, self.vcs.official_sequence
+
+    def grep(self, pattern, history):
+        """GREP on this shard: search_index.SearchIndex.search() over the branches it owns."""
+        return self.vcs.search_index.search(pattern, history, skip_branches=self.copies)
+
+    def gauges(self):
+        return self.vcs.gauges()
+
+    def close(self):
+        self.vcs.close()
+        self.pack.close()
+
+
+def run_shard(index, count, data_dir, connection, log_level, sequence):
+    """
+    Entry point of a worker process. Requests arrive on `connection` as
+    (request_id, method, args) and run on a thread pool, so a commit waiting for
+    its fsync does not hold up the shard; replies go back as
+    (request_id, ok, result) in the order they finish.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C reaches the front-end, which shuts the shards down
+    logging.basicConfig(level=log_level, format=f"[shard {index}] %(message)s")
+    worker = ShardWorker(index, count, data_dir, sequence)
+    send_lock = Lock()
+
+    def run(request_id, method, args):
+        try:
+            reply = (request_id, True, getattr(worker, method)(*args))
+        except Exception as e:
+            logger.error("[ERROR] %s failed: %s", method, e)
+            reply = (request_id, False, f"{type(e).__name__}: {e}")
+        with send_lock:
+            connection.send(reply)
+
+    with ThreadPoolExecutor(SHARD_WORKER_THREADS, thread_name_prefix=f"shard-{index}") as pool:
+        while True:
+            try:
+                request_id, method, args = connection.recv()
+            except (EOFError, OSError):
+                break # The front-end has gone away
+            if method == "close":
+                break
+            if method not in ShardWorker.RPC_METHODS:
+                with send_lock:
+                    connection.send((request_id, False, f"Unknown shard call '{method}'."))
+                continue
+            pool.submit(run, request_id, method, args)
+    worker.close()
+    connection.close()
+
+
+class ShardClient:
+    """
+    The front-end's connection to one worker process. call() may be used from
+    any number of threads at once: each request carries an ID and a reader
+    thread hands every reply to the caller waiting for it.
+    """
+    def __init__(self, index, connection, process, sequence):
+        self.index = index
+        self.process = process
+        # The commit sequence counter the worker shares with the other shards (the
+        # front-end must keep it alive while the worker starts and attaches to it)
+        self.sequence = sequence
+        self._connection = connection
+        self._pending = {} # { request_id: Future }
+        self._ids = itertools.count()
+        self._send_lock = Lock()
+        self._closed = False
+        self._reader = Thread(target=self._read_replies, name=f"shard-{index}-replies", daemon=True)
+        self._reader.start()
+
+    def call(self, method, *args):
+        """Runs a ShardWorker method in the worker process and returns its result."""
+        future = Future()
+        with self._send_lock:
+            if self._closed:
+                raise ConnectionError(f"Shard {self.index} is not running.")
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            self._connection.send((request_id, method, args))
+        return future.result()
+
+    def _read_replies(self):
+        while True:
+            try:
+                request_id, ok, result = self._connection.recv()
+            except (EOFError, OSError):
+                break
+            future = self._pending.pop(request_id)
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(RuntimeError(f"Shard {self.index}: {result}"))
+        with self._send_lock:
+            self._closed = True
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError(f"Shard {self.index} stopped."))
+
+    def close(self, timeout=30):
+        """Asks the worker to write its final checkpoint and exit, and waits for it."""
+        with self._send_lock:
+            if not self._closed:
+                try:
+                    self._connection.send((None, "close", ()))
+                except OSError:
+                    pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def start_shards(count=None, log_level="INFO", data_dir=DATA_DIR):
+    """Starts the worker processes and returns a ShardClient for each (they open their stores in parallel)."""
+    count = count or os.cpu_count() or 1
+    check_shard_count(data_dir, count)
+    # Spawned rather than forked: the front-end already runs threads
+    context = multiprocessing.get_context("spawn")
+    # Commit sequence numbers, shared by every shard (see ShardWorker)
+    sequence = context.Value("q", 0)
+    shards = []
+    for index in range(count):
+        connection, child_connection = context.Pipe()
+        process = context.Process(target=run_shard, name=f"vcs-shard-{index}", daemon=True,
+                                  args=(index, count, data_dir, child_connection, log_level, sequence))
+        process.start()
+        child_connection.close()
+        shards.append(ShardClient(index, connection, process, sequence))
+    return shards
+
+
+def _text(argument):
+    return str(argument, "utf-8").strip()
+
+
+class ShardRouter:
+    """
+    The front-end of the sharded server, used by the threaded server in place of
+    protocol.LocalRouter. It keeps every user's session (branch, open file and
+    synced version) and the official version, and runs each command on the
+    shard that owns the user's branch. Commands that name another branch
+    (BRANCH, CHECKOUT, DELETE_BRANCH, MERGE, BATCH, LOG, DIFF) look it up on the shard
+    that owns it first; GREP asks every shard. Sessions live in memory: after a
+    restart every user starts on 'master'.
+    """
+    def __init__(self, shards):
+        self.shards = shards
+        self.broker = Broker()
+        # { "username": {"branch": name, "path": path[, "synced": (revision_id, path) or None]} }
+        self.sessions = {}
+        self._lock = Lock()
+        # (revision ID, sequence number) of the newest commit reported by any shard
+        # (replies from two shards may arrive out of order)
+        self.official = self._find_official()
+        self._routes = {
+            "STATS": self._stats,
+            "BRANCH": self._branch,
+            "CHECKOUT": self._checkout,
+            "DELETE_BRANCH": self._delete_branch,
+            "MERGE": self._merge,
+            "BATCH": self._batch,
+            "LOG": self._log,
+            "DIFF": self._diff,
+            "GREP": self._grep,
+        }
+
+    def _shard(self, branch_name):
+        return self.shards[shard_of(branch_name, len(self.shards))]
+
+    def _find_official(self):
+        """
+        (revision ID, sequence number) of the newest commit of any shard; before
+        the first commit, of the root of 'master'.
+        """
+        states = [shard.call("official_state") for shard in self.shards]
+        official = states[self._shard("master").index]
+        for state in states:
+            if state[1] > official[1]:
+                official = state
+        return official
+
+    def _session(self, username):
+        with self._lock:
+            return dict(self.sessions.get(username) or {"branch": "master", "path": DEFAULT_PATH})
+
+    # --- Router interface (see protocol.LocalRouter) ---
+    def register(self, username, subscriber):
+        self.broker.subscribe(subscriber)
+        with self._lock:
+            session = self.sessions.setdefault(username, {"branch": "master", "path": DEFAULT_PATH})
+            return session["branch"]
+
+    def execute(self, username, name, argument):
+        if name is None:
+            return dispatch_command(username, name, argument) # The usual error reply
+        route = self._routes.get(name)
+        if route is not None:
+            return route(username, name, argument)
+        return self._call(username, "execute", name, bytes(argument))
+
+    def unregister(self, username, subscriber):
+        self.broker.unsubscribe(subscriber)
+        with self._lock:
+            session = self.sessions.get(username)
+            if session is not None:
+                session.pop("synced", None)
+
+    # --- Calls into the shards ---
+    def _call(self, username, method, *args, shard=None, refs=None, catch_up=False):
+        """Runs a ShardWorker.execute/draft call for the user and applies what it changed."""
+        session = self._session(username)
+        shard = shard or self._shard(session["branch"])
+        response, session, official, notices = shard.call(
+            method, username, session, self.official, refs or {}, catch_up, *args)
+        with self._lock:
+            self.sessions[username] = session
+            if official is not None and official[1] > self.official[1]:
+                self.official = official
+        for kind, message in notices:
+            self.broker.publish(kind, message)
+        return response
+
+    def _remote_heads(self, branch_name, refs):
+        """{ ref: head } for the refs that are branches owned by another shard than branch_name's."""
+        home = self._shard(branch_name)
+        heads = {}
+        for ref in refs:
+            if ref in ("", "HEAD", "official") or self._shard(ref) is home:
+                continue
+            head = self._shard(ref).call("head", ref)
+            if head is not None:
+                heads[ref] = head
+        return heads
+
+    def _stats(self, username, name, argument):
+        return metrics.render_text(self)
+
+    def _branch(self, username, name, argument):
+        new_name = _text(argument)
+        branch_name = self._session(username)["branch"]
+        owner, home = self._shard(new_name), self._shard(branch_name)
+        if owner is home:
+            return self._call(username, "execute", name, bytes(argument))
+        head = home.call("head", branch_name)
+        if head is None:
+            return f"Error: Branch '{branch_name}' not found."
+        return owner.call("create_branch", username, new_name, head)
+
+    def _checkout(self, username, name, argument):
+        target = _text(argument)
+        owner = self._shard(target)
+        if owner.call("head", target) is None:
+            # Not a branch: a version ID, checked out on the shard that owns its 'detached-<id>' branch
+            found = {shard.call("resolve", target) for shard in self.shards} - {None}
+            if len(found) != 1:
+                return self._call(username, "draft", f"Error: Branch or version '{target}' not found.")
+            revision_id = found.pop()
+            owner = self._shard(f"detached-{revision_id[:12]}")
+            argument = revision_id.encode()
+        return self._call(username, "execute", name, bytes(argument), shard=owner, catch_up=True)
+
+    def _delete_branch(self, username, name, argument):
+        target = _text(argument)
+        status = self._shard(target).call("delete_branch", username, target)
+        if not status.startswith("Error:"):
+            with self._lock:
+                for session in self.sessions.values():
+                    if session["branch"] == target:
+                        session["branch"] = "master"
+        return self._call(username, "draft", status)
+
+    def _merge(self, username, name, argument):
+        source = _text(argument)
+        branch_name = self._session(username)["branch"]
+        refs = self._remote_heads(branch_name, [source])
+        if source not in refs and self._shard(source) is not self._shard(branch_name):
+            return self._call(username, "draft", f"Error: Branch '{source}' not found.")
+        return self._call(username, "execute", name, bytes(argument), refs=refs)
+
+    def _batch(self, username, name, argument):
+        try:
+            sources = [_text(step_argument) for step_name, step_argument in parse_batch(argument)
+                       if step_name == "MERGE"]
+        except ValueError:
+            sources = [] # The shard reports the malformed batch
+        branch_name = self._session(username)["branch"]
+        refs = self._remote_heads(branch_name, sources)
+        for source in sources:
+            if source not in refs and self._shard(source) is not self._shard(branch_name):
+                return self._call(username, "draft", f"Error: Branch '{source}' not found. Nothing was applied.")
+        return self._call(username, "execute", name, bytes(argument), refs=refs)
+
+    def _log(self, username, name, argument):
+        ref = _text(argument)
+        refs = self._remote_heads(self._session(username)["branch"], [ref])
+        # Anything else may be a version ID from another shard
+        return self._call(username, "execute", name, bytes(argument), refs=refs, catch_up=bool(ref))
+
+    def _diff(self, username, name, argument):
+        first, _, second = _text(argument).partition("..")
+        refs = self._remote_heads(self._session(username)["branch"], [first.strip(), second.strip()])
+        return self._call(username, "execute", name, bytes(argument), refs=refs, catch_up=True)
+
+    def _grep(self, username, name, argument):
+        try:
+            pattern, history = parse_grep(argument)
+        except ValueError as e:
+            return f"Error: {e}"
+        results = [shard.call("grep", pattern, history) for shard in self.shards]
+        return format_matches(pattern, *merge_results(results))
+
+    # --- Reports (metrics.ServerMetrics) ---
+    def gauges(self):
+        """
+        The shards' gauges added up. Objects read from another shard's pack count
+        once per shard holding them, and every shard keeps a 'master' of its own.
+        """
+        totals = {}
+        for shard in self.shards:
+            for gauge_name, help_text, value in shard.call("gauges"):
+                previous = totals.get(gauge_name, (help_text, 0))
+                totals[gauge_name] = (help_text, previous[1] + value)
+        with self._lock:
+            totals["sessions"] = ("Users with a session", len(self.sessions))
+        gauges = [(gauge_name, help_text, value) for gauge_name, (help_text, value) in totals.items()]
+        gauges.append(("shards", "Shard worker processes", len(self.shards)))
+        return gauges
+
+    def close(self):
+        """Delivers the last notices and shuts every shard down (each writes a final checkpoint)."""
+        self.broker.close()
+        for shard in self.shards:
+            shard.close()
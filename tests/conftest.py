@@ -0,0 +1,51 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_vcs(tmp_path):
+    """
+    Builds VersionControlSystem instances on a temporary data directory and
+    shared file (reopening the same directory recovers its state). Every one
+    still open at the end of the test is closed.
+    """
+    from vcs_core import VersionControlSystem
+    opened = []
+
+    def make(**options):
+        options.setdefault("data_dir", str(tmp_path / "vcs_data"))
+        options.setdefault("shared_file", str(tmp_path / "server_repo.txt"))
+        vcs = VersionControlSystem(**options)
+        opened.append(vcs)
+        return vcs
+
+    yield make
+    for vcs in opened:
+        if vcs.wal is not None and not vcs.wal._closed:
+            vcs.close()
+
+
+@pytest.fixture
+def serve(make_vcs, monkeypatch):
+    """
+    Points the command handlers of protocol.py at a fresh VersionControlSystem
+    and returns run(username, command), which gives the reply as one string.
+    """
+    import protocol
+    vcs = make_vcs()
+    monkeypatch.setattr(protocol, "vcs", vcs)
+    monkeypatch.setattr(protocol, "synced_revisions", {})
+
+    def run(username, command):
+        reply = protocol.process_client_request(username, command)
+        if isinstance(reply, str):
+            return reply
+        return "".join(part if isinstance(part, str) else bytes(part).decode() for part in reply)
+
+    run.vcs = vcs
+    return run
@@ -0,0 +1,67 @@
+def test_history_is_trimmed_to_its_limit(make_vcs):
+    vcs = make_vcs(history_limit=8)
+    vcs.register_user("alice")
+    for n in range(50):
+        vcs.edit("alice", f"version {n}\n")
+    undos = 0
+    while vcs.undo("alice") == "Undo successful.":
+        undos += 1
+    assert 8 - 1 <= undos <= 8 + 8 // 4 # Trimmed back to the limit once a quarter more have piled up
+    assert vcs.get_active_branch("alice").read_file(vcs.get_user_path("alice")) == f"version {49 - undos}\n"
+    while vcs.redo("alice") == "Redo successful.":
+        pass
+    assert vcs.get_active_branch("alice").read_file(vcs.get_user_path("alice")) == "version 49\n"
+
+
+def test_idle_branches_are_spilled_and_loaded_back(make_vcs):
+    vcs = make_vcs(branch_cache_entries=2)
+    vcs.register_user("bob")
+    for i in range(6):
+        vcs.create_branch("bob", f"b{i}")
+        vcs.switch_branch("bob", f"b{i}")
+        vcs.edit("bob", f"branch {i}\n")
+        vcs.edit("bob", f"branch {i}, second edit\n")
+    assert len(vcs.branch_store) > 0
+    for i in range(6):
+        vcs.switch_branch("bob", f"b{i}")
+        assert vcs.get_active_branch("bob").read_file("server_repo.txt") == f"branch {i}, second edit\n"
+        assert vcs.undo("bob") == "Undo successful." # The history came back with the branch
+        assert vcs.get_active_branch("bob").read_file("server_repo.txt") == f"branch {i}\n"
+
+
+def test_deleting_a_spilled_branch_moves_its_users_to_master(make_vcs):
+    vcs = make_vcs(branch_cache_entries=1)
+    vcs.register_user("bob")
+    vcs.register_user("carol")
+    vcs.create_branch("bob", "old")
+    vcs.switch_branch("bob", "old")
+    for i in range(4):
+        vcs.create_branch("carol", f"b{i}") # Pushes 'old' out of the cache
+        vcs.switch_branch("carol", f"b{i}")
+        vcs.edit("carol", f"b{i}\n")
+    assert "old" in vcs.branch_store._names
+    assert vcs.delete_branch("alice", "old") == "Branch 'old' deleted."
+    assert vcs.get_active_branch("bob").name == "master"
+    assert vcs.switch_branch("bob", "old") == "Error: Branch 'old' not found."
+    assert vcs.delete_branch("bob", "master").startswith("Error:")
+
+
+def test_spilled_branches_survive_a_restart(make_vcs):
+    vcs = make_vcs(branch_cache_entries=2)
+    vcs.register_user("bob")
+    for i in range(10):
+        vcs.create_branch("bob", f"b{i}")
+        vcs.switch_branch("bob", f"b{i}")
+        vcs.edit("bob", f"branch {i}\n")
+    assert len(vcs.branch_store) > 0
+    assert vcs.checkpoint()
+    vcs.switch_branch("bob", "b0")
+    vcs.edit("bob", "b0 after the checkpoint\n")
+    vcs.wal.close()
+
+    recovered = make_vcs(branch_cache_entries=2)
+    for i in range(1, 10):
+        recovered.switch_branch("bob", f"b{i}")
+        assert recovered.get_active_branch("bob").read_file("server_repo.txt") == f"branch {i}\n"
+    recovered.switch_branch("bob", "b0")
+    assert recovered.get_active_branch("bob").read_file("server_repo.txt") == "b0 after the checkpoint\n"
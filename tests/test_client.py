@@ -0,0 +1,64 @@
+import socket
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from client import ScriptClient
+from framing import (send_frame, recv_frame, split_request_id, with_request_id, FLAG_REQUEST_ID,
+                     OP_HELLO, OP_RESPONSE)
+
+
+@pytest.fixture
+def echo_server(request):
+    """
+    A server that agrees to request IDs and replies to each command with its own
+    text (as many times as the test's parameter says, once by default). Yields its port.
+    """
+    replies = getattr(request, "param", 1)
+    listener = socket.create_server(("127.0.0.1", 0))
+
+    def serve():
+        connection, _ = listener.accept()
+        with connection:
+            opcode, _, _ = recv_frame(connection)
+            assert opcode == OP_HELLO
+            send_frame(connection, OP_RESPONSE, "CAPS:request-id\nWelcome!")
+            while (frame := recv_frame(connection)) is not None:
+                request_id, body = split_request_id(frame[2])
+                for _ in range(replies):
+                    send_frame(connection, OP_RESPONSE, with_request_id(request_id, bytes(body)), FLAG_REQUEST_ID)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield listener.getsockname()[1]
+    listener.close()
+    thread.join(timeout=5)
+
+
+def test_pipelined_replies_match_their_commands(echo_server):
+    with ScriptClient("alice", "127.0.0.1", echo_server) as client:
+        assert client.welcome == "Welcome!"
+        commands = [f"EDIT:version {n}" for n in range(100)]
+        assert client.run(commands, timeout=5) == commands
+
+
+def test_request_ids_wrap_around_and_skip_those_in_flight(echo_server):
+    with ScriptClient("alice", "127.0.0.1", echo_server) as client:
+        waiting = Future()
+        with client._send_lock:
+            client._next_id = 2 ** 32 - 2
+            client._pending[0] = waiting # A command sent long ago, still without a reply
+        futures = client._send(["LOG", "PEEK", "LS"])
+        assert [future.result(5) for future in futures] == ["LOG", "PEEK", "LS"]
+        assert client._next_id == 2 # 2**32 - 2, 2**32 - 1, then 1: 0 was skipped
+        assert client._pending.pop(0) is waiting
+
+
+@pytest.mark.parametrize("echo_server", [2], indirect=True)
+def test_replies_to_no_pending_request_are_ignored(echo_server):
+    with ScriptClient("alice", "127.0.0.1", echo_server) as client:
+        commands = [f"EDIT:version {n}" for n in range(50)]
+        assert client.run(commands, timeout=5) == commands # Every duplicate arrives after its request completed
+        assert client.request("LOG", timeout=5) == "LOG"
+        assert client._reader.is_alive()
@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from commit_graph import CommitGraph
+
+
+def _ancestors(graph, revision_id):
+    """Every ancestor of a revision by a plain walk (the reference the indexed queries must agree with)."""
+    seen, stack = set(), [revision_id]
+    while stack:
+        current = stack.pop()
+        if current not in seen:
+            seen.add(current)
+            stack.extend(graph.parents(current))
+    return seen
+
+
+def _best_common_ancestors(graph, first, second):
+    common = _ancestors(graph, first) & _ancestors(graph, second)
+    return {c for c in common if not any(c != other and c in _ancestors(graph, other) for other in common)}
+
+
+def _random_dag(seed, size=150):
+    rng = random.Random(seed)
+    graph = CommitGraph()
+    ids = [graph.add("tree-root", (), timestamp=0)]
+    for n in range(1, size):
+        if len(ids) > 2 and rng.random() < 0.25:
+            parents = tuple(rng.sample(ids[-20:], 2))
+        else:
+            parents = (rng.choice(ids[-10:]),)
+        ids.append(graph.add(f"tree-{n}", parents, timestamp=n))
+    return graph, ids
+
+
+def test_merge_base_of_a_criss_cross_history_is_a_best_common_ancestor():
+    #     a1 --- a2 (merges b1)
+    #    /   \ /
+    # root    X
+    #    \   / \
+    #     b1 --- b2 (merges a1)
+    graph = CommitGraph()
+    root = graph.add("t0", ())
+    a1 = graph.add("ta1", (root,))
+    b1 = graph.add("tb1", (root,))
+    a2 = graph.add("ta2", (a1, b1))
+    b2 = graph.add("tb2", (b1, a1))
+    assert graph.merge_base(a2, b2) in (a1, b1)
+    assert graph.merge_base(graph.add("ta3", (a2,)), graph.add("tb3", (b2,))) in (a1, b1)
+
+
+def test_merge_base_of_linear_and_unrelated_histories():
+    graph = CommitGraph()
+    chain = [graph.add("t0", ())]
+    for n in range(1, 40):
+        chain.append(graph.add(f"t{n}", (chain[-1],)))
+    fork = graph.add("fork", (chain[12],))
+    assert graph.merge_base(chain[-1], fork) == chain[12]
+    assert graph.merge_base(chain[30], chain[5]) == chain[5]
+    assert graph.merge_base(chain[-1], graph.add("other root", ())) is None
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_indexed_ancestry_agrees_with_a_full_walk(seed):
+    graph, ids = _random_dag(seed)
+    rng = random.Random(seed)
+    for _ in range(300):
+        first, second = rng.choice(ids), rng.choice(ids)
+        assert graph.is_ancestor(first, second) == (first in _ancestors(graph, second))
+        assert graph.merge_base(first, second) in _best_common_ancestors(graph, first, second)
+    for revision_id in ids[::7]:
+        node = graph.get(revision_id)
+        for depth in range(node.depth + 1):
+            ancestor = graph.ancestor_at_depth(revision_id, depth)
+            assert graph.get(ancestor).depth == depth
+            assert graph.is_ancestor(ancestor, revision_id)
+
+
+def test_log_and_checkout_by_version_id(make_vcs):
+    vcs = make_vcs()
+    vcs.register_user("alice")
+    vcs.edit("alice", "first\n")
+    assert vcs.commit("alice", "first version").startswith("Commit")
+    first_id = vcs.official_revision_id
+    vcs.edit("alice", "second\n")
+    vcs.commit("alice", "second version")
+
+    log = vcs.log("alice").splitlines()
+    assert "second version (official)" in log[0]
+    assert any(line.startswith(first_id[:12]) and "first version" in line for line in log)
+    assert vcs.checkout_revision("alice", first_id[:8]).startswith(f"Checked out version {first_id[:12]}")
+    assert vcs.get_active_branch("alice").read_file(vcs.get_user_path("alice")) == "first\n"
+    assert vcs.checkout_revision("alice", "zzzz").startswith("Error:")
@@ -0,0 +1,111 @@
+"""
+Multithreaded stress test for VersionControlSystem locking.
+
+Many threads run random EDIT/UNDO/REDO/CHECKOUT/MERGE/COMMIT operations against
+a shared set of branches, then the history of every branch is checked:
+
+  * each branch's head is the top of its undo history,
+  * the undo depth of each branch equals the successful edits + merges +
+    commits + redos - successful undos recorded for that branch, and undoing
+    all of them brings the branch back to the revision it was created at,
+  * every object in the store rebuilds to content whose hash is its object ID,
+  * the official repository content is the content of some stored object.
+
+With a small branch cache, branches are spilled to disk and loaded back while
+other threads hold them, which exercises the retry in _locked_active_branch.
+"""
+import random
+import threading
+from collections import Counter
+
+import pytest
+
+THREADS = 8
+OPS = 400
+BRANCHES = 8
+
+
+def worker(vcs, index, branch_names, deltas, errors):
+    rng = random.Random(7 + index)
+    username = f"user{index}"
+    vcs.register_user(username, None)
+    local = Counter()
+    try:
+        for n in range(OPS):
+            branch_name = vcs.get_active_branch(username).name
+            roll = rng.random()
+            if roll < 0.45:
+                if vcs.edit(username, f"{username} edit {n}\n" * rng.randint(1, 20)).startswith("File "):
+                    local[branch_name] += 1
+            elif roll < 0.65:
+                if vcs.undo(username) == "Undo successful.":
+                    local[branch_name] -= 1
+            elif roll < 0.80:
+                if vcs.redo(username) == "Redo successful.":
+                    local[branch_name] += 1
+            elif roll < 0.90:
+                vcs.switch_branch(username, rng.choice(branch_names))
+            elif roll < 0.97:
+                if vcs.merge(username, rng.choice(branch_names)).startswith("Merge"): # Clean or with conflicts
+                    local[branch_name] += 1
+            else:
+                if vcs.commit(username).startswith("Commit"):
+                    local[branch_name] += 1
+    except Exception as e: # Any exception is an invariant violation
+        errors.append(f"{username}: {type(e).__name__}: {e}")
+    deltas.append(local)
+
+
+def check_invariants(vcs, branch_names, net_pushes, base_heads):
+    problems = []
+    checker = "invariant-checker"
+    vcs.register_user(checker, None)
+    for name in branch_names:
+        vcs.switch_branch(checker, name)
+        branch = vcs.get_active_branch(checker)
+        if branch.history_stack.peek() != branch.head_revision_id:
+            problems.append(f"{name}: head does not match the top of the history stack")
+        depth = 0
+        while vcs.undo(checker) == "Undo successful.":
+            depth += 1
+        if depth != net_pushes[name]:
+            problems.append(f"{name}: undo depth {depth}, expected {net_pushes[name]}")
+        if vcs.branch_head(name) != base_heads[name]:
+            problems.append(f"{name}: undoing everything does not return to the revision it was created at")
+
+    store = vcs.object_store
+    for object_id in list(store._objects) + list(store._deltas):
+        if store.hash_content(store.get(object_id)) != object_id:
+            problems.append(f"object {object_id} does not rebuild to its own content")
+
+    if not store.contains(store.hash_content(vcs.official_repository_content)):
+        problems.append("official repository content is not a stored version")
+    return problems
+
+
+@pytest.mark.parametrize("branch_cache_entries", [None, 3], ids=["in-memory", "spilling"])
+def test_concurrent_operations_keep_every_history_consistent(make_vcs, branch_cache_entries):
+    options = {"history_limit": None} # Undo depths are checked exactly
+    if branch_cache_entries is not None:
+        options["branch_cache_entries"] = branch_cache_entries
+    vcs = make_vcs(**options)
+    vcs.register_user("setup", None)
+    branch_names = ["master"] + [f"branch{i}" for i in range(BRANCHES - 1)]
+    for name in branch_names[1:]:
+        vcs.create_branch("setup", name)
+    base_heads = {name: vcs.branch_head(name) for name in branch_names}
+
+    deltas, errors = [], []
+    threads = [threading.Thread(target=worker, args=(vcs, i, branch_names, deltas, errors))
+               for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    net_pushes = Counter({name: 0 for name in branch_names})
+    for local in deltas:
+        net_pushes.update(local)
+    assert errors + check_invariants(vcs, branch_names, net_pushes, base_heads) == []
+    if branch_cache_entries is not None:
+        assert len(vcs.branch_store) > 0
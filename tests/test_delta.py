@@ -0,0 +1,66 @@
+import random
+
+import pytest
+
+from delta import compute_delta, apply_delta, encode_delta, decode_delta
+from object_store import ObjectStore
+
+
+def _versions(count, seed=3):
+    """A file edited `count` times: lines replaced, inserted and deleted at random."""
+    rng = random.Random(seed)
+    lines = [f"line {i}\n" for i in range(200)]
+    versions = ["".join(lines)]
+    for n in range(count):
+        position = rng.randrange(len(lines))
+        roll = rng.random()
+        if roll < 0.4:
+            lines[position] = f"changed {n}\n"
+        elif roll < 0.7:
+            lines[position:position] = [f"inserted {n}.{k}\n" for k in range(rng.randint(1, 5))]
+        else:
+            del lines[position:position + rng.randint(1, 5)]
+        versions.append("".join(lines))
+    return versions
+
+
+@pytest.mark.parametrize("base, target", [
+    ("", ""),
+    ("", "new file\n"),
+    ("old file\n", ""),
+    ("same\n", "same\n"),
+    ("a\nb\nc\n", "a\nB\nc\n"),
+    ("no newline at the end", "no newline at the end, longer"),
+    ("x\n" * 50, "y\n" + "x\n" * 50 + "z"),
+])
+def test_delta_rebuilds_the_target(base, target):
+    assert apply_delta(base, compute_delta(base, target)) == target
+
+
+def test_delta_round_trips_through_its_wire_encoding():
+    versions = _versions(50)
+    for base, target in zip(versions, versions[1:]):
+        encoded = "".join(encode_delta(compute_delta(base, target))) + "trailing text"
+        ops, end = decode_delta(encoded, 0, len(base))
+        assert apply_delta(base, ops) == target
+        assert encoded[end:] == "trailing text"
+
+
+def test_decode_delta_rejects_copies_outside_the_base():
+    with pytest.raises(ValueError):
+        decode_delta("1\nC 0 20\n", 0, base_length=10)
+    with pytest.raises(ValueError):
+        decode_delta("1\nI 50\nshort", 0)
+
+
+def test_object_store_rebuilds_every_version_of_a_delta_chain():
+    store = ObjectStore(keyframe_interval=8, cache_bytes=0) # No cache: every get() replays its chain
+    versions = _versions(40)
+    ids = []
+    for content in versions:
+        ids.append(store.put(content, ids[-1] if ids else None))
+    assert store._deltas, "consecutive versions should be stored as deltas"
+    assert all(depth < 8 for _, depth, _ in store._deltas.values())
+    for object_id, content in zip(ids, versions):
+        assert store.get(object_id) == content
+        assert ObjectStore.hash_content(content) == object_id
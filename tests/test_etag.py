@@ -0,0 +1,40 @@
+def _tag(reply):
+    first_line, _, rest = reply.partition("\n")
+    assert first_line.startswith("ETAG:")
+    return first_line[len("ETAG:"):], rest
+
+
+def test_peek_is_not_modified_while_the_draft_is_unchanged(serve):
+    serve.vcs.register_user("alice")
+    serve.vcs.edit("alice", "draft one\n")
+    etag, body = _tag(serve("alice", "PEEK:ETAG"))
+    assert body.endswith("draft one\n")
+    assert serve("alice", f"PEEK:ETAG:{etag}") == f"NOT_MODIFIED:{etag}\n"
+
+    serve.vcs.edit("alice", "draft two\n")
+    new_etag, body = _tag(serve("alice", f"PEEK:ETAG:{etag}"))
+    assert new_etag != etag and body.endswith("draft two\n")
+    serve.vcs.undo("alice") # Back to the same file version: the old token matches again
+    assert serve("alice", f"PEEK:ETAG:{etag}") == f"NOT_MODIFIED:{etag}\n"
+
+
+def test_show_is_not_modified_until_the_next_commit(serve):
+    serve.vcs.register_user("alice")
+    serve.vcs.edit("alice", "official one\n")
+    serve.vcs.commit("alice")
+    etag, body = _tag(serve("alice", "SHOW:ETAG"))
+    assert body == "SHOW_CONTENT:\nofficial one\n"
+    serve.vcs.edit("alice", "not committed yet\n")
+    assert serve("alice", f"SHOW:ETAG:{etag}") == f"NOT_MODIFIED:{etag}\n"
+
+    serve.vcs.commit("alice")
+    new_etag, body = _tag(serve("alice", f"SHOW:ETAG:{etag}"))
+    assert new_etag != etag and body == "SHOW_CONTENT:\nnot committed yet\n"
+
+
+def test_a_missing_file_has_its_own_token(serve):
+    serve.vcs.register_user("alice")
+    serve.vcs.open_path("alice", "docs/new.md")
+    assert serve("alice", "SHOW:ETAG") == "ETAG:none\nSHOW_CONTENT:\n"
+    assert serve("alice", "SHOW:ETAG:none") == "NOT_MODIFIED:none\n"
+    assert serve("alice", "PEEK:ETAG:none") == "NOT_MODIFIED:none\n"
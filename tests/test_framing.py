@@ -0,0 +1,137 @@
+import asyncio
+import socket
+
+import pytest
+
+from framing import (send_frame, recv_frame, encode_frame, read_frame_async, write_frame_async, compress_body,
+                     decompress_body, with_request_id, split_request_id, FrameError, HEADER, ENCODINGS,
+                     ENCODING_NONE, ENCODING_ZLIB, FLAG_REQUEST_ID, OP_COMMAND, OP_RESPONSE, OP_NOTIFY)
+from protocol import parse_hello, negotiate, parse_command, parse_batch
+from client import encode_batch
+
+
+@pytest.fixture
+def pair():
+    a, b = socket.socketpair()
+    yield a, b
+    a.close()
+    b.close()
+
+
+def test_frames_arrive_whole_and_in_order(pair):
+    a, b = pair
+    bodies = [b"", b"EDIT:x", "unicode é\n", [b"part one, ", memoryview(b"part two")], b"\x00\xff" * 100000]
+    for body in bodies:
+        send_frame(a, OP_COMMAND, body)
+    expected = [b"", b"EDIT:x", "unicode é\n".encode(), b"part one, part two", b"\x00\xff" * 100000]
+    for body in expected:
+        assert recv_frame(b) == (OP_COMMAND, 0, bytearray(body))
+    a.close()
+    assert recv_frame(b) is None # A clean disconnect between frames
+
+
+def test_encode_frame_matches_send_frame(pair):
+    a, b = pair
+    a.sendall(encode_frame(OP_NOTIFY, "notice", 2))
+    assert recv_frame(b) == (OP_NOTIFY, 2, bytearray(b"notice"))
+
+
+def test_truncated_and_oversized_frames_are_errors(pair):
+    a, b = pair
+    a.sendall(HEADER.pack(OP_COMMAND, 0, 10) + b"short")
+    a.close()
+    with pytest.raises(FrameError):
+        recv_frame(b)
+
+    c, d = socket.socketpair()
+    with c, d:
+        c.sendall(HEADER.pack(OP_COMMAND, 0, 2 ** 63))
+        with pytest.raises(FrameError):
+            recv_frame(d)
+
+
+def test_async_frames_match_the_blocking_ones():
+    async def round_trip():
+        received = []
+
+        async def handle(reader, writer):
+            received.append(await read_frame_async(reader))
+            await write_frame_async(writer, OP_RESPONSE, ["reply ", b"body"], ENCODING_NONE)
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        loop = asyncio.get_running_loop()
+        sock = await loop.run_in_executor(None, socket.create_connection, ("127.0.0.1", port))
+        with sock:
+            await loop.run_in_executor(None, send_frame, sock, OP_COMMAND, b"LOG")
+            reply = await loop.run_in_executor(None, recv_frame, sock)
+        server.close()
+        await server.wait_closed()
+        return received[0], reply
+
+    request, reply = asyncio.run(round_trip())
+    assert request == (OP_COMMAND, 0, b"LOG")
+    assert reply == (OP_RESPONSE, 0, bytearray(b"reply body"))
+
+
+@pytest.mark.parametrize("name", sorted(ENCODINGS))
+def test_compressed_bodies_round_trip(name):
+    body = ["line of a large draft\n" * 2000, b"and a bytes part"]
+    compressed, flags = compress_body(body, ENCODINGS[name])
+    assert flags == ENCODINGS[name]
+    assert decompress_body(compressed, flags | FLAG_REQUEST_ID) == b"".join(part.encode() if isinstance(part, str)
+                                                                             else part for part in body)
+
+
+def test_small_or_incompressible_bodies_are_sent_as_they_are():
+    assert compress_body(b"tiny", ENCODING_ZLIB)[1] == ENCODING_NONE
+    assert compress_body(b"x" * 100000, ENCODING_NONE) == (b"x" * 100000, ENCODING_NONE)
+
+
+def test_request_ids_round_trip():
+    parts = with_request_id(2 ** 32 - 1, "COMMIT:done")
+    request_id, rest = split_request_id(b"".join(part if isinstance(part, bytes) else bytes(part) for part in parts))
+    assert (request_id, bytes(rest)) == (2 ** 32 - 1, b"COMMIT:done")
+    with pytest.raises(FrameError):
+        split_request_id(b"ab")
+
+
+# --- Handshake ---
+
+def test_hello_without_capabilities_gets_the_plain_protocol():
+    assert parse_hello(b"alice") == ("alice", None)
+    assert parse_hello(b"  \n") == ("Guest", None)
+
+
+def test_negotiation_picks_the_first_supported_encoding_and_known_features():
+    username, offered = parse_hello(b"bob\nCAPS:brotli, ZLIB,etag,zstd,request-id,teleport")
+    assert username == "bob"
+    accepted, encoding = negotiate(offered)
+    assert encoding == ENCODING_ZLIB # The client preferred zlib over zstd
+    assert accepted == ["zlib", "etag", "request-id"]
+
+
+def test_negotiation_of_nothing_known():
+    assert negotiate(["brotli", "teleport"]) == ([], ENCODING_NONE)
+
+
+# --- Command parsing ---
+
+def test_parse_command_splits_keyword_and_argument_without_copying():
+    name, argument = parse_command(b"edit:hello\nworld")
+    assert (name, bytes(argument)) == ("EDIT", b"hello\nworld")
+    assert isinstance(argument, memoryview)
+    assert parse_command(b"EDIT")[0] is None # Needs ':<argument>'
+    assert parse_command(b"FROBNICATE:x")[0] is None
+
+
+def test_batch_bodies_round_trip():
+    commands = ["OPEN:docs/a.md", "EDIT:multi\nline\n", "COMMIT:done"]
+    name, argument = parse_command(encode_batch(commands).encode())
+    assert name == "BATCH"
+    parsed = parse_batch(argument)
+    assert [(name, bytes(argument).decode()) for name, argument in parsed] == \
+        [("OPEN", "docs/a.md"), ("EDIT", "multi\nline\n"), ("COMMIT", "done")]
+    with pytest.raises(ValueError):
+        parse_batch(b"99:EDIT:x")
@@ -0,0 +1,69 @@
+import pytest
+
+import mapped_file
+from mapped_file import MappedFile, MappedFileCache
+from object_store import ObjectStore
+
+TEXT = "".join(f"line {n}\n" for n in range(1, 2001)) + "no newline at the end"
+
+
+@pytest.fixture
+def mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapped_file, "LINE_INDEX_BLOCK", 64) # Many blocks for a small file
+    path = tmp_path / "file.txt"
+    path.write_bytes(TEXT.encode())
+    return MappedFile(str(path))
+
+
+def test_line_ranges_match_splitlines(mapped):
+    lines = TEXT.splitlines(keepends=True)
+    assert mapped.line_count() == len(lines)
+    for first in (0, 1, 7, 63, 64, 999, 2000, 2001, 5000):
+        for count in (0, 1, 3, 100):
+            start, end = mapped.line_range(first, count)
+            assert bytes(mapped.read(start, end - start)).decode() == "".join(lines[first:first + count])
+
+
+def test_reads_are_clipped_to_the_file(mapped):
+    assert bytes(mapped.read(len(TEXT) - 5, 100)) == TEXT[-5:].encode()
+    assert mapped.read(len(TEXT) + 10, 5).nbytes == 0
+
+
+def test_empty_files_can_be_mapped(tmp_path):
+    path = tmp_path / "empty.txt"
+    path.write_bytes(b"")
+    empty = MappedFile(str(path))
+    assert empty.size == 0 and empty.line_count() == 0 and empty.read().nbytes == 0
+
+
+def test_cache_keeps_the_most_recently_used_versions(tmp_path):
+    store = ObjectStore()
+    ids = [store.put(f"version {n}\n") for n in range(4)]
+    cache = MappedFileCache(str(tmp_path / "mapped"), store, limit=2)
+    for object_id in ids:
+        assert bytes(cache.open(object_id).read()) == store.get(object_id).encode()
+    assert list(cache._files) == ids[2:]
+    assert cache.open(ids[3]) is cache.open(ids[3])
+
+
+def _commit_lines(serve, count):
+    serve.vcs.register_user("alice")
+    serve.vcs.edit("alice", "".join(f"line {n}\n" for n in range(1, count + 1))) # EDIT would strip the last newline
+    assert serve("alice", "COMMIT:lines").startswith("Commit")
+
+
+def test_show_lines_past_the_end_of_the_file(serve):
+    _commit_lines(serve, 5)
+    assert serve("alice", "SHOW:LINES:4:10") == "SHOW_LINES:4:2:5\nline 4\nline 5\n"
+    assert serve("alice", "SHOW:LINES:6:3") == "SHOW_LINES:6:0:5\n"
+    assert serve("alice", "SHOW:LINES:50:3") == "SHOW_LINES:50:0:5\n"
+    assert serve("alice", "SHOW:LINES:0:3").startswith("Error: Use SHOW")
+
+
+def test_show_byte_ranges(serve):
+    _commit_lines(serve, 3)
+    assert serve("alice", "SHOW:7:6") == "SHOW_RANGE:7:6:21\nline 2"
+    assert serve("alice", "SHOW:18:100") == "SHOW_RANGE:18:3:21\n 3\n"
+    assert serve("alice", "SHOW:500:1") == "SHOW_RANGE:500:0:21\n"
+    assert serve("alice", "SHOW:-1:1").startswith("Error: Use SHOW")
+    assert serve("alice", "SHOW") == "SHOW_CONTENT:\nline 1\nline 2\nline 3\n"
@@ -0,0 +1,53 @@
+from merge import three_way_merge, diff_lines, unified_diff
+
+BASE = "one\ntwo\nthree\nfour\nfive\n"
+
+
+def test_changes_on_both_sides_are_combined():
+    ours = "ONE\ntwo\nthree\nfour\nfive\n"
+    theirs = "one\ntwo\nthree\nfour\nFIVE\n"
+    assert three_way_merge(BASE, ours, theirs) == ("ONE\ntwo\nthree\nfour\nFIVE\n", [])
+
+
+def test_one_sided_and_identical_changes_need_no_merge():
+    changed = "one\ntwo\n3\nfour\nfive\n"
+    assert three_way_merge(BASE, changed, BASE) == (changed, [])
+    assert three_way_merge(BASE, BASE, changed) == (changed, [])
+    assert three_way_merge(BASE, changed, changed) == (changed, [])
+
+
+def test_insertions_and_deletions_in_different_places_merge_cleanly():
+    ours = "zero\none\ntwo\nthree\nfour\nfive\n"
+    theirs = "one\ntwo\nfour\nfive\n"
+    assert three_way_merge(BASE, ours, theirs) == ("zero\none\ntwo\nfour\nfive\n", [])
+
+
+def test_overlapping_changes_conflict_with_markers():
+    ours = "one\nTWO (ours)\nthree\nfour\nfive\n"
+    theirs = "one\nTWO (theirs)\nthree\nfour\nfive\n"
+    merged, conflicts = three_way_merge(BASE, ours, theirs, "master", "feature")
+    assert merged == ("one\n<<<<<<< master\nTWO (ours)\n=======\nTWO (theirs)\n>>>>>>> feature\n"
+                      "three\nfour\nfive\n")
+    assert conflicts == [{"base": (2, 3), "ours": (2, 3), "theirs": (2, 3)}]
+
+
+def test_conflict_markers_start_on_their_own_line():
+    merged, conflicts = three_way_merge("a\nb", "a\nours", "a\ntheirs")
+    assert len(conflicts) == 1
+    assert "ours\n=======\ntheirs\n>>>>>>> theirs\n" in merged
+
+
+def test_diff_lines_hunks_rebuild_the_new_lines():
+    a = ["a\n", "b\n", "c\n", "d\n", "e\n"]
+    b = ["a\n", "x\n", "c\n", "e\n", "f\n"]
+    rebuilt, position = [], 0
+    for a_lo, a_hi, b_lo, b_hi in diff_lines(a, b):
+        rebuilt += a[position:a_lo] + b[b_lo:b_hi]
+        position = a_hi
+    assert rebuilt + a[position:] == b
+
+
+def test_unified_diff_format():
+    diff = unified_diff(["a\n", "b\n", "c\n"], ["a\n", "B\n", "c\n"], "old", "new")
+    assert diff == ["--- old\n", "+++ new\n", "@@ -1,3 +1,3 @@\n", " a\n", "-b\n", "+B\n", " c\n"]
+    assert unified_diff(["same\n"], ["same\n"]) == []
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+from metrics import ServerMetrics, LatencyHistogram, LATENCY_BUCKETS
+
+VCS = SimpleNamespace(broker=SimpleNamespace(evicted=0, notice_bytes=0), gauges=lambda: [])
+
+
+def test_stats_table_columns_line_up_with_long_command_names():
+    metrics = ServerMetrics()
+    for name in ("LOG", "DELETE_BRANCH", "EDIT"):
+        metrics.observe_command(name, 0.001, 10, 20)
+    lines = metrics.render_text(VCS).splitlines()
+    header = next(i for i, line in enumerate(lines) if line.startswith("Command"))
+    table = lines[header:header + 4]
+    assert [line.split()[0] for line in table] == ["Command", "DELETE_BRANCH", "EDIT", "LOG"]
+    assert len({len(line) for line in table}) == 1 # Every row as wide as the header
+    count_end = table[0].index("count") + len("count")
+    assert all(line[:count_end].endswith(" 1") for line in table[1:])
+
+
+def test_quantiles_are_bucket_upper_bounds():
+    histogram = LatencyHistogram()
+    for _ in range(99):
+        histogram.observe(0.00004)
+    histogram.observe(1.0)
+    counts, total = histogram.snapshot()
+    assert sum(counts) == 100 and abs(total - (1.0 + 99 * 0.00004)) < 1e-9
+    assert LatencyHistogram.quantile(counts, 0.5) == LATENCY_BUCKETS[0]
+    assert LatencyHistogram.quantile(counts, 0.999) >= 1.0
+    assert LatencyHistogram.quantile([0] * len(counts), 0.5) == 0.0
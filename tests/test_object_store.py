@@ -0,0 +1,10 @@
+from object_store import ObjectStore
+
+
+def test_object_store_keeps_identical_content_once():
+    store = ObjectStore()
+    first = store.put("same content\n")
+    assert store.put("same content\n", first) == first
+    assert len(store) == 1
+    assert store.get(first) == "same content\n"
+    assert ObjectStore.hash_content("same content\n") == first
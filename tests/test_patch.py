@@ -0,0 +1,50 @@
+from delta import compute_delta
+
+
+def _setup(make_vcs):
+    vcs = make_vcs()
+    vcs.register_user("alice")
+    vcs.edit("alice", "one\ntwo\nthree\nfour\nfive\n")
+    return vcs, vcs.branch_head("master")
+
+
+def test_patch_on_the_head_becomes_the_new_head(make_vcs):
+    vcs, base_id = _setup(make_vcs)
+    ops = compute_delta("one\ntwo\nthree\nfour\nfive\n", "one\ntwo\nTHREE\nfour\nfive\n")
+    status, applied_id = vcs.patch("alice", base_id, ops)
+    assert status.startswith("File ")
+    assert applied_id == vcs.branch_head("master")
+    assert vcs.get_active_branch("alice").read_file(vcs.get_user_path("alice")) == "one\ntwo\nTHREE\nfour\nfive\n"
+
+
+def test_patch_on_a_stale_base_is_merged_onto_the_head(make_vcs):
+    vcs, base_id = _setup(make_vcs)
+    vcs.edit("alice", "ONE\ntwo\nthree\nfour\nfive\n") # Lands after the client's base
+    ops = compute_delta("one\ntwo\nthree\nfour\nfive\n", "one\ntwo\nthree\nfour\nFIVE\n")
+    status, applied_id = vcs.patch("alice", base_id, ops)
+    assert status.startswith("File ")
+    assert applied_id is None # The client's copy is not the new head: it must SYNC
+    assert vcs.get_active_branch("alice").read_file(vcs.get_user_path("alice")) == "ONE\ntwo\nthree\nfour\nFIVE\n"
+
+
+def test_patch_on_a_stale_base_that_overlaps_is_rejected(make_vcs):
+    vcs, base_id = _setup(make_vcs)
+    vcs.edit("alice", "one\ntwo\nthree, theirs\nfour\nfive\n")
+    head_id = vcs.branch_head("master")
+    status, applied_id = vcs.patch("alice", base_id, compute_delta("one\ntwo\nthree\nfour\nfive\n",
+                                                                    "one\ntwo\nthree, mine\nfour\nfive\n"))
+    assert status.startswith("Error: Patch conflicts") and applied_id is None
+    assert vcs.branch_head("master") == head_id
+
+
+def test_patch_with_copies_outside_the_base_is_rejected(make_vcs):
+    vcs, base_id = _setup(make_vcs)
+    for ops in ([("copy", 0, 1000)], [("copy", 5, 2)], [("copy", -1, 3)]):
+        status, applied_id = vcs.patch("alice", base_id, ops)
+        assert status.startswith("Error: Patch does not match the base version") and applied_id is None
+    assert vcs.branch_head("master") == base_id
+
+
+def test_patch_on_an_unknown_base_asks_for_a_sync(make_vcs):
+    vcs, _ = _setup(make_vcs)
+    assert vcs.patch("alice", "0" * 64, [("insert", "x")])[0].startswith("Error: Unknown base version")
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from framing import encode_frame, HEADER, OP_NOTIFY, OP_RESPONSE
+from pubsub import ThreadSubscriber
+
+
+class _ShortWriteSocket:
+    """A socket whose first non-blocking send() takes only half of the frame."""
+    def __init__(self):
+        self.sent = bytearray()
+        self.busy = threading.Lock() # Held to keep sendall() (the writer thread) waiting
+        self._short = True
+
+    def send(self, data, flags=0):
+        count = len(data) // 2 if self._short else len(data)
+        self._short = False
+        self.sent += data[:count]
+        return count
+
+    def sendall(self, data):
+        with self.busy:
+            self.sent += data
+
+    def shutdown(self, how):
+        pass
+
+
+def _frames(data):
+    frames, position = [], 0
+    while position < len(data):
+        opcode, _, length = HEADER.unpack_from(data, position)
+        position += HEADER.size
+        frames.append((opcode, bytes(data[position:position + length])))
+        position += length
+    assert position == len(data)
+    return frames
+
+
+def test_a_half_sent_notice_is_finished_before_a_reply():
+    for _ in range(20): # The reply races the writer thread
+        sock = _ShortWriteSocket()
+        subscriber = ThreadSubscriber(sock, "alice").start()
+        with sock.busy:
+            assert subscriber.offer(encode_frame(OP_NOTIFY, b"N" * 100))
+            reply = threading.Thread(target=subscriber.send, args=(OP_RESPONSE, b"R" * 50))
+            reply.start()
+            time.sleep(0.001)
+        reply.join()
+        deadline = time.monotonic() + 5
+        while len(sock.sent) < 2 * HEADER.size + 150 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        subscriber.close()
+        assert _frames(sock.sent) == [(OP_NOTIFY, b"N" * 100), (OP_RESPONSE, b"R" * 50)]
+
+
+def test_notices_keep_their_order_behind_a_half_sent_one():
+    sock = _ShortWriteSocket()
+    subscriber = ThreadSubscriber(sock, "bob").start()
+    notices = [encode_frame(OP_NOTIFY, f"notice {n}".encode()) for n in range(50)]
+    for frame in notices:
+        assert subscriber.offer(frame)
+    deadline = time.monotonic() + 5
+    while len(sock.sent) < sum(map(len, notices)) and time.monotonic() < deadline:
+        time.sleep(0.001)
+    subscriber.close()
+    assert _frames(sock.sent) == [(OP_NOTIFY, f"notice {n}".encode()) for n in range(50)]
+
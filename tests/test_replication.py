@@ -0,0 +1,97 @@
+import os
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import pytest
+
+from replication import Follower, ReplicationSource
+
+
+def _start_primary(make_vcs, tmp_path, secret=None):
+    """A primary with a replication port on 127.0.0.1 (chosen by the OS). Returns (vcs, source, address)."""
+    vcs = make_vcs()
+    vcs.register_user("alice")
+    source = ReplicationSource(vcs, 0, secret=secret).start()
+    return vcs, source, source._listener.address
+
+
+def _wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_a_follower_catches_up_from_the_snapshot_and_the_log(make_vcs, tmp_path):
+    primary, source, address = _start_primary(make_vcs, tmp_path, secret=b"s3cret")
+    primary.edit("alice", "before the follower\n")
+    primary.commit("alice", "first")
+    follower = make_vcs(data_dir=str(tmp_path / "follower"), shared_file=str(tmp_path / "follower.txt"))
+    replication = Follower(address, follower, secret=b"s3cret").start()
+    try:
+        assert replication.snapshots == 1
+        assert follower.official_repository_content == "before the follower\n"
+        primary.edit("alice", "after the follower\n")
+        primary.commit("alice", "second")
+        _wait_for(lambda: follower.official_repository_content == "after the follower\n")
+        assert follower.official_revision_id == primary.official_revision_id
+        assert "in 1 file(s) in committed versions:" in follower.grep("after the follower", history=True)
+    finally:
+        replication.close()
+        source.close()
+
+
+def test_a_follower_without_the_secret_gets_nothing(make_vcs, tmp_path, monkeypatch):
+    monkeypatch.delenv("VCS_REPLICATION_SECRET", raising=False)
+    primary, source, address = _start_primary(make_vcs, tmp_path, secret=b"s3cret")
+    primary.edit("alice", "private\n")
+    primary.commit("alice")
+    follower = make_vcs(data_dir=str(tmp_path / "follower"), shared_file=str(tmp_path / "follower.txt"))
+    for secret in (b"wrong", None):
+        replication = Follower(address, follower, retry_interval=0.05, secret=secret)
+        threading.Thread(target=replication.start, daemon=True).start()
+        time.sleep(0.5)
+        replication.close()
+        assert replication.snapshots == 0
+    assert follower.official_repository_content != "private\n"
+    source.close()
+
+
+def test_a_follower_refuses_a_message_that_would_run_code(make_vcs, tmp_path):
+    marker = tmp_path / "ran"
+
+    class Payload:
+        def __reduce__(self):
+            return os.mkdir, (str(marker),)
+
+    rogue = Listener(("127.0.0.1", 0), authkey=b"s3cret")
+
+    def serve():
+        with rogue.accept() as connection:
+            connection.send(("snapshot", Payload()))
+            try:
+                connection.recv_bytes() # Until the follower hangs up
+            except EOFError:
+                pass
+
+    threading.Thread(target=serve, daemon=True).start()
+    follower = make_vcs(data_dir=str(tmp_path / "follower"), shared_file=str(tmp_path / "follower.txt"))
+    replication = Follower(rogue.address, follower, retry_interval=0.05, secret=b"s3cret")
+    threading.Thread(target=replication.start, daemon=True).start()
+    time.sleep(0.5)
+    replication.close()
+    rogue.close()
+    assert not marker.exists()
+    assert replication.snapshots == 0
+
+
+def test_replicating_across_the_network_needs_a_secret(make_vcs, monkeypatch):
+    monkeypatch.delenv("VCS_REPLICATION_SECRET", raising=False)
+    vcs = make_vcs()
+    with pytest.raises(ValueError):
+        ReplicationSource(vcs, 0, host="0.0.0.0").start()
+    with pytest.raises(ValueError):
+        Follower(("192.0.2.1", 5060), vcs).start()
+    monkeypatch.setenv("VCS_REPLICATION_SECRET", "s3cret")
+    assert Follower(("192.0.2.1", 5060), vcs).secret == b"s3cret"
@@ -0,0 +1,75 @@
+from search_index import trigrams
+
+
+def _vcs(make_vcs):
+    vcs = make_vcs()
+    vcs.register_user("alice")
+    return vcs
+
+
+def test_grep_finds_edits_at_branch_heads(make_vcs):
+    vcs = _vcs(make_vcs)
+    vcs.create_branch("alice", "feature")
+    vcs.switch_branch("alice", "feature")
+    vcs.edit_files("alice", {"src/a.py": "import os\nneedle = 1\n", "README": "no match\n"})
+    assert vcs.grep("needle") == "'needle' found in 1 file(s) at branch heads:\nsrc/a.py on feature\n  2: needle = 1"
+    vcs.edit("alice", "needle moved\n", path="src/a.py")
+    assert vcs.grep("needle").splitlines()[-1] == "  1: needle moved"
+    assert vcs.grep("needle = 1") == "'needle = 1' found in 0 file(s) at branch heads."
+
+
+def test_grep_all_finds_committed_versions_after_the_heads_moved_on(make_vcs):
+    vcs = _vcs(make_vcs)
+    vcs.edit("alice", "first needle\n")
+    vcs.commit("alice", "one")
+    commit_id = vcs.official_revision_id
+    vcs.edit("alice", "rewritten\n")
+    assert "found in 0 file(s) at branch heads." in vcs.grep("needle")
+    found = vcs.grep("needle", history=True).splitlines()
+    assert found[1] == "'needle' found in 1 file(s) in committed versions:"
+    assert found[2].startswith(f"server_repo.txt in {commit_id[:12]} (")
+    assert found[3] == "  1: first needle"
+
+
+def test_grep_forgets_a_deleted_branch(make_vcs):
+    vcs = _vcs(make_vcs)
+    vcs.create_branch("alice", "doomed")
+    vcs.switch_branch("alice", "doomed")
+    vcs.edit("alice", "only on doomed\n")
+    assert "on doomed" in vcs.grep("only on")
+    vcs.switch_branch("alice", "master")
+    assert vcs.delete_branch("alice", "doomed") == "Branch 'doomed' deleted."
+    assert vcs.grep("only on") == "'only on' found in 0 file(s) at branch heads."
+
+
+def test_many_branches_holding_one_version_are_grouped(make_vcs):
+    vcs = _vcs(make_vcs)
+    vcs.edit("alice", "shared needle\n")
+    for i in range(8):
+        vcs.create_branch("alice", f"b{i}")
+    found = vcs.grep("needle").splitlines()
+    assert found[0] == "'needle' found in 9 file(s) at branch heads:"
+    assert found[1] == "server_repo.txt on b0, b1, b2, b3, b4 and 4 more"
+
+
+def test_index_compaction_keeps_results(make_vcs):
+    vcs = _vcs(make_vcs)
+    index = vcs.search_index
+    index._compact_at = 8 # Compact often
+    for n in range(40):
+        vcs.edit("alice", f"version {n} with needle{n % 3}\n")
+    assert vcs.grep("needle2") == "'needle2' found in 0 file(s) at branch heads." # Only version 39 is at a head
+    assert vcs.grep("version 39").splitlines()[-1] == "  1: version 39 with needle0"
+    assert len(index) < 40
+
+
+def test_grep_commands_reject_bad_patterns(serve):
+    serve.vcs.register_user("alice")
+    assert serve("alice", "GREP:").startswith("Error: Use GREP:<text>")
+    assert serve("alice", "GREP:ALL:").startswith("Error: Use GREP:<text>")
+    assert serve("alice", "GREP:two\nlines").startswith("Error: GREP matches within one line")
+
+
+def test_trigrams_and_short_patterns():
+    assert trigrams("abcd") == {"abc", "bcd"}
+    assert trigrams("ab") == set()
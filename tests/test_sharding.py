@@ -0,0 +1,94 @@
+import time
+
+import pytest
+
+from protocol import parse_command
+from sharding import ShardRouter, start_shards, shard_of
+
+
+def _other_shards_commit(vcs, content, **options):
+    """A commit as if read from another shard's pack: in the graph, but not made by this VCS."""
+    tree_id = vcs.trees.write_file(vcs.commit_graph.object_id(vcs.official_revision_id), "server_repo.txt", content)
+    return vcs.commit_graph.add(tree_id, (vcs.official_revision_id,), author="bob", kind="commit", **options)
+
+
+def test_an_adopted_official_version_survives_a_restart_and_is_searchable(make_vcs):
+    vcs = make_vcs()
+    vcs.register_user("alice")
+    adopted = _other_shards_commit(vcs, "committed on another shard\n")
+    assert vcs.adopt_official(adopted, 7)
+    assert not vcs.adopt_official(vcs.branch_head("master"), 7) # Not a later commit
+    assert "in 1 file(s) in committed versions:" in vcs.grep("another shard", history=True)
+    vcs.wal.close() # A crash: the official version is only in the log
+
+    recovered = make_vcs()
+    assert (recovered.official_revision_id, recovered.official_sequence) == (adopted, 7)
+    assert recovered.official_repository_content == "committed on another shard\n"
+    assert "in 1 file(s) in committed versions:" in recovered.grep("another shard", history=True)
+    recovered.edit("alice", "a later commit\n")
+    recovered.commit("alice")
+    assert recovered.official_sequence == 8
+
+
+def test_commits_are_ordered_by_sequence_not_by_clock(make_vcs):
+    vcs = make_vcs()
+    vcs.register_user("alice")
+    vcs.edit("alice", "ours\n")
+    vcs.commit("alice")
+    ours = vcs.official_revision_id
+    ahead = _other_shards_commit(vcs, "clock an hour ahead\n", timestamp=time.time() + 3600)
+    assert not vcs.adopt_official(ahead, vcs.official_sequence) # Same number: not later, whatever its clock says
+    behind = _other_shards_commit(vcs, "clock an hour behind\n", timestamp=time.time() - 3600)
+    assert vcs.adopt_official(behind, vcs.official_sequence + 1)
+    assert vcs.official_revision_id == behind and ours != behind
+
+
+@pytest.fixture
+def router(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path) # The shard owning 'master' mirrors the shared file into the working directory
+    data_dir = str(tmp_path / "vcs_data")
+    started = []
+
+    def start():
+        router = ShardRouter(start_shards(2, "WARNING", data_dir))
+        started.append(router)
+        return router
+
+    yield start
+    for router in started:
+        for shard in router.shards:
+            shard.close()
+
+
+def _run(router, username, command):
+    reply = router.execute(username, *parse_command(command))
+    return reply if isinstance(reply, str) else "".join(part if isinstance(part, str) else bytes(part).decode()
+                                                         for part in reply)
+
+
+def test_two_shards_agree_on_the_official_version(router):
+    front = router()
+    names = {shard_of(f"b{i}", 2): f"b{i}" for i in range(20)}
+    users = {"alice": names[0], "bob": names[1]}
+    for username, branch_name in users.items():
+        assert _run(front, username, f"BRANCH:{branch_name}").endswith("created successfully.")
+        _run(front, username, f"CHECKOUT:{branch_name}")
+
+    for n in range(6): # Commits alternate between the shards, often within one clock tick
+        username = ("alice", "bob")[n % 2]
+        _run(front, username, f"EDIT:{username} version {n}")
+        commit_id = _run(front, username, "COMMIT").split()[1]
+        for other in users:
+            assert _run(front, other, "LOG:official").startswith(commit_id)
+        assert front.official[0].startswith(commit_id)
+
+    time.sleep(0.1) # Let the background log flush write the last adopted official version
+    for shard in front.shards: # A crash: no final checkpoint, so the adoptions are replayed from the logs
+        shard.process.kill()
+        shard.process.join()
+    restarted = router()
+    assert restarted.official == front.official
+    assert [shard.call("official_state") for shard in restarted.shards] == [front.official] * 2
+    # The shard that adopted bob's last commit indexed it again once it could read it
+    _, commits = restarted.shards[0].call("grep", "bob version 5", True)
+    assert commits[1] == 1
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from vcs_core import LazyVersionControlSystem
+
+
+@pytest.mark.parametrize("module", ["client", "vcs_core", "protocol", "server"])
+def test_importing_a_module_touches_no_files(tmp_path, module):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    subprocess.run([sys.executable, "-c", f"import {module}"], cwd=tmp_path, env=env, check=True)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_the_store_opens_on_first_use_with_the_configured_options(tmp_path):
+    lazy = LazyVersionControlSystem()
+    lazy.configure(data_dir=str(tmp_path / "vcs_data"), shared_file=str(tmp_path / "server_repo.txt"))
+    assert not lazy.is_open and not (tmp_path / "vcs_data").exists()
+    try:
+        assert lazy.register_user("alice") # Forwarded to the store, which opens first
+        assert lazy.is_open and lazy.get().data_dir == str(tmp_path / "vcs_data")
+    finally:
+        lazy.close()
+
+
+def test_open_in_background_returns_before_the_store_is_open():
+    release = threading.Event()
+    opened = object()
+
+    def slow_factory():
+        release.wait(5)
+        return opened
+
+    lazy = LazyVersionControlSystem(slow_factory)
+    lazy.open_in_background()
+    assert not lazy.is_open # Still recovering; the server accepts connections meanwhile
+    release.set()
+    assert lazy.get() is opened
+
+
+def test_a_failed_open_is_reported_to_every_caller():
+    def broken_factory():
+        raise OSError("disk on fire")
+
+    lazy = LazyVersionControlSystem(broken_factory)
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="disk on fire"):
+            lazy.get()
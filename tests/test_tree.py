@@ -0,0 +1,65 @@
+import pytest
+
+from object_store import ObjectStore
+from tree import TreeStore, normalize_path
+
+
+@pytest.fixture
+def trees():
+    return TreeStore(ObjectStore())
+
+
+def test_writing_one_file_shares_every_other_subtree(trees):
+    root = trees.write_files(None, {"src/a.py": "a\n", "src/b.py": "b\n", "docs/readme.md": "docs\n"})
+    changed = trees.write_file(root, "src/a.py", "a, changed\n")
+    assert trees.lookup(changed, "docs") == trees.lookup(root, "docs")
+    assert trees.lookup(changed, "src") != trees.lookup(root, "src")
+    assert trees.read_file(changed, "src/a.py") == "a, changed\n"
+    assert trees.read_file(root, "src/a.py") == "a\n"
+    assert list(trees.iter_files(changed)) == [(path, trees.lookup(changed, path)[1])
+                                               for path in ("docs/readme.md", "src/a.py", "src/b.py")]
+    assert trees.diff(root, changed) == [("src/a.py", trees.lookup(root, "src/a.py")[1],
+                                          trees.lookup(changed, "src/a.py")[1])]
+
+
+def test_paths_through_files_and_over_directories_are_rejected(trees):
+    root = trees.write_files(None, {"src/a.py": "a\n"})
+    with pytest.raises(ValueError):
+        trees.write_file(root, "src/a.py/inner", "x\n")
+    with pytest.raises(ValueError):
+        trees.write_file(root, "src", "x\n")
+    with pytest.raises(ValueError):
+        normalize_path("../etc/passwd")
+    assert normalize_path("./src//a.py") == "src/a.py"
+
+
+def test_removing_the_last_file_removes_its_directories(trees):
+    root = trees.write_files(None, {"src/deep/a.py": "a\n", "b.txt": "b\n"})
+    removed = trees.remove(root, "src/deep/a.py")
+    assert trees.lookup(removed, "src") is None
+    assert trees.remove(root, "missing.txt") is None
+
+
+def test_tree_merge_combines_files_and_reports_conflicts(trees):
+    base = trees.write_files(None, {"a.txt": "one\ntwo\nthree\n", "b.txt": "b\n"})
+    ours = trees.write_files(base, {"a.txt": "ONE\ntwo\nthree\n", "ours.txt": "new\n"})
+    theirs = trees.write_files(base, {"a.txt": "one\ntwo\nTHREE\n", "b.txt": "b, theirs\n"})
+    merged, conflicts = trees.merge(base, ours, theirs)
+    assert conflicts == []
+    assert {path: trees.read_file(merged, path) for path, _ in trees.iter_files(merged)} == \
+        {"a.txt": "ONE\ntwo\nTHREE\n", "b.txt": "b, theirs\n", "ours.txt": "new\n"}
+
+    clash = trees.write_files(base, {"b.txt": "b, clashing\n"})
+    _, conflicts = trees.merge(base, theirs, clash)
+    assert [path for path, _ in conflicts] == ["b.txt"]
+
+
+def test_branches_hold_several_files(make_vcs):
+    vcs = make_vcs()
+    vcs.register_user("alice")
+    assert vcs.edit_files("alice", {"src/main.py": "print()\n", "README": "hi\n"}) == \
+        "2 files updated on branch 'master'."
+    assert vcs.list_path("alice").splitlines() == ["README", "server_repo.txt", "src/"]
+    assert vcs.list_path("alice", "src") == "main.py"
+    assert vcs.remove_path("alice", "src") == "Removed 'src' from branch 'master'."
+    assert vcs.list_path("alice", "src").startswith("Error:")
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+import wal
+from wal import WriteAheadLog, read_records, segment_path, encode_record
+
+
+def _state(vcs, username):
+    """What a restart must preserve: the user's branch, draft, history and the log of every branch."""
+    branch = vcs.get_active_branch(username)
+    return {
+        "branch": branch.name,
+        "path": vcs.get_user_path(username),
+        "draft": branch.read_file(vcs.get_user_path(username)),
+        "official": vcs.official_revision_id,
+        "logs": {name: vcs.log(username, name) for name in ("master", "feature")},
+        "ls": vcs.list_path(username),
+    }
+
+
+def _make_history(vcs):
+    vcs.register_user("alice")
+    vcs.edit("alice", "one\ntwo\nthree\n")
+    vcs.commit("alice", "base")
+    vcs.create_branch("alice", "feature")
+    vcs.switch_branch("alice", "feature")
+    vcs.edit("alice", "ONE\ntwo\nthree\n")
+    vcs.open_path("alice", "docs/readme.md")
+    vcs.edit("alice", "docs\n")
+    vcs.edit("alice", "docs, second draft\n")
+    vcs.undo("alice")
+
+
+def test_state_survives_a_restart_from_the_log_alone(make_vcs):
+    vcs = make_vcs()
+    _make_history(vcs)
+    before = _state(vcs, "alice")
+    vcs.wal.close() # A crash after the last flush: no final checkpoint
+
+    recovered = make_vcs()
+    assert _state(recovered, "alice") == before
+    assert recovered.redo("alice") == "Redo successful." # The undone edit is still on the redo stack
+    assert recovered.get_active_branch("alice").read_file("docs/readme.md") == "docs, second draft\n"
+
+
+def test_state_survives_a_checkpoint_and_later_log_records(make_vcs):
+    vcs = make_vcs()
+    _make_history(vcs)
+    assert vcs.checkpoint()
+    vcs.edit("alice", "after the checkpoint\n")
+    before = _state(vcs, "alice")
+    vcs.wal.close()
+
+    assert _state(make_vcs(), "alice") == before
+
+
+def test_a_torn_record_at_the_end_of_the_log_is_dropped(make_vcs):
+    vcs = make_vcs()
+    _make_history(vcs)
+    before = _state(vcs, "alice")
+    path = segment_path(vcs.data_dir, "wal", vcs.wal.seq)
+    vcs.wal.close()
+    with open(path, "ab") as f:
+        f.write(encode_record(("edit", "feature", "not-a-revision"))[:-3]) # Cut off mid-record
+
+    recovered = make_vcs()
+    assert _state(recovered, "alice") == before
+    assert read_records(path)[1] == os.path.getsize(path) # The tail was truncated away
+
+
+# --- WriteAheadLog on its own ---
+
+@pytest.fixture
+def log(tmp_path):
+    log = WriteAheadLog(str(tmp_path), 1, flush_interval=0.005)
+    yield log
+    if not log._closed:
+        log.close()
+
+
+def _logged(log, seq=1):
+    return [record[1] for record in read_records(segment_path(log.directory, "wal", seq))[0]]
+
+
+def test_records_are_durable_in_order(log):
+    lsns = [log.append(("r", i)) for i in range(100)]
+    log.wait_durable(lsns[-1])
+    assert _logged(log) == list(range(100))
+
+
+def test_a_failed_flush_is_reported_and_retried_without_losing_records(log, monkeypatch):
+    log.wait_durable(log.append(("r", 0)))
+    fsync = os.fsync
+    failing = [True]
+
+    def flaky_fsync(fd):
+        if failing[0]:
+            raise OSError(28, "No space left on device")
+        return fsync(fd)
+
+    monkeypatch.setattr(wal.os, "fsync", flaky_fsync)
+    lsn = log.append(("r", 1))
+    with pytest.raises(OSError):
+        log.wait_durable(lsn) # Reported, not a hang
+    assert log._durable_lsn < lsn
+    assert _logged(log) == [0] # The failed write was cut off the segment
+
+    failing[0] = False
+    log.wait_durable(log.append(("r", 2)))
+    assert _logged(log) == [0, 1, 2] # Retried in order, exactly once
+
+
+def test_rotate_moves_appends_to_a_new_segment(log):
+    log.append(("r", 0))
+    log.rotate(2)
+    log.wait_durable(log.append(("r", 1)))
+    assert _logged(log, 1) == [0]
+    assert _logged(log, 2) == [1]
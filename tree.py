@@ -0,0 +1,242 @@
+from collections import OrderedDict
+from threading import Lock
+from config import TREE_CACHE_ENTRIES
+from merge import three_way_merge
+
+# A tree object is stored in the ObjectStore as text, one line per entry,
+# sorted by name:
+#     "blob <object_id> <name>\n"   -> a file
+#     "tree <object_id> <name>\n"   -> a subdirectory (another tree object)
+# Changing one file rewrites only the trees on its path; every other subtree
+# keeps its object ID and is shared between versions.
+
+
+def normalize_path(path):
+    """Turns a user-supplied path into 'dir/sub/file' form. Raises ValueError if invalid."""
+    parts = [part for part in path.strip().replace("\\", "/").split("/") if part not in ("", ".")]
+    if not parts:
+        raise ValueError("Path is empty.")
+    if ".." in parts or any("\n" in part for part in parts):
+        raise ValueError(f"Invalid path '{path.strip()}'.")
+    return "/".join(parts)
+
+
+class TreeStore:
+    """
+    Reads and writes directory trees on top of an ObjectStore.
+    Parsed trees are immutable and kept in a small LRU, so walking a path does
+    not re-parse the directories above it on every access.
+    """
+    def __init__(self, object_store, cache_entries=TREE_CACHE_ENTRIES):
+        self.object_store = object_store
+        self._cache = OrderedDict()
+        self._cache_limit = cache_entries
+        self._lock = Lock()
+
+    @property
+    def empty_tree_id(self):
+        return self.write_tree({})
+
+    # --- Tree objects ---
+    def read_tree(self, tree_id):
+        """Returns { name: (kind, object_id) } for a tree. The dict must not be modified."""
+        with self._lock:
+            entries = self._cache.get(tree_id)
+            if entries is not None:
+                self._cache.move_to_end(tree_id)
+                return entries
+
+        entries = {}
+        for line in self.object_store.get(tree_id).splitlines():
+            kind, object_id, name = line.split(" ", 2)
+            entries[name] = (kind, object_id)
+        self._remember(tree_id, entries)
+        return entries
+
+    def write_tree(self, entries, base_id=None):
+        """Stores a tree (delta-compressed against `base_id` if given) and returns its ID."""
+        text = "".join(f"{kind} {object_id} {name}\n" for name, (kind, object_id) in sorted(entries.items()))
+        tree_id = self.object_store.put(text, base_id=base_id)
+        self._remember(tree_id, dict(entries))
+        return tree_id
+
+    # --- Paths ---
+    def lookup(self, root_id, path):
+        """Returns the (kind, object_id) entry at a path, or None if it does not exist."""
+        entry = ("tree", root_id)
+        for part in path.split("/"):
+            if entry[0] != "tree":
+                return None
+            entry = self.read_tree(entry[1]).get(part)
+            if entry is None:
+                return None
+        return entry
+
+    def read_file(self, root_id, path):
+        """Content of the file at a path, or None if there is no such file."""
+        entry = self.lookup(root_id, path)
+        if entry is None or entry[0] != "blob":
+            return None
+        return self.object_store.get(entry[1])
+
+    def write_file(self, root_id, path, content):
+        """Returns the ID of a new root tree with the file at `path` set to `content`."""
+        return self.write_files(root_id, {path: content})
+
+    def write_files(self, root_id, files):
+        """
+        Returns the ID of a new root tree with every { path: content } of `files`
+        written (missing directories are created; root_id None starts from an
+        empty tree). Each directory on the way is rewritten once, however many
+        of its files change; every other subtree is shared with the old root.
+        Raises ValueError if a path runs through a file or replaces a directory.
+        """
+        nested = {}
+        for path, content in files.items():
+            parts = path.split("/")
+            node = nested
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+                if not isinstance(node, dict):
+                    raise ValueError(f"'{part}' is a file, not a directory.")
+            node[parts[-1]] = content
+        return self._write_nested(root_id, nested)
+
+    def _write_nested(self, tree_id, nested):
+        entries = dict(self.read_tree(tree_id)) if tree_id else {}
+        for name, value in nested.items():
+            current = entries.get(name)
+            if isinstance(value, dict):
+                if current is not None and current[0] == "blob":
+                    raise ValueError(f"'{name}' is a file, not a directory.")
+                entries[name] = ("tree", self._write_nested(current[1] if current else None, value))
+            else:
+                if current is not None and current[0] == "tree":
+                    raise ValueError(f"'{name}' is a directory.")
+                entries[name] = ("blob", self.object_store.put(value, base_id=current[1] if current else None))
+        return self.write_tree(entries, base_id=tree_id)
+
+    def remove(self, root_id, path):
+        """
+        Returns the ID of a new root tree without the file or directory at `path`
+        (directories left empty are removed too), or None if the path does not exist.
+        """
+        new_root = self._remove(root_id, path.split("/"))
+        if new_root is False:
+            return None
+        return new_root or self.empty_tree_id
+
+    def _remove(self, tree_id, parts):
+        """New tree ID, None if the tree became empty, or False if the path was not found."""
+        entries = dict(self.read_tree(tree_id))
+        current = entries.get(parts[0])
+        if current is None:
+            return False
+        if len(parts) == 1:
+            del entries[parts[0]]
+        else:
+            if current[0] != "tree":
+                return False
+            subtree = self._remove(current[1], parts[1:])
+            if subtree is False:
+                return False
+            if subtree is None:
+                del entries[parts[0]]
+            else:
+                entries[parts[0]] = ("tree", subtree)
+        return self.write_tree(entries, base_id=tree_id) if entries else None
+
+    def iter_files(self, tree_id, prefix=""):
+        """Yields (path, blob_id) for every file under a tree, in path order."""
+        for name, (kind, object_id) in sorted(self.read_tree(tree_id).items()):
+            if kind == "tree":
+                yield from self.iter_files(object_id, f"{prefix}{name}/")
+            else:
+                yield f"{prefix}{name}", object_id
+
+    # --- Comparing and merging trees ---
+    def diff(self, old_id, new_id, prefix=""):
+        """
+        Lists the files that differ between two trees as (path, old_blob_id, new_blob_id)
+        tuples (None for an added/removed side). Subtrees with the same ID are skipped
+        without being read, so the cost follows the size of the change.
+        """
+        if old_id == new_id:
+            return []
+        old = self.read_tree(old_id) if old_id else {}
+        new = self.read_tree(new_id) if new_id else {}
+        changes = []
+        for name in sorted(set(old) | set(new)):
+            a, b = old.get(name), new.get(name)
+            if a == b:
+                continue
+            path = prefix + name
+            a_tree = a[1] if a and a[0] == "tree" else None
+            b_tree = b[1] if b and b[0] == "tree" else None
+            a_blob = a[1] if a and a[0] == "blob" else None
+            b_blob = b[1] if b and b[0] == "blob" else None
+            if a_tree or b_tree:
+                changes.extend(self.diff(a_tree, b_tree, path + "/"))
+            if a_blob != b_blob:
+                changes.append((path, a_blob, b_blob))
+        return changes
+
+    def merge(self, base_id, ours_id, theirs_id, ours_label="ours", theirs_label="theirs"):
+        """
+        Three-way merge of two trees against their common base tree.
+        Returns (root_tree_id, conflicts) where conflicts is a list of
+        (path, text_conflicts) tuples; text_conflicts is the list returned by
+        merge.three_way_merge, or a string describing a structural conflict.
+        """
+        conflicts = []
+        root = self._merge(base_id, ours_id, theirs_id, ours_label, theirs_label, "", conflicts)
+        return root or self.empty_tree_id, conflicts
+
+    def _merge(self, base_id, ours_id, theirs_id, ours_label, theirs_label, prefix, conflicts):
+        # Whole subtrees changed on one side only are taken as they are
+        if ours_id == theirs_id or theirs_id == base_id:
+            return ours_id
+        if ours_id == base_id:
+            return theirs_id
+
+        base = self.read_tree(base_id) if base_id else {}
+        ours = self.read_tree(ours_id) if ours_id else {}
+        theirs = self.read_tree(theirs_id) if theirs_id else {}
+        merged = {}
+        for name in sorted(set(base) | set(ours) | set(theirs)):
+            b, o, t = base.get(name), ours.get(name), theirs.get(name)
+            path = prefix + name
+            if o == t or t == b:
+                entry = o
+            elif o == b:
+                entry = t
+            elif o and t and o[0] == t[0] == "tree":
+                subtree = self._merge(b[1] if b and b[0] == "tree" else None, o[1], t[1],
+                                      ours_label, theirs_label, path + "/", conflicts)
+                entry = ("tree", subtree) if subtree else None
+            elif o and t and o[0] == t[0] == "blob":
+                base_text = self.object_store.get(b[1]) if b and b[0] == "blob" else ""
+                text, text_conflicts = three_way_merge(
+                    base_text, self.object_store.get(o[1]), self.object_store.get(t[1]),
+                    ours_label=ours_label, theirs_label=theirs_label)
+                entry = ("blob", self.object_store.put(text, base_id=o[1]))
+                if text_conflicts:
+                    conflicts.append((path, text_conflicts))
+            elif o and t:
+                entry = o
+                conflicts.append((path, f"a file on one side and a directory on the other (kept '{ours_label}')"))
+            else:
+                # Changed on one side, deleted on the other: keep the changed version
+                entry = o or t
+                conflicts.append((path, "changed on one side and deleted on the other (kept the changed version)"))
+            if entry is not None:
+                merged[name] = entry
+        return self.write_tree(merged, base_id=ours_id) if merged else None
+
+    # --- Internal helpers ---
+    def _remember(self, tree_id, entries):
+        with self._lock:
+            self._cache[tree_id] = entries
+            self._cache.move_to_end(tree_id)
+            while len(self._cache) > self._cache_limit:
+                self._cache.popitem(last=False)
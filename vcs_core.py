@@ -1,207 +1,1268 @@
+import functools
+import logging
 import os
-from config import SHARED_FILE
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from threading import Event, Lock, Thread
+import time
+from config import (SHARED_FILE, DATA_DIR, WAL_FLUSH_INTERVAL, WAL_CHECKPOINT_BYTES, LOG_LIMIT, DEFAULT_PATH,
+                    HISTORY_DEPTH_LIMIT, BRANCH_CACHE_ENTRIES, MAPPED_FILE_ENTRIES)
+from framing import NOTIFY_COMMIT, NOTIFY_MERGE
 from data_structure import Stack
 from exception import StackUnderFlowError
+from object_store import ObjectStore
+from branch_store import BranchStore
+from mapped_file import MappedFileCache
+from commit_graph import CommitGraph
+from tree import TreeStore, normalize_path
+from pubsub import Broker
+from search_index import SearchIndex, format_matches
+from replication import Follower
+from merge import three_way_merge, unified_diff
+from delta import apply_delta, check_delta
+from wal import (WriteAheadLog, list_segments, segment_path, read_records,
+                 write_checkpoint, load_latest_checkpoint, remove_segments_before)
+
+logger = logging.getLogger(__name__)
 
 class BranchWorkspace: # Renamed to be more descriptive
     """
     Represents a single workspace and its independent file history.
     Each workspace has its own independent undo/redo history.
+    History entries are revision IDs in the shared CommitGraph; each revision
+    points at a root tree in the shared TreeStore, so a branch never holds its
+    own copy of any file.
+
+    At most `history_limit` undo states are kept: once a quarter more have
+    piled up, the oldest are dropped in one pass (their revisions stay in the
+    commit graph, reachable through LOG and CHECKOUT).
+
+    Every move of the head is reported to `on_head_moved(name, revision_id)`
+    if given (the VCS keeps its search index up to date with it).
     """
-    def __init__(self, name, initial_content=""): # Improved name
+    def __init__(self, name, trees, commit_graph, initial_revision_id, history_limit=HISTORY_DEPTH_LIMIT,
+                 on_head_moved=None): # Improved name
         self.name = name
-        self.current_content = initial_content
-        
-        # LIFO Stack: Stores the history of edits for Undo
-        self.history_stack = Stack() 
-        self.history_stack.push(initial_content) # Base state is the first entry
-        
-        # LIFO Stack: Stores undone edits for Redo
-        self.future_stack = Stack() 
+        self.trees = trees
+        self.commit_graph = commit_graph
+        self.on_head_moved = on_head_moved
+        self.head_revision_id = initial_revision_id
+        self.history_limit = history_limit
+
+        # LIFO Stack: Stores the revision IDs of past edits for Undo
+        self.history_stack = Stack()
+        self.history_stack.push(initial_revision_id) # Base state is the first entry
+
+        # LIFO Stack: Stores revision IDs of undone edits for Redo
+        self.future_stack = Stack()
+        self.history_depth = 1
+        self.future_depth = 0
+
+        # Guards head_revision_id and both stacks; each branch has its own lock,
+        # so operations on different branches never wait for each other.
+        self.lock = Lock()
+        # Set (under the lock) once this object no longer represents the branch:
+        # it was spilled to disk or deleted. Writers then look the branch up again.
+        self.retired = False
+
+    @property
+    def head_revision_id(self):
+        return self._head_revision_id
+
+    @head_revision_id.setter
+    def head_revision_id(self, revision_id):
+        self._head_revision_id = revision_id
+        if self.on_head_moved is not None:
+            self.on_head_moved(self.name, revision_id)
+
+    @property
+    def head_tree_id(self):
+        """ID of the root tree at the head of this branch."""
+        return self.commit_graph.object_id(self.head_revision_id)
+
+    def read_file(self, path):
+        """Content of a file at the head of this branch ("" if it does not exist yet)."""
+        content = self.trees.read_file(self.head_tree_id, path)
+        return "" if content is None else content
+
+    # --- History transitions (caller holds self.lock) ---
+    # These are shared by the live operations and by write-ahead log replay,
+    # so a replayed log always produces exactly the same history.
+    def apply_new_state(self, revision_id):
+        """Moves the head to a new state (edit or merge)."""
+        # 1. Update the head
+        self.head_revision_id = revision_id
+        # 2. Save new state to history stack
+        self.history_stack.push(revision_id)
+        self.history_depth += 1
+        # 3. Clear future stack (a new edit kills the ability to Redo prior undos)
+        self.future_stack.clear()
+        self.future_depth = 0
+        # 4. Drop the oldest states once the history is well past its limit
+        if self.history_limit is not None and self.history_depth > self.history_limit + self.history_limit // 4:
+            self.restore_history(_stack_items(self.history_stack)[-self.history_limit:], [])
+
+    def step_back(self):
+        """Undoes one state. Returns False when already at the base state."""
+        try:
+            # The current state is popped off the history stack...
+            current_state = self.history_stack.pop()
+
+            # ...if the stack is now empty, we stop
+            if self.history_stack.is_empty():
+                # Re-add the state we popped to prevent underflow
+                self.history_stack.push(current_state)
+                return False
+
+            # ...and the popped state is saved to the future stack for Redo
+            self.future_stack.push(current_state)
+            self.history_depth -= 1
+            self.future_depth += 1
+
+            # The new 'current' content is the state now on top of the history stack
+            self.head_revision_id = self.history_stack.peek()
+            return True
+        except StackUnderFlowError:
+            return False
+
+    def step_forward(self):
+        """Redoes one state. Returns False when there is nothing to redo."""
+        if self.future_stack.is_empty():
+            return False
+
+        # 1. Take the state from the future stack...
+        restored_state = self.future_stack.pop()
+        # 2. ...and put it back into the history stack
+        self.history_stack.push(restored_state)
+        self.head_revision_id = restored_state
+        self.history_depth += 1
+        self.future_depth -= 1
+        return True
+
+    def restore_history(self, history, future):
+        """Replaces both stacks with lists of revision IDs (bottom to top), as from _stack_items()."""
+        self.history_stack.clear()
+        for revision_id in history:
+            self.history_stack.push(revision_id)
+        self.future_stack.clear()
+        for revision_id in future:
+            self.future_stack.push(revision_id)
+        self.history_depth = len(history)
+        self.future_depth = len(future)
+
+# Log records that change an existing branch (a follower applies them under its lock)
+_BRANCH_RECORDS = ("edit", "merge", "undo", "redo", "commit", "batch")
+
+def _stack_items(stack):
+    """Lists a Stack's items from bottom to top without changing it (only uses push/pop)."""
+    items = []
+    while not stack.is_empty():
+        items.append(stack.pop())
+    items.reverse()
+    for item in items:
+        stack.push(item)
+    return items
 
 class VersionControlSystem:
     """
     The central Manager for the entire VCS. It coordinates user sessions,
     branch workspaces, file I/O operations, and peer-to-peer announcements.
+
+    Every state change is appended to a write-ahead log (see wal.py) and the
+    full state is periodically compacted into a checkpoint, so branches,
+    undo/redo history and user sessions all survive a restart.
+
+    Only the `branch_cache_entries` most recently used branches are kept in
+    memory; the others wait in a BranchStore on disk and are loaded back the
+    next time they are used (CHECKOUT, MERGE, LOG...). Together with the
+    per-branch history limit, this bounds the memory spent on branches no
+    matter how many exist.
+
+    With `follow` set to a primary's replication address, the VCS is a
+    read-only follower: its state comes from the primary's snapshot and log
+    stream (see replication.py) instead of data_dir, and it logs nothing.
+
+    Locking order (never acquire in the reverse direction):
+      _commit_lock -> _registry_lock -> BranchWorkspace.lock -> ObjectStore internals -> WAL
     """
-    def __init__(self):
-        self.official_repository_content = "" # Improved name for server file content
-        self.connected_clients = []
-        
-        # Storage: { "branch_name": BranchWorkspaceObject }
-        self.branch_registry = {} # Improved name
-        
+    def __init__(self, data_dir=DATA_DIR, history_limit=HISTORY_DEPTH_LIMIT,
+                 branch_cache_entries=BRANCH_CACHE_ENTRIES, shared_file=SHARED_FILE, follow=None):
+        self.official_revision_id = None
+        # Position of the official version in the order of commits (see _next_sequence)
+        self.official_sequence = 0
+        # Plain-text copy of the official DEFAULT_PATH (imported on first start)
+        self.shared_file = shared_file
+        self.object_store = ObjectStore()
+        self.trees = TreeStore(self.object_store)
+        self.commit_graph = CommitGraph()
+        # Trigram index of the files at the branch heads and in the commits, for GREP
+        self.search_index = SearchIndex(self.trees, self.commit_graph)
+        # Official files written out and memory-mapped for SHOW
+        self.mapped_files = MappedFileCache(os.path.join(data_dir, "export"), self.object_store, MAPPED_FILE_ENTRIES)
+        # Commit/merge notices for connected clients (see pubsub.py)
+        self.broker = Broker()
+
+        # Storage: { "branch_name": BranchWorkspaceObject } for the branches in memory,
+        # least recently used first; the rest are in branch_store
+        self.branch_registry = OrderedDict() # Improved name
+        self.branch_store = BranchStore(os.path.join(data_dir, "branches"))
+        self.history_limit = history_limit
+        self.branch_cache_entries = branch_cache_entries
+
+        # Optional lookup for branches kept outside this VCS (the other shards of
+        # the sharded server): ref_resolver(name) returns the head revision ID of
+        # such a branch, or None to look the name up here as usual.
+        self.ref_resolver = None
+        # Optional callback, also for the sharded server: on_commit(revision_id, sequence)
+        # runs on the committing thread for every commit this VCS makes official.
+        self.on_commit = None
+        # Optional source of commit sequence numbers, for the sharded server:
+        # commit_sequence() returns a number larger than any it returned before,
+        # to any shard, so commits made on different shards can be ordered.
+        self.commit_sequence = None
+
         # User Tracking: { "username": "current_branch_name" }
         self.user_sessions = {}
-        
-        self._load_from_disk() # Renamed to private helper method
-        
-        # Ensure the default 'master' branch is initialized
-        if "master" not in self.branch_registry:
-            self.branch_registry["master"] = BranchWorkspace("master", self.official_repository_content)
+        # The file each user's draft commands work on: { "username": "path" }
+        self.user_paths = {}
+
+        # Guards branch_registry, branch_store and user_sessions
+        self._registry_lock = Lock()
+        # Serialises commits so the official content and the log agree
+        self._commit_lock = Lock()
+        # Only one checkpoint runs at a time
+        self._checkpoint_lock = Lock()
+
+        self.data_dir = data_dir
+        self.wal = None
+        # Log shipping: a replication.ReplicationSource on a primary that has
+        # followers, the replication.Follower on a follower (None otherwise)
+        self.replication = None
+        self.read_only = follow is not None
+        if follow is None:
+            self._recover()
+        else:
+            self.replication = Follower(follow, self).start() # Returns once the first snapshot is loaded
 
     # --- File I/O Operations ---
+    @property
+    def official_repository_content(self):
+        """The official (last committed) content of DEFAULT_PATH, mirrored to the shared file."""
+        return self.read_file(self.official_revision_id, DEFAULT_PATH) or ""
+
     def _load_from_disk(self):
         """Reads the official repository file from the disk."""
-        if os.path.exists(SHARED_FILE):
-            with open(SHARED_FILE, 'r') as f:
-                self.official_repository_content = f.read()
-        else:
-            self.official_repository_content = ""
+        if os.path.exists(self.shared_file):
+            with open(self.shared_file, 'r') as f:
+                return f.read()
+        return ""
+
+    def official_file(self, path):
+        """
+        The official (last committed) version of a file as a memory-mapped
+        MappedFile, or None if the file does not exist in the official revision.
+        """
+        entry = self.trees.lookup(self.commit_graph.object_id(self.official_revision_id), path)
+        if entry is None or entry[0] != "blob":
+            return None
+        return self.mapped_files.open(entry[1])
 
     def _save_to_disk(self): # Renamed to private helper method
-        """Writes the current official memory state to the physical file."""
+        """
+        Writes the current official memory state to the physical file.
+        The file is replaced atomically, so a crash never leaves it half written.
+        """
         try:
-            with open(SHARED_FILE, 'w') as f:
-                f.write(self.official_repository_content)
+            temp_file = self.shared_file + ".tmp"
+            official = self.official_file(DEFAULT_PATH)
+            with open(temp_file, 'wb') as f:
+                if official is not None:
+                    f.write(official.read())
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_file, self.shared_file)
         except Exception as e:
-            print(f"Error writing to disk: {e}")
+            logger.error("Error writing to disk: %s", e)
+
+    # --- Write-Ahead Log & Checkpoints ---
+    def _recover(self):
+        """Rebuilds the state from the newest checkpoint plus the log segments written after it."""
+        os.makedirs(self.data_dir, exist_ok=True)
+        checkpoint_seq, state = load_latest_checkpoint(self.data_dir)
+
+        if state is not None:
+            self._restore_state(state)
+        else:
+            # First start: import the legacy repository file as the initial state
+            initial_id = self.trees.write_files(None, {DEFAULT_PATH: self._load_from_disk()})
+            root_revision = self.commit_graph.add(initial_id, author="server",
+                                                  message=f"Initial import of {self.shared_file}")
+            self.official_revision_id = root_revision
+            self._install_branch(self._new_branch("master", root_revision))
+
+        # Replay every operation logged after the checkpoint, in order
+        segments = [seq for seq in list_segments(self.data_dir, "wal") if seq >= checkpoint_seq]
+        for seq in segments:
+            path = segment_path(self.data_dir, "wal", seq)
+            records, valid_length = read_records(path)
+            for record in records:
+                self._apply_record(record)
+            if valid_length < os.path.getsize(path):
+                # Drop a torn tail left by a crash so new records append cleanly
+                with open(path, "r+b") as f:
+                    f.truncate(valid_length)
+
+        current_seq = max(segments + [checkpoint_seq, 1])
+        self.wal = WriteAheadLog(self.data_dir, current_seq, WAL_FLUSH_INTERVAL)
+        self.object_store.on_new_object = lambda object_id, entry: self._log(("obj", object_id, entry))
+        self.commit_graph.on_new_revision = lambda revision_id, node: self._log(("rev", revision_id, node))
+
+        if state is None:
+            self.checkpoint() # Make the imported initial state durable straight away
+        self._index_commits()
+
+    def _index_commits(self):
+        """Queues the committed versions for the search index and starts it (after recovery or a snapshot)."""
+        # Branch heads were queued for the search index as they were rebuilt; the
+        # committed versions are queued oldest first (the initial import included)
+        committed = [(node.timestamp, revision_id) for revision_id, node in self.commit_graph.snapshot().items()
+                     if node.kind in ("root", "commit")]
+        for _, revision_id in sorted(committed):
+            self.search_index.committed(revision_id)
+        self.search_index.start()
+
+    def _apply_record(self, record):
+        """Re-applies one logged operation during recovery."""
+        op = record[0]
+        if op == "obj":
+            self.object_store.load_entry(record[1], record[2])
+        elif op == "rev":
+            self.commit_graph.load_entry(record[1], record[2])
+        elif op in ("edit", "merge"):
+            self._get_branch(record[1]).apply_new_state(record[2])
+        elif op == "undo":
+            self._get_branch(record[1]).step_back()
+        elif op == "redo":
+            self._get_branch(record[1]).step_forward()
+        elif op == "branch":
+            self._install_branch(self._new_branch(record[1], record[2]))
+        elif op == "delete":
+            self._remove_branch(record[1])
+        elif op == "session":
+            self.user_sessions[record[1]] = record[2]
+        elif op == "path":
+            self.user_paths[record[1]] = record[2]
+        elif op == "commit":
+            self._get_branch(record[1]).apply_new_state(record[2])
+            self.official_revision_id = record[2]
+            # Logs written before commits were numbered have no sequence number
+            self.official_sequence = record[3] if len(record) > 3 else self.official_sequence + 1
+        elif op == "batch":
+            branch = self._get_branch(record[1])
+            for revision_id in record[2]:
+                branch.apply_new_state(revision_id)
+            if record[3]:
+                self.official_revision_id = record[2][-1]
+                self.official_sequence = record[6] if len(record) > 6 else self.official_sequence + 1
+            self.user_paths[record[4]] = record[5]
+        elif op == "official":
+            self.official_revision_id = record[1]
+            self.official_sequence = record[2]
+
+    def _log(self, record):
+        """Appends an operation to the write-ahead log; returns its sequence number."""
+        if self.wal is None: # Still recovering
+            return 0
+        lsn = self.wal.append(record)
+        if self.wal.bytes_since_checkpoint > WAL_CHECKPOINT_BYTES and not self._checkpoint_lock.locked():
+            Thread(target=self.checkpoint, name="vcs-checkpoint", daemon=True).start()
+        return lsn
+
+    def _capture_state(self):
+        """
+        Snapshot of everything needed to rebuild the VCS (caller holds every lock).
+        Spilled branches are only pinned here: _read_spilled() adds them once the
+        locks are released, so operations do not wait for their files to be read.
+        """
+        objects, deltas = self.object_store.snapshot()
+        spilled = self.branch_store.pin()
+        branches = {}
+        for name, branch in self.branch_registry.items():
+            branches[name] = (branch.head_revision_id, _stack_items(branch.history_stack), _stack_items(branch.future_stack))
+        return {
+            "objects": objects,
+            "deltas": deltas,
+            "revisions": self.commit_graph.snapshot(),
+            "branches": branches,
+            "sessions": dict(self.user_sessions),
+            "paths": dict(self.user_paths),
+            "official_revision_id": self.official_revision_id,
+            "official_sequence": self.official_sequence,
+            "spilled": spilled, # Replaced by the branches themselves in _read_spilled()
+        }
+
+    def _read_spilled(self, state):
+        """Completes a snapshot from _capture_state() with the spilled branches, as they were when it was taken."""
+        branches = {}
+        try:
+            for name in state.pop("spilled"):
+                with self._registry_lock: # One branch at a time, so operations go on meanwhile
+                    branches[name] = self.branch_store.read_pinned(name)
+        finally:
+            with self._registry_lock:
+                self.branch_store.unpin()
+        branches.update(state["branches"]) # Spilled first: _restore_state() keeps the last ones in memory
+        state["branches"] = branches
+        return state
+
+    def _restore_state(self, state):
+        """Loads a snapshot produced by _capture_state()."""
+        self.object_store.restore(state["objects"], state["deltas"])
+        self.commit_graph.restore(state["revisions"])
+        for name, (head_id, history, future) in state["branches"].items():
+            branch = self._new_branch(name, head_id)
+            branch.restore_history(history, future)
+            self._install_branch(branch)
+        self.user_sessions.update(state["sessions"])
+        self.user_paths.update(state.get("paths", {}))
+        self.official_revision_id = state["official_revision_id"]
+        self.official_sequence = state.get("official_sequence", 0)
+
+    # --- Replication (see replication.py) ---
+    def ship_log(self, source):
+        """Primary: hands every log write to `source` (a replication.ReplicationSource) once it is durable."""
+        self.replication = source
+        self.wal.on_durable = source.publish
+
+    def replication_snapshot(self, subscribe):
+        """
+        Primary: the state a new follower starts from. subscribe() is called
+        with every lock held and the log flushed, so the follower's feed gets
+        exactly the log writes made after the snapshot.
+        """
+        with self._checkpoint_lock: # Branch store pins are taken by one snapshot at a time
+            with self._commit_lock, self._registry_lock, ExitStack() as held:
+                for name in sorted(self.branch_registry):
+                    held.enter_context(self.branch_registry[name].lock)
+                state = self._capture_state()
+                self.wal.flush()
+                subscribe()
+            return self._read_spilled(state)
+
+    def load_snapshot(self, state):
+        """Follower: replaces the whole state with a snapshot from the primary (on every connection)."""
+        with self._commit_lock, self._registry_lock:
+            for branch in self.branch_registry.values():
+                with branch.lock:
+                    branch.retired = True # Commands holding it look the branch up again
+            self.branch_registry.clear()
+            self.branch_store.clear()
+            self.user_sessions.clear()
+            self.user_paths.clear()
+            self.search_index.close()
+            self.search_index = SearchIndex(self.trees, self.commit_graph)
+            self._restore_state(state)
+        self._index_commits()
+
+    def apply_replicated(self, records):
+        """Follower: applies log records received from the primary, under the locks readers take."""
+        with self._registry_lock:
+            for record in records:
+                if record[0] in _BRANCH_RECORDS:
+                    with self._get_branch(record[1]).lock:
+                        self._apply_record(record)
+                else:
+                    self._apply_record(record)
+                if record[0] in ("commit", "official") or (record[0] == "batch" and record[3]):
+                    self.search_index.committed(self.official_revision_id)
+
+    def checkpoint(self):
+        """
+        Compacts the log: captures the full state, starts a new log segment, writes
+        the checkpoint atomically and deletes the segments it replaces. Operations are
+        paused only while the in-memory snapshot is taken, not while spilled branches
+        are read back for it or while it is written.
+        """
+        if not self._checkpoint_lock.acquire(blocking=False):
+            return False # Another checkpoint is already running
+        try:
+            with self._commit_lock, self._registry_lock, ExitStack() as held:
+                for name in sorted(self.branch_registry):
+                    held.enter_context(self.branch_registry[name].lock)
+                state = self._capture_state()
+                new_seq = self.wal.seq + 1
+                self.wal.rotate(new_seq)
+
+            self._read_spilled(state)
+            write_checkpoint(self.data_dir, new_seq, state)
+            remove_segments_before(self.data_dir, new_seq)
+            self._save_to_disk() # Keep the plain-text copy of the official file current
+            return True
+        finally:
+            self._checkpoint_lock.release()
+
+    def close(self):
+        """Writes a final checkpoint and stops the log (called on server shutdown)."""
+        self.broker.close()
+        self.search_index.close()
+        if self.replication is not None:
+            self.replication.close()
+        if self.wal is not None:
+            self.checkpoint()
+            self.wal.close()
+
+    def gauges(self):
+        """Values reported by STATS and the metrics file: (name, help, value) tuples."""
+        with self._registry_lock:
+            in_memory = len(self.branch_registry)
+            branches = in_memory + len(self.branch_store)
+            sessions = len(self.user_sessions)
+        return [
+            ("branches", "Branches", branches),
+            ("branches_in_memory", "Branches held in memory (the rest are spilled to disk)", in_memory),
+            ("sessions", "Users with a session", sessions),
+            ("revisions", "Revisions in the commit graph", len(self.commit_graph)),
+            ("objects", "Objects (file versions and trees) in the object store", len(self.object_store)),
+            ("object_store_bytes", "Bytes held by stored keyframes and deltas", self.object_store.stored_bytes()),
+            ("search_index_versions", "File versions in the GREP trigram index", len(self.search_index)),
+        ] + (self.replication.gauges() if self.replication is not None else [])
 
     # --- User & Branch Management ---
-    def register_user(self, username, connection_socket): # Improved name
-        """Adds a new user and sets their initial branch to 'master'."""
-        self.connected_clients.append(connection_socket)
-        self.user_sessions[username] = "master"
+    def _new_branch(self, name, revision_id):
+        return BranchWorkspace(name, self.trees, self.commit_graph, revision_id, self.history_limit,
+                               self.search_index.head_moved)
+
+    # The helpers below are called with _registry_lock held (or during recovery)
+    def _has_branch(self, name):
+        return name in self.branch_registry or self.branch_store.contains(name)
+
+    def _get_branch(self, name):
+        """Returns a branch, loading it back from the branch store if it was spilled (None if it does not exist)."""
+        branch = self.branch_registry.get(name)
+        if branch is not None:
+            self.branch_registry.move_to_end(name)
+            return branch
+        state = self.branch_store.take(name)
+        if state is None:
+            return None
+        branch = self._new_branch(name, state[0])
+        branch.restore_history(state[1], state[2])
+        self._install_branch(branch)
+        return branch
+
+    def _install_branch(self, branch):
+        """Adds a branch as the most recently used one and spills the least recently used beyond the cache size."""
+        self.branch_registry[branch.name] = branch
+        # Busy branches are skipped (moved to the back), so at most one pass is made
+        for _ in range(len(self.branch_registry) - self.branch_cache_entries):
+            victim = next(iter(self.branch_registry.values()))
+            if victim is branch or not victim.lock.acquire(blocking=False):
+                self.branch_registry.move_to_end(victim.name)
+                continue
+            try:
+                self.branch_store.save(victim.name, victim.head_revision_id,
+                                       _stack_items(victim.history_stack), _stack_items(victim.future_stack))
+                victim.retired = True
+                del self.branch_registry[victim.name]
+            finally:
+                victim.lock.release()
+
+    def _remove_branch(self, name):
+        """Deletes a branch wherever it is and moves its users to 'master'. Returns False if it does not exist."""
+        branch = self.branch_registry.pop(name, None)
+        if branch is not None:
+            with branch.lock:
+                branch.retired = True
+        elif not self.branch_store.discard(name):
+            return False
+        self.search_index.head_moved(name, None)
+        for username, branch_name in self.user_sessions.items():
+            if branch_name == name:
+                self.user_sessions[username] = "master"
+        return True
+
+    @contextmanager
+    def _locked_active_branch(self, username):
+        """
+        Holds the lock of the user's active branch. If the branch was spilled or
+        deleted between the lookup and taking its lock, it is looked up again,
+        so a change never lands on a retired copy.
+        """
+        while True:
+            branch = self.get_active_branch(username)
+            with branch.lock:
+                if not branch.retired:
+                    yield branch
+                    return
+
+    def register_user(self, username, subscriber=None): # Improved name
+        """
+        Adds a user to the session list and subscribes their connection
+        (a pubsub.Subscriber, or None) to notices. A returning user is put back
+        on the branch they last used (if it still exists); new users start on
+        'master'. Returns the name of the user's branch.
+        """
+        if subscriber is not None:
+            self.broker.subscribe(subscriber)
+        with self._registry_lock:
+            branch_name = self.user_sessions.get(username, "master")
+            if not self._has_branch(branch_name):
+                branch_name = "master"
+            self.user_sessions[username] = branch_name
+            self._log(("session", username, branch_name))
+        return branch_name
+
+    def unregister_client(self, subscriber):
+        """Stops sending notices to a disconnected client (no-op if already gone)."""
+        self.broker.unsubscribe(subscriber)
+
+    def get_connected_clients(self):
+        """Returns a snapshot list of subscribed connections."""
+        return self.broker.subscribers()
+
+    def read_file(self, revision_id, path):
+        """Returns the content of a file in a revision (None if the file does not exist there)."""
+        return self.trees.read_file(self.commit_graph.object_id(revision_id), path)
+
+    def set_session(self, username, branch_name, path):
+        """
+        Puts a user on a branch and file. The sharded server keeps sessions in
+        its front-end and sends them along with every command (see sharding.py).
+        """
+        with self._registry_lock:
+            if self.user_sessions.get(username) != branch_name:
+                self.user_sessions[username] = branch_name
+                self._log(("session", username, branch_name))
+            if self.user_paths.get(username, DEFAULT_PATH) != path:
+                self.user_paths[username] = path
+                self._log(("path", username, path))
+
+    def branch_head(self, branch_name):
+        """Head revision ID of a branch, or None if there is no such branch."""
+        with self._registry_lock:
+            branch = self._get_branch(branch_name)
+        if branch is None:
+            return None
+        with branch.lock:
+            return branch.head_revision_id
+
+    def get_user_path(self, username):
+        """The file the user's EDIT/PATCH/PEEK/SHOW commands work on."""
+        with self._registry_lock:
+            return self.user_paths.get(username, DEFAULT_PATH)
 
     def get_active_branch(self, username):
         """Retrieves the BranchWorkspace object the user is currently checked out to."""
-        branch_name = self.user_sessions.get(username, "master")
-        return self.branch_registry.get(branch_name, self.branch_registry["master"]) # Safe retrieval
-
-    def create_branch(self, username, new_branch_name):
-        """Creates a new branch that is an exact copy of the user's current branch state."""
-        if new_branch_name in self.branch_registry:
-            return f"Error: Branch '{new_branch_name}' already exists."
-        
-        # Copy current state to the new branch
-        current_branch = self.get_active_branch(username)
-        self.branch_registry[new_branch_name] = BranchWorkspace(new_branch_name, current_branch.current_content)
+        with self._registry_lock:
+            branch_name = self.user_sessions.get(username, "master")
+            return self._get_branch(branch_name) or self._get_branch("master") # Safe retrieval
+
+    def create_branch(self, username, new_branch_name, revision_id=None):
+        """
+        Creates a new branch that is an exact copy of the user's current branch state
+        (or that starts at `revision_id`, the head of a branch kept on another shard).
+        """
+        if revision_id is not None:
+            head_id = revision_id
+        else:
+            current_branch = self.get_active_branch(username)
+            with current_branch.lock:
+                head_id = current_branch.head_revision_id
+
+        with self._registry_lock:
+            if self._has_branch(new_branch_name):
+                return f"Error: Branch '{new_branch_name}' already exists."
+
+            # The new branch starts from the same revision as the current branch (no copy)
+            self._install_branch(self._new_branch(new_branch_name, head_id))
+            self._log(("branch", new_branch_name, head_id))
         return f"Branch '{new_branch_name}' created successfully."
 
     def switch_branch(self, username, target_branch_name):
-        """Checks out to a different branch, updating the user's session."""
-        if target_branch_name not in self.branch_registry:
-            return f"Error: Branch '{target_branch_name}' not found."
-        
-        self.user_sessions[username] = target_branch_name
-        branch = self.branch_registry[target_branch_name]
+        """Checks out to a different branch, updating the user's session (and loading a spilled branch)."""
+        with self._registry_lock:
+            if self._get_branch(target_branch_name) is None:
+                return f"Error: Branch '{target_branch_name}' not found."
+
+            self.user_sessions[username] = target_branch_name
+            self._log(("session", username, target_branch_name))
         return f"Switched to branch '{target_branch_name}'. Content loaded."
 
-    # --- The Core 3: Edit, Undo, Redo ---
-    def edit(self, username, new_content):
-        """Applies a new change to the active branch, saving the old state to history."""
+    def checkout_revision(self, username, revision_ref):
+        """
+        Checks out any revision by (a unique prefix of) its ID. The revision gets
+        its own branch 'detached-<id>' so it can be edited, merged or committed.
+        """
+        revision_id = self.commit_graph.resolve_prefix(revision_ref)
+        if revision_id is None:
+            return f"Error: Branch or version '{revision_ref}' not found."
+
+        branch_name = f"detached-{revision_id[:12]}"
+        with self._registry_lock:
+            if self._get_branch(branch_name) is None:
+                self._install_branch(self._new_branch(branch_name, revision_id))
+                self._log(("branch", branch_name, revision_id))
+            self.user_sessions[username] = branch_name
+            self._log(("session", username, branch_name))
+        return f"Checked out version {revision_id[:12]} on branch '{branch_name}'. Content loaded."
+
+    def delete_branch(self, username, branch_name):
+        """
+        Deletes a branch and its undo/redo history. Its revisions stay in the commit
+        graph, so LOG and CHECKOUT by version ID still reach them. Users who had the
+        branch checked out are moved to 'master'.
+        """
+        if branch_name == "master":
+            return "Error: The 'master' branch cannot be deleted."
+        with self._registry_lock:
+            if not self._remove_branch(branch_name):
+                return f"Error: Branch '{branch_name}' not found."
+            self._log(("delete", branch_name))
+        return f"Branch '{branch_name}' deleted."
+
+    # --- Paths ---
+    def open_path(self, username, path):
+        """Selects the file the user's draft commands work on (it need not exist yet)."""
+        try:
+            path = normalize_path(path)
+        except ValueError as e:
+            return f"Error: {e}"
         branch = self.get_active_branch(username)
-        
-        # 1. Update content
-        branch.current_content = new_content
-        # 2. Save new state to history stack
-        branch.history_stack.push(new_content)
-        # 3. Clear future stack (a new edit kills the ability to Redo prior undos)
-        branch.future_stack.clear()
-        
-        return f"File updated on branch '{branch.name}'."
+        with branch.lock:
+            entry = self.trees.lookup(branch.head_tree_id, path)
+        if entry is not None and entry[0] == "tree":
+            return f"Error: '{path}' is a directory. Use LS:{path} to list it."
 
-    def undo(self, username):
-        """Reverts the current branch state to the previous recorded state."""
+        with self._registry_lock:
+            self.user_paths[username] = path
+            self._log(("path", username, path))
+        if entry is None:
+            return f"Opened new file '{path}' on branch '{branch.name}'. EDIT it to create it."
+        return f"Opened '{path}' on branch '{branch.name}'."
+
+    def list_path(self, username, path=""):
+        """Lists a directory of the user's branch head (directories end with '/')."""
         branch = self.get_active_branch(username)
+        with branch.lock:
+            root_id = branch.head_tree_id
         try:
-            # The current state is popped off the history stack...
-            current_state = branch.history_stack.pop()
-            
-            # ...if the stack is now empty, we stop
-            if branch.history_stack.is_empty():
-                # Re-add the state we popped to prevent underflow
-                branch.history_stack.push(current_state) 
+            path = normalize_path(path) if path.strip() else ""
+        except ValueError as e:
+            return f"Error: {e}"
+
+        entry = self.trees.lookup(root_id, path) if path else ("tree", root_id)
+        if entry is None:
+            return f"Error: '{path}' not found on branch '{branch.name}'."
+        if entry[0] == "blob":
+            return path
+        names = [name + "/" if kind == "tree" else name
+                 for name, (kind, _) in sorted(self.trees.read_tree(entry[1]).items())]
+        return "\n".join(names) if names else "(empty)"
+
+    # --- History Queries ---
+    def resolve_ref(self, username, ref):
+        """
+        Turns a reference into a revision ID: '' or 'HEAD' (the user's branch head),
+        'official' (the last commit), a branch name, or a unique revision ID prefix.
+        """
+        ref = ref.strip()
+        if ref in ("", "HEAD"):
+            branch = self.get_active_branch(username)
+        elif ref == "official":
+            return self.official_revision_id
+        else:
+            revision_id = self.ref_resolver(ref) if self.ref_resolver else None
+            if revision_id is not None:
+                return revision_id
+            with self._registry_lock:
+                branch = self._get_branch(ref)
+            if branch is None:
+                return self.commit_graph.resolve_prefix(ref)
+        with branch.lock:
+            return branch.head_revision_id
+
+    def log(self, username, ref="", limit=LOG_LIMIT):
+        """Lists the newest revisions on the first-parent history of a reference."""
+        revision_id = self.resolve_ref(username, ref)
+        if revision_id is None:
+            return f"Error: Branch or version '{ref}' not found."
+
+        lines = []
+        for entry_id, node in self.commit_graph.first_parent_history(revision_id, limit):
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(node.timestamp))
+            marks = " (official)" if entry_id == self.official_revision_id else ""
+            if len(node.parents) > 1:
+                marks += f" (merge of {', '.join(p[:12] for p in node.parents)})"
+            text = f" {node.message}" if node.message else ""
+            lines.append(f"{entry_id[:12]} {when} {node.author or '-'} [{node.kind}]{text}{marks}")
+        return "\n".join(lines)
+
+    def diff(self, username, first_ref, second_ref):
+        """Unified line diff between two references (see resolve_ref)."""
+        ids = []
+        for ref in (first_ref, second_ref):
+            revision_id = self.resolve_ref(username, ref)
+            if revision_id is None:
+                return f"Error: Branch or version '{ref}' not found."
+            ids.append(revision_id)
+        # Only files whose blob IDs differ are read; shared subtrees are skipped
+        changes = self.trees.diff(self.commit_graph.object_id(ids[0]), self.commit_graph.object_id(ids[1]))
+        output = []
+        for path, old_blob, new_blob in changes:
+            old_lines = self.object_store.get(old_blob).splitlines(keepends=True) if old_blob else []
+            new_lines = self.object_store.get(new_blob).splitlines(keepends=True) if new_blob else []
+            output.append(f"diff {ids[0][:12]}..{ids[1][:12]} {path}\n")
+            output.extend(unified_diff(old_lines, new_lines,
+                                       f"a/{path}" if old_blob else "/dev/null",
+                                       f"b/{path}" if new_blob else "/dev/null"))
+        return "".join(output) if output else "No differences."
+
+    def grep(self, pattern, history=False):
+        """
+        Lists the lines containing `pattern` at every branch head and, with
+        `history`, in every committed file version (see search_index.py).
+        """
+        return format_matches(pattern, *self.search_index.search(pattern, history))
+
+    # --- The Core 3: Edit, Undo, Redo ---
+    def edit(self, username, new_content, path=None):
+        """
+        Applies a new change to one file of the active branch (the user's open file
+        by default), saving the old state to history.
+        """
+        return self.edit_files(username, {path or self.get_user_path(username): new_content})
+
+    def edit_files(self, username, files, message=None):
+        """
+        Writes { path: content } files to the active branch as one new state in its
+        history. Only the trees on the changed paths are rewritten; the rest of the
+        repository is shared with the previous state, so the cost follows the size
+        of the change rather than the size of the repository.
+        """
+        try:
+            files = {normalize_path(path): content for path, content in files.items()}
+        except ValueError as e:
+            return f"Error: {e}"
+        if message is None:
+            message = f"Edit {next(iter(files))}" if len(files) == 1 else f"Edit {len(files)} files"
+
+        with self._locked_active_branch(username) as branch:
+            # Store the new versions as deltas against the current ones, then move the head
+            try:
+                tree_id = self.trees.write_files(branch.head_tree_id, files)
+            except ValueError as e:
+                return f"Error: {e}"
+            new_id = self.commit_graph.add(tree_id, (branch.head_revision_id,), author=username, message=message)
+            branch.apply_new_state(new_id)
+            self._log(("edit", branch.name, new_id))
+
+        if len(files) == 1:
+            return f"File '{next(iter(files))}' updated on branch '{branch.name}'."
+        return f"{len(files)} files updated on branch '{branch.name}'."
+
+    def remove_path(self, username, path):
+        """Deletes a file or directory from the active branch (recorded as an edit)."""
+        try:
+            path = normalize_path(path)
+        except ValueError as e:
+            return f"Error: {e}"
+
+        with self._locked_active_branch(username) as branch:
+            tree_id = self.trees.remove(branch.head_tree_id, path)
+            if tree_id is None:
+                return f"Error: '{path}' not found on branch '{branch.name}'."
+            new_id = self.commit_graph.add(tree_id, (branch.head_revision_id,), author=username,
+                                           message=f"Remove {path}")
+            branch.apply_new_state(new_id)
+            self._log(("edit", branch.name, new_id))
+
+        return f"Removed '{path}' from branch '{branch.name}'."
+
+    def patch(self, username, base_revision_id, ops):
+        """
+        Applies a delta (see delta.py) computed by the client against a known
+        revision of the file, so only the changed parts travel over the network.
+        If other edits have landed on the branch since that revision, the patch
+        is three-way merged onto the current head; overlapping changes reject it.
+        Returns (status, revision_id) where revision_id is set only when the
+        patched content itself became the new head.
+        """
+        if not self.commit_graph.contains(base_revision_id):
+            return f"Error: Unknown base version '{base_revision_id}'. SYNC and try again.", None
+        path = self.get_user_path(username)
+        base_content = self.read_file(base_revision_id, path) or ""
+        try:
+            check_delta(ops, len(base_content))
+        except ValueError as e:
+            return f"Error: Patch does not match the base version ({e}).", None
+        new_content = apply_delta(base_content, ops)
+
+        with self._locked_active_branch(username) as branch:
+            head_id = branch.head_revision_id
+            if head_id != base_revision_id:
+                # The branch moved on: rebase the patch onto the head
+                new_content, conflicts = three_way_merge(base_content, branch.read_file(path), new_content)
+                if conflicts:
+                    return (f"Error: Patch conflicts with {len(conflicts)} change(s) made on branch "
+                            f"'{branch.name}' since version {base_revision_id[:12]}. Nothing was applied."), None
+            try:
+                tree_id = self.trees.write_file(branch.head_tree_id, path, new_content)
+            except ValueError as e:
+                return f"Error: {e}", None
+            new_id = self.commit_graph.add(tree_id, (head_id,), author=username, message=f"Edit {path}")
+            # The client's patched copy is exactly the new head only on the fast path
+            applied_id = new_id if head_id == base_revision_id else None
+            branch.apply_new_state(new_id)
+            self._log(("edit", branch.name, new_id))
+
+        return f"File '{path}' updated on branch '{branch.name}'.", applied_id
+
+    def undo(self, username):
+        """Reverts the current branch state to the previous recorded state."""
+        with self._locked_active_branch(username) as branch:
+            if not branch.step_back():
                 return "Nothing to undo (at base state of history)."
-            
-            # ...and the popped state is saved to the future stack for Redo
-            branch.future_stack.push(current_state)
-            
-            # The new 'current' content is the state now on top of the history stack
-            branch.current_content = branch.history_stack.peek()
-            
-            return "Undo successful."
-        except StackUnderFlowError:
-            return "Nothing to undo."
+            self._log(("undo", branch.name))
+        return "Undo successful."
 
     def redo(self, username):
         """Re-applies the most recently undone state."""
-        branch = self.get_active_branch(username)
-        if branch.future_stack.is_empty():
-            return "Nothing to redo."
-        
-        # 1. Take the state from the future stack...
-        restored_state = branch.future_stack.pop()
-        # 2. ...and put it back into the history stack
-        branch.history_stack.push(restored_state)
-        branch.current_content = restored_state
+        with self._locked_active_branch(username) as branch:
+            if not branch.step_forward():
+                return "Nothing to redo."
+            self._log(("redo", branch.name))
         return "Redo successful."
 
-    def commit(self, username):
+    def _next_sequence(self):
+        """Sequence number of a new commit (the caller holds _commit_lock)."""
+        if self.commit_sequence is not None:
+            return self.commit_sequence()
+        return self.official_sequence + 1
+
+    def _promote(self, revision_id, sequence):
+        """Makes a new commit the official version. The caller holds _commit_lock."""
+        self.official_revision_id = revision_id
+        self.official_sequence = sequence
+        self.search_index.committed(revision_id)
+        if self.on_commit is not None:
+            self.on_commit(revision_id, sequence)
+
+    def adopt_official(self, revision_id, sequence):
         """
-        Promotes the user's current branch content to the official server repository,
-        and saves it to the physical file.
+        Makes a commit from elsewhere (another shard of the sharded server) the
+        official version, unless the official version here is the same or a
+        later commit. Returns True if it was adopted.
         """
-        # 1. Find the user's work
-        branch = self.get_active_branch(username)
-        
-        # 2. Update the Server's Global State (The "Official" version)
-        self.official_repository_content = branch.current_content
-        
-        # 3. Write to Hard Drive
-        self._save_to_disk()
-        
+        with self._commit_lock:
+            if sequence <= self.official_sequence:
+                return False
+            self.official_revision_id = revision_id
+            self.official_sequence = sequence
+            self._log(("official", revision_id, sequence))
+            self.search_index.committed(revision_id)
+        return True
+
+    def commit(self, username, message=""):
+        """
+        Records a commit (author, timestamp, message) on top of the user's branch
+        head and promotes it to the official server repository.
+        The commit is durable once its log record is fsynced; concurrent commits
+        share one fsync (group commit) instead of each rewriting the whole file.
+        """
+        with self._commit_lock:
+            # 1. Find the user's work, then create the commit object; it becomes the new head of the branch
+            with self._locked_active_branch(username) as branch:
+                head_id = branch.head_revision_id
+                commit_id = self.commit_graph.add(
+                    self.commit_graph.object_id(head_id), (head_id,), author=username, kind="commit",
+                    message=message or f"Commit from branch '{branch.name}'")
+                branch.apply_new_state(commit_id)
+                sequence = self._next_sequence()
+                lsn = self._log(("commit", branch.name, commit_id, sequence))
+
+            # 2. Update the Server's Global State (The "Official" version)
+            self._promote(commit_id, sequence)
+
+        # 3. Wait until the commit record is on disk
+        self.wal.wait_durable(lsn)
+
         # 4. Notify others
-        msg = f"[COMMIT] User \'{username}\' has committed new changes from branch '{branch.name}'."
-        self._broadcast_message(msg)
-        
-        return "Commit successful! Server repository updated."
+        msg = f"[COMMIT] User '{username}' committed {commit_id[:12]} from branch '{branch.name}': {message or 'no message'}"
+        self._broadcast_message(NOTIFY_COMMIT, msg)
+
+        return f"Commit {commit_id[:12]} successful! Server repository updated."
 
     def merge(self, username, source_name):
         """
-        Performs a simple merge (overwrite) of the source branch content 
-        into the user's active branch.
+        Three-way merge of the source branch into the user's active branch.
+        The merge base is the best common ancestor in the revision graph. Trees are
+        merged path by path (subtrees changed on one side only are taken whole);
+        files changed on both sides are merged line by line, and overlapping
+        changes are written between conflict markers and reported back.
         """
-        target_branch = self.get_active_branch(username)
-        
-        if source_name not in self.branch_registry:
+        source_id = self._source_head(source_name)
+        if source_id is None:
             return f"Error: Branch '{source_name}' not found."
-            
-        source_branch = self.branch_registry[source_name]
-        
-        # Check if merge is necessary
-        if target_branch.current_content == source_branch.current_content:
-            return f"Branch '{source_name}' is already up to date with '{target_branch.name}'."
-        
-        # 1. Update the content of the target branch (The Merge)
-        new_content = source_branch.current_content
-        target_branch.current_content = new_content
-        
-        # 2. Record the merge as a new state in history
-        target_branch.history_stack.push(new_content)
-        target_branch.future_stack.clear() 
-        
-        # 3. Announce the merge
+
+        with self._locked_active_branch(username) as target_branch:
+            new_id, conflicts = self._merge_revisions(username, target_branch.name, target_branch.head_revision_id,
+                                                      source_name, source_id)
+            if new_id is None:
+                return f"Branch '{source_name}' is already up to date with '{target_branch.name}'."
+
+            # Record the merge as a new state in history
+            target_branch.apply_new_state(new_id)
+            self._log(("merge", target_branch.name, new_id))
+
+        # Announce the merge
         msg = f"[MERGE] User {username} merged branch '{source_name}' into '{target_branch.name}'."
-        self._broadcast_message(msg)
-        
+        self._broadcast_message(NOTIFY_MERGE, msg)
+
+        if conflicts:
+            return _conflict_report(source_name, target_branch.name, conflicts,
+                                    "Resolve the marked sections and EDIT the files:")
         return f"Merge successful! '{source_name}' integrated into '{target_branch.name}'."
 
-    def _broadcast_message(self, message):
-        
+    def _source_head(self, source_name):
+        """Head of a branch to merge from, from ref_resolver or this VCS (None if there is no such branch)."""
+        source_id = self.ref_resolver(source_name) if self.ref_resolver else None
+        if source_id is None:
+            with self._registry_lock:
+                source_branch = self._get_branch(source_name)
+            if source_branch is None:
+                return None
+            # Snapshot the source head before the target is locked; holding one
+            # branch lock at a time means two opposite merges can never deadlock.
+            with source_branch.lock:
+                source_id = source_branch.head_revision_id
+        return source_id
+
+    def _merge_revisions(self, username, target_name, target_id, source_name, source_id):
         """
-        FIX: Temporarily modifies the function to ONLY print to the server console 
-        to prevent race conditions with the client's synchronous socket reads.
+        Merges revision source_id into target_id (caller holds the target branch lock).
+        Returns (new revision ID, conflicts), with None as the ID if the target
+        already contains the source.
         """
-        
+        base_id = self.commit_graph.merge_base(target_id, source_id)
 
-        print(f"[SERVER BROADCAST DISABLED (Race Condition Fix)] {message}")
-        for conn in self.connected_clients:
-            try:
-                conn.sendall(message.encode())
-            except:
-                pass
+        # 1. Nothing new on the source side
+        if source_id == target_id or base_id == source_id:
+            return None, []
+
+        if base_id == target_id:
+            # 2. Fast-forward: the target has no changes of its own
+            return source_id, []
+
+        # 3. Real three-way merge of the trees and file contents
+        tree_id, conflicts = self.trees.merge(
+            self.commit_graph.object_id(base_id) if base_id else None,
+            self.commit_graph.object_id(target_id), self.commit_graph.object_id(source_id),
+            ours_label=target_name, theirs_label=source_name)
+        new_id = self.commit_graph.add(tree_id, (target_id, source_id), author=username,
+                                       message=f"Merge '{source_name}' into '{target_name}'")
+        return new_id, conflicts
+
+    def batch(self, username, steps):
+        """
+        Runs a sequence of changes on the user's active branch as one unit.
+        `steps` are (kind, argument) pairs: ("open", path), ("edit", content),
+        ("rm", path), ("merge", branch name) and, last, ("commit", message).
+
+        Every step works on a private head while the branch lock is held, so no
+        other change lands on the branch between two steps. Only when all of
+        them succeed are the new states pushed onto the branch history, under a
+        single log record, so a crash replays the whole batch or none of it.
+        A failed step (including a merge with conflicts) leaves the branch as
+        it was; revisions made by the earlier steps stay unreachable in the
+        commit graph. Returns the status text.
+        """
+        if not steps:
+            return "Error: The batch is empty."
+        if any(kind == "commit" for kind, _ in steps[:-1]):
+            return "Error: COMMIT can only be the last command of a batch."
+        committed = steps[-1][0] == "commit"
+
+        # 1. Heads of the branches to merge, taken before the target is locked
+        sources = {}
+        for kind, argument in steps:
+            if kind == "merge" and argument not in sources:
+                sources[argument] = self._source_head(argument)
+                if sources[argument] is None:
+                    return f"Error: Branch '{argument}' not found. Nothing was applied."
+
+        path = self.get_user_path(username)
+        new_ids = []
+        merged = []
+        report = []
+        with ExitStack() as held:
+            if committed:
+                held.enter_context(self._commit_lock)
+            branch = held.enter_context(self._locked_active_branch(username))
+
+            # 2. Every step on a private head; the branch itself is not touched yet
+            head_id = branch.head_revision_id
+            for number, (kind, argument) in enumerate(steps, 1):
+                try:
+                    status, new_id = self._batch_step(username, branch.name, head_id, path, kind, argument,
+                                                      sources.get(argument))
+                except ValueError as e:
+                    status, new_id = f"Error: {e}", None
+                if status.startswith("Error:"):
+                    return f"Error: Step {number} ({kind.upper()}) failed, nothing was applied: {status[len('Error: '):]}"
+                if kind == "open":
+                    path = new_id
+                elif new_id is not None:
+                    new_ids.append(new_id)
+                    head_id = new_id
+                    if kind == "merge":
+                        merged.append(argument)
+                report.append(status)
+
+            # 3. All steps succeeded: publish them at once
+            for new_id in new_ids:
+                branch.apply_new_state(new_id)
+            sequence = self._next_sequence() if committed else None
+            lsn = self._log(("batch", branch.name, tuple(new_ids), committed, username, path, sequence))
+            if committed:
+                self._promote(head_id, sequence)
+
+        with self._registry_lock:
+            self.user_paths[username] = path
+        if committed:
+            self.wal.wait_durable(lsn)
+
+        for source_name in merged:
+            self._broadcast_message(NOTIFY_MERGE, f"[MERGE] User {username} merged branch '{source_name}' into '{branch.name}'.")
+        if committed:
+            self._broadcast_message(NOTIFY_COMMIT, f"[COMMIT] User '{username}' committed {head_id[:12]} "
+                                                   f"from branch '{branch.name}': {steps[-1][1] or 'no message'}")
+        report.append(f"Batch of {len(steps)} command(s) applied to branch '{branch.name}'.")
+        return "\n".join(report)
+
+    def _batch_step(self, username, branch_name, head_id, path, kind, argument, source_id):
+        """
+        One step of batch() against head_id. Returns (status, new revision ID or None);
+        for "open", the second value is the normalised path instead.
+        """
+        tree_id = self.commit_graph.object_id(head_id)
+        if kind == "open":
+            path = normalize_path(argument)
+            entry = self.trees.lookup(tree_id, path)
+            if entry is not None and entry[0] == "tree":
+                return f"Error: '{path}' is a directory.", None
+            return f"Opened '{path}'.", path
+        if kind == "edit":
+            new_id = self.commit_graph.add(self.trees.write_files(tree_id, {path: argument}), (head_id,),
+                                           author=username, message=f"Edit {path}")
+            return f"File '{path}' updated.", new_id
+        if kind == "rm":
+            removed = normalize_path(argument)
+            new_tree_id = self.trees.remove(tree_id, removed)
+            if new_tree_id is None:
+                return f"Error: '{removed}' not found.", None
+            return f"Removed '{removed}'.", self.commit_graph.add(new_tree_id, (head_id,), author=username,
+                                                                  message=f"Remove {removed}")
+        if kind == "merge":
+            new_id, conflicts = self._merge_revisions(username, branch_name, head_id, argument, source_id)
+            if conflicts:
+                return "Error: " + _conflict_report(argument, branch_name, conflicts, "Merge it on its own to resolve them:"), None
+            if new_id is None:
+                return f"Branch '{argument}' is already up to date.", None
+            return f"Merged '{argument}'.", new_id
+        if kind == "commit":
+            new_id = self.commit_graph.add(tree_id, (head_id,), author=username, kind="commit",
+                                           message=argument or f"Commit from branch '{branch_name}'")
+            return f"Commit {new_id[:12]} recorded.", new_id
+        return f"Error: Unknown batch step '{kind}'.", None
+
+    def _broadcast_message(self, kind, message):
+        """
+        Publishes a notice to every connected client. This only queues it: each
+        connection's writer delivers it, so a slow client never delays the caller.
+        """
+        logger.info("[BROADCAST] %s", message)
+        self.broker.publish(kind, message)
+
+
+def _conflict_report(source_name, target_name, conflicts, advice):
+    """Describes the conflicts of a merge (as returned by TreeStore.merge), one line per conflict."""
+    count = sum(len(found) if isinstance(found, list) else 1 for _, found in conflicts)
+    report = [f"Merge of '{source_name}' into '{target_name}' has {count} conflict(s). {advice}"]
+    for path, found in conflicts:
+        if not isinstance(found, list):
+            report.append(f"  {path}: {found}")
+            continue
+        for number, conflict in enumerate(found, 1):
+            report.append(f"  {path} #{number}: base lines {conflict['base'][0]}-{conflict['base'][1] - 1}, "
+                          f"'{target_name}' lines {conflict['ours'][0]}-{conflict['ours'][1] - 1}, "
+                          f"'{source_name}' lines {conflict['theirs'][0]}-{conflict['theirs'][1] - 1}")
+    return "\n".join(report)
+
+
+class LazyVersionControlSystem:
+    """
+    Stands in for the shared VersionControlSystem and creates it on first use,
+    so importing this module reads nothing from disk (the client imports the
+    shared modules too). The server calls open_in_background() at startup and
+    accepts connections while the store recovers; any attribute access waits
+    until it is open.
+    """
+    def __init__(self, factory=VersionControlSystem):
+        self._factory = factory
+        self._instance = None
+        self._opened = Event()
+        self._open_lock = Lock()
+        self._opener = None
+        self._open_error = None
+
+    def configure(self, **options):
+        """Sets arguments for the VersionControlSystem (only before it is opened)."""
+        self._factory = functools.partial(self._factory, **options)
+
+    def open_in_background(self):
+        """Starts opening the store on a thread and returns at once (no-op if already started)."""
+        with self._open_lock:
+            if self._opener is None:
+                self._opener = Thread(target=self._open, name="vcs-open", daemon=True)
+                self._opener.start()
+
+    def _open(self):
+        started = time.perf_counter()
+        try:
+            self._instance = self._factory()
+            logger.info("[STORE] Repository store opened in %.3fs.", time.perf_counter() - started)
+        except Exception as e:
+            self._open_error = e
+            logger.critical("[FATAL ERROR] Repository store failed to open: %s", e)
+        finally:
+            self._opened.set()
+
+    def get(self):
+        """The VersionControlSystem, opening it first if needed (blocks until it is open)."""
+        instance = self._instance
+        if instance is not None:
+            return instance
+        self.open_in_background()
+        self._opened.wait()
+        if self._open_error is not None:
+            raise RuntimeError(f"Repository store failed to open: {self._open_error}")
+        return self._instance
+
+    @property
+    def is_open(self):
+        return self._instance is not None
+
+    def close(self):
+        """Closes the store if it was ever opened (waiting for an open in progress)."""
+        if self._opener is not None:
+            self._opened.wait()
+        if self._instance is not None:
+            self._instance.close()
+
+    def __getattr__(self, name):
+        # Only called for attributes not defined above: forward them to the store
+        return getattr(self.get(), name)
 
 
-# Singleton Instance of the Version Control System
-vcs = VersionControlSystem()
\ No newline at end of file
+# Shared instance of the Version Control System, opened on first use
+vcs = LazyVersionControlSystem()
@@ -0,0 +1,298 @@
+import logging
+import os
+import pickle
+import re
+import struct
+import zlib
+from threading import Condition, Lock, Thread
+
+# On-disk layout inside the data directory:
+#
+#   checkpoint.<seq>   Compacted snapshot of the whole VCS state (atomically renamed into place)
+#   wal.<seq>          Append-only log of operations made after checkpoint.<seq> was taken
+#
+# Recovery loads the newest valid checkpoint and replays every wal segment with
+# a sequence number >= that checkpoint, in order.
+#
+# Each log record is framed as: | length (u32) | crc32 (u32) | pickled record |
+# A torn or corrupt record ends the replay; the tail after it is discarded.
+
+RECORD_HEADER = struct.Struct("<II")
+_SEGMENT_NAME = re.compile(r"^(wal|checkpoint)\.(\d{8})$")
+
+logger = logging.getLogger(__name__)
+
+
+def segment_path(directory, kind, seq):
+    return os.path.join(directory, f"{kind}.{seq:08d}")
+
+
+def list_segments(directory, kind):
+    """Returns the sorted sequence numbers of all files of one kind ('wal' or 'checkpoint')."""
+    found = []
+    for name in os.listdir(directory):
+        match = _SEGMENT_NAME.match(name)
+        if match and match.group(1) == kind:
+            found.append(int(match.group(2)))
+    return sorted(found)
+
+
+def encode_record(record):
+    payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(path, start=0, end=None):
+    """
+    Reads every intact record from a log segment, between byte `start` and
+    `end` (the end of the file by default).
+    Returns (records, valid_length): valid_length is the byte offset where the
+    last intact record ends, so a torn tail can be truncated away (or, for a
+    file still being appended to, read again later from there).
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read() if end is None else f.read(end - start)
+    records, length = decode_records(data)
+    return records, start + length
+
+
+def decode_records(data, loads=pickle.loads):
+    """
+    Decodes the intact records at the start of a buffer of framed records
+    (unpickling each with loads). Returns (records, length of the bytes they took).
+    """
+    records = []
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, offset)
+        payload_start = offset + RECORD_HEADER.size
+        payload = data[payload_start:payload_start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            break
+        try:
+            records.append(loads(payload))
+        except Exception:
+            break
+        offset = payload_start + length
+    return records, offset
+
+
+def _fsync_directory(directory):
+    """Makes a rename/create inside the directory durable (no-op where unsupported)."""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_checkpoint(directory, seq, state):
+    """Writes a checkpoint atomically: temp file, fsync, rename, fsync directory."""
+    final_path = segment_path(directory, "checkpoint", seq)
+    temp_path = final_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, final_path)
+    _fsync_directory(directory)
+
+
+def load_latest_checkpoint(directory):
+    """Returns (seq, state) for the newest readable checkpoint, or (0, None) if there is none."""
+    for seq in reversed(list_segments(directory, "checkpoint")):
+        try:
+            with open(segment_path(directory, "checkpoint", seq), "rb") as f:
+                return seq, pickle.loads(zlib.decompress(f.read()))
+        except Exception:
+            continue # Damaged checkpoint: fall back to the previous one
+    return 0, None
+
+
+def remove_segments_before(directory, seq):
+    """Deletes checkpoints and log segments made obsolete by checkpoint.<seq>."""
+    for kind in ("wal", "checkpoint"):
+        for old_seq in list_segments(directory, kind):
+            if old_seq < seq:
+                try:
+                    os.remove(segment_path(directory, kind, old_seq))
+                except OSError:
+                    pass
+
+
+class WriteAheadLog:
+    """
+    Append-only operation log with group commit.
+
+    append() only copies the encoded record into an in-memory buffer. A single
+    background flusher writes the buffer and calls fsync; every record appended
+    while one fsync is running is made durable by the next one, so many
+    concurrent commits share a single disk flush. Callers that need durability
+    (commits) block in wait_durable() until their record is on disk.
+
+    If set, on_durable(data) is called with the bytes of every write once they
+    are on disk, in log order (replication.py ships them to the followers).
+
+    A write or fsync that fails is cut off the segment again and its records
+    go back to the front of the buffer, so the next flush retries them in
+    order and nothing is counted as durable before it is on disk. Callers
+    waiting in wait_durable() at the time get the error instead of blocking.
+    """
+    def __init__(self, directory, seq, flush_interval):
+        self.directory = directory
+        self.seq = seq
+        self.flush_interval = flush_interval
+        self.bytes_since_checkpoint = 0
+
+        self._lock = Lock()
+        self._wakeup = Condition(self._lock)     # Signals the flusher
+        self._durable = Condition(self._lock)    # Signals waiters in wait_durable()
+        self._io_lock = Lock()                   # Held while writing to the segment file
+
+        self._buffer = bytearray()
+        self._last_lsn = 0       # Log sequence number of the newest appended record
+        self._durable_lsn = 0    # Newest record known to be on disk
+        self._flush_requested = False
+        self._closed = False
+        self._failures = 0       # Flushes that failed so far
+        self._error = None       # The last failure
+        self.on_durable = None
+
+        self._file = open(segment_path(directory, "wal", seq), "ab")
+        self._size = self._file.tell() # Bytes of the segment known to be on disk
+        self._flusher = Thread(target=self._flush_loop, name="wal-flusher", daemon=True)
+        self._flusher.start()
+
+    def append(self, record):
+        """Buffers one record and returns its log sequence number."""
+        frame = encode_record(record)
+        with self._lock:
+            self._buffer += frame
+            self._last_lsn += 1
+            self.bytes_since_checkpoint += len(frame)
+            return self._last_lsn
+
+    def wait_durable(self, lsn):
+        """
+        Blocks until the record with this sequence number has been fsynced.
+        Raises OSError if a flush fails meanwhile.
+        """
+        with self._lock:
+            failures = self._failures
+            while self._durable_lsn < lsn:
+                if self._closed:
+                    raise RuntimeError("Write-ahead log is closed.")
+                if self._failures != failures:
+                    raise OSError(f"Write-ahead log flush failed: {self._error}")
+                self._flush_requested = True
+                self._wakeup.notify()
+                self._durable.wait()
+
+    def flush(self):
+        """Writes and fsyncs everything appended so far (called by the flusher and on rotate/close)."""
+        with self._io_lock:
+            data, lsn = self._take_buffer()
+            if data:
+                self._write(data)
+            with self._lock:
+                self._durable_lsn = max(self._durable_lsn, lsn)
+                self._durable.notify_all()
+
+    def rotate(self, new_seq):
+        """Flushes the current segment and switches appends to wal.<new_seq>."""
+        with self._io_lock:
+            data, lsn = self._take_buffer()
+            self._write(data)
+            self._file.close()
+
+            self._file = open(segment_path(self.directory, "wal", new_seq), "ab")
+            self._size = 0
+            _fsync_directory(self.directory)
+            with self._lock:
+                self.seq = new_seq
+                self.bytes_since_checkpoint = 0
+                self._durable_lsn = max(self._durable_lsn, lsn)
+                self._durable.notify_all()
+
+    def _take_buffer(self):
+        """Removes and returns (buffered bytes, sequence number of their last record)."""
+        with self._lock:
+            data = self._buffer
+            self._buffer = bytearray()
+            self._flush_requested = False
+            return data, self._last_lsn
+
+    def _write(self, data):
+        """
+        Appends data to the segment and fsyncs it, then passes it to on_durable.
+        If that fails, undoes the write, puts data back in front of the buffer,
+        wakes the waiters with the error and raises it. The caller holds _io_lock.
+        """
+        try:
+            if data:
+                self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except (OSError, ValueError) as e:
+            self._discard_partial_write()
+            with self._lock:
+                self._buffer[:0] = data
+                self._failures += 1
+                self._error = e
+                self._durable.notify_all()
+            raise
+        self._size += len(data)
+        if data and self.on_durable is not None:
+            self.on_durable(bytes(data))
+
+    def _discard_partial_write(self):
+        """Truncates the segment back to its last durable byte and reopens it for appending."""
+        path = segment_path(self.directory, "wal", self.seq)
+        try:
+            self._file.close() # Drops what is left in the file object's own buffer
+        except (OSError, ValueError):
+            pass
+        try:
+            os.truncate(path, self._size)
+            self._file = open(path, "ab")
+        except OSError as e:
+            logger.error("[WAL] Could not reopen %s after a failed write: %s", path, e)
+
+    def close(self):
+        """Flushes outstanding records and stops the flusher thread."""
+        self.flush()
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+            self._durable.notify_all()
+        self._flusher.join(timeout=1)
+        with self._io_lock:
+            self._file.close()
+
+    def _flush_loop(self):
+        failing = False # Log a failing disk once, not on every retry
+        while True:
+            with self._lock:
+                if not self._flush_requested and not self._closed:
+                    self._wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+                self._flush_requested = False
+                pending = bool(self._buffer)
+            if pending:
+                try:
+                    self.flush()
+                except (OSError, ValueError) as e:
+                    if not failing:
+                        logger.error("[WAL] Flush failed, retrying until it succeeds: %s", e)
+                    failing = True
+                else:
+                    if failing:
+                        logger.info("[WAL] Flushing works again.")
+                    failing = False
\ No newline at end of file